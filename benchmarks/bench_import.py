@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Import-time budget
+#
+# Imports every module of pygazeanalyser in a fresh interpreter, and checks
+# that it stays within an import-time budget and does not load any of the
+# heavy optional libraries (matplotlib, pyarrow, numba), which are only
+# imported by the functions that need them. This keeps the worker processes
+# of the runner, which only run detectors, small and quick to start.
+#
+#	python benchmarks/bench_import.py [--budget 250] [--output results.json]
+#		[--compare baseline.json]
+#
+# Times are the best of --repeat imports, each in its own process, and do
+# not include numpy, which is imported before the timing starts. Loading a
+# heavy library always fails the check. Wall-clock times vary a lot with
+# the load of the machine, so the budget leaves ample headroom (the modules
+# import in 5-20 ms on an idle machine) and only catches gross regressions,
+# such as pyplot at module level (400-500 ms). Smaller ones, such as the
+# process pool at module level (about 50 ms), are reported by passing an
+# earlier results file with --compare, which flags the modules that became
+# more than --tolerance times slower (and at least --slack ms slower), as
+# in bench_suite. The exit status is 1 if any check fails.
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# libraries that no module may load at import time
+HEAVY = ('matplotlib', 'pyarrow', 'numba')
+
+PROBE = """
+import sys, time, json
+import numpy
+t0 = time.perf_counter()
+import %s
+seconds = time.perf_counter() - t0
+print(json.dumps({'seconds': seconds, 'heavy': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def modules():
+    package = os.path.join(ROOT, 'pygazeanalyser')
+    return ['pygazeanalyser.' + os.path.splitext(name)[0] for name in sorted(os.listdir(package))
+            if name.endswith('.py') and name != '__init__.py']
+
+
+def probe(module, repeat):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', PROBE % (module, HEAVY)], cwd=ROOT, env=env)
+        results.append(json.loads(out.decode().strip().splitlines()[-1]))
+    return {'module': module,
+            'seconds': min(r['seconds'] for r in results),
+            'heavy': results[0]['heavy']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the import time of the pygazeanalyser modules")
+    parser.add_argument('--budget', type=float, default=250.0, help="import-time budget per module in ms")
+    parser.add_argument('--repeat', type=int, default=3, help="number of imports per module, of which the best counts")
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    parser.add_argument('--compare', default=None, help="JSON results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help="slowdown factor over the baseline that counts as a regression")
+    parser.add_argument('--slack', type=float, default=20.0,
+                        help="slowdown in ms over the baseline below which no regression is reported")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = dict((r['module'], r['seconds']) for r in json.load(f)['modules'])
+
+    results = [probe(module, args.repeat) for module in modules()]
+    failed = []
+    for r in results:
+        over = 1000 * r['seconds'] > args.budget
+        old = baseline.get(r['module'])
+        slower = old is not None and r['seconds'] > args.tolerance * old and \
+            1000 * (r['seconds'] - old) > args.slack
+        print("%-32s %8.1f ms%s%s%s" % (r['module'], 1000 * r['seconds'], '  OVER BUDGET' if over else '',
+                                        '  SLOWER (%.1f ms before)' % (1000 * old) if slower else '',
+                                        ''.join('  loads %s' % m for m in r['heavy'])))
+        if over or slower or r['heavy']:
+            failed.append(r['module'])
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'budget_ms': args.budget, 'modules': results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
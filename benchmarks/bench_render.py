@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Rendering benchmark
+#
+# Draws a heatmap for the first trials of images.csv, once with a new figure
+# per trial (draw_heatmap, as in a plain loop over trials) and once with
+# gazeplotter.BatchRenderer, and reports the time per trial and the peak
+# resident memory of each. Every mode runs in its own process, so that the
+# peak memory of one mode does not hide that of another.
+#
+#	python benchmarks/bench_render.py [--trials N] [--output results.json]
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ('draw_heatmap', 'draw_heatmap_headless', 'batch_renderer')
+DISPSIZE = (1920, 1200)
+
+
+def load(datadir, ntrials):
+    from pygazeanalyser.detectors import fixation_detection_dd
+    from pygazeanalyser.icarereader import read_images, read_trial, trial_filename
+
+    trials = []
+    for participant, dataset, trial, image in read_images(os.path.join(datadir, 'images.csv')):
+        csvfile = trial_filename(datadir, participant, dataset, trial, image)
+        if not os.path.isfile(csvfile):
+            continue
+        Sfix, Efix = fixation_detection_dd(*read_trial(csvfile), table=True)
+        trials.append((Efix, os.path.splitext(csvfile)[0] + '.png'))
+        if len(trials) == ntrials:
+            break
+    return trials
+
+
+def run_mode(mode, datadir, ntrials):
+    import matplotlib
+    matplotlib.use('Agg')
+    from pygazeanalyser import gazeplotter
+
+    trials = load(datadir, ntrials)
+    t0 = time.perf_counter()
+    if mode == 'batch_renderer':
+        with gazeplotter.BatchRenderer() as renderer:
+            for Efix, imagefile in trials:
+                renderer.heatmap(Efix, DISPSIZE, imagefile=imagefile)
+    else:
+        for Efix, imagefile in trials:
+            fig = gazeplotter.draw_heatmap(Efix, DISPSIZE, imagefile=imagefile, headless=(mode == 'draw_heatmap_headless'))
+            gazeplotter.figure_to_array(fig)
+    seconds = time.perf_counter() - t0
+    return {'mode': mode,
+            'trials': len(trials),
+            'seconds': seconds,
+            'ms_per_trial': 1000.0 * seconds / max(1, len(trials)),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data', default=os.path.join(ROOT, 'data'), help="path to the data directory")
+    parser.add_argument('--trials', type=int, default=100, help="number of trials to render")
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    parser.add_argument('--mode', choices=MODES, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.mode is not None:
+        print(json.dumps(run_mode(args.mode, args.data, args.trials)))
+        return 0
+
+    results = []
+    for mode in MODES:
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--mode', mode,
+                                       '--data', args.data, '--trials', str(args.trials)])
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        results.append(result)
+        print("%-22s %5d trials  %8.1f ms/trial  peak RSS %7.1f MB" %
+              (mode, result['trials'], result['ms_per_trial'], result['peak_rss_mb']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmark suite
+#
+# Times the detectors and plotting functions on representative trials of the
+# ICARE data (the shortest and the longest trial, the trial with the most
+# missing samples, and a median-length trial of each task), and runs every
+# detector over the full corpus to report its throughput in samples per
+# second. The results, together with the commit and library versions, are
+# written to a JSON file; passing an earlier results file with --compare
+# reports the benchmarks that became slower.
+#
+#	python benchmarks/bench_suite.py [--output results.json] [--compare baseline.json]
+#
+# Times are the best of --repeat runs. The trial files are parsed before any
+# timing starts; missing samples are coded as 0.0, as the detectors expect.
+# Peak RSS is the peak of the whole process up to the end of a benchmark;
+# the corpus pass runs before the representative trials.
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DISPSIZE = (1920, 1200)
+
+
+def detectors():
+    from pygazeanalyser import detectors as d
+    return {'fixation_detection': d.fixation_detection,
+            'fixation_detection_dd': d.fixation_detection_dd,
+            'saccade_detection': d.saccade_detection,
+            'saccade_detection_ivt': d.saccade_detection_ivt,
+            'blink_detection': d.blink_detection,
+            'gap_detection': d.gap_detection}
+
+
+def load_corpus(datadir):
+    from pygazeanalyser.icarereader import list_trials, read_trial
+
+    trials = []
+    for participant, dataset, trial, image, path in list_trials(datadir):
+        x, y, t = read_trial(path)
+        nan = numpy.isnan(x) | numpy.isnan(y)
+        trials.append({'name': "%d/%s/%d" % (participant, dataset, trial),
+                       'dataset': dataset,
+                       'samples': (numpy.where(nan, 0.0, x), numpy.where(nan, 0.0, y), t),
+                       'p_nan': float(numpy.mean(nan)) if len(x) > 0 else 0.0})
+    return trials
+
+
+def representative(trials):
+    # shortest, longest, most missing data, and a median-length trial per task
+    chosen = {}
+    nonempty = [t for t in trials if len(t['samples'][0]) > 1]
+    length = lambda t: len(t['samples'][0])
+    chosen['short'] = min(nonempty, key=length)
+    chosen['long'] = max(nonempty, key=length)
+    chosen['nan_heavy'] = max(nonempty, key=lambda t: t['p_nan'])
+    for dataset in sorted(set(t['dataset'] for t in nonempty)):
+        task = sorted((t for t in nonempty if t['dataset'] == dataset), key=length)
+        chosen['task_' + dataset] = task[len(task) // 2]
+    return chosen
+
+
+def best_of(func, repeat):
+    seconds = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - t0)
+    return min(seconds)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_trials(chosen, repeat):
+    import matplotlib
+    matplotlib.use('Agg')
+    from pygazeanalyser import gazeplotter
+    from pygazeanalyser.detectors import fixation_detection_dd
+
+    results = []
+    for label, trial in sorted(chosen.items()):
+        x, y, t = trial['samples']
+        for name, detector in detectors().items():
+            seconds = best_of(lambda: detector(x, y, t), repeat)
+            results.append({'benchmark': name, 'trial': label, 'source': trial['name'], 'samples': len(x),
+                            'seconds': seconds, 'samples_per_sec': len(x) / seconds})
+        Sfix, Efix = fixation_detection_dd(x, y, t)
+        seconds = best_of(lambda: gazeplotter.parse_fixations(Efix), repeat)
+        results.append({'benchmark': 'parse_fixations', 'trial': label, 'source': trial['name'],
+                        'fixations': len(Efix), 'seconds': seconds})
+    # the plots are only timed on the median trial of every task
+    for label, trial in sorted(chosen.items()):
+        if not label.startswith('task_'):
+            continue
+        Sfix, Efix = fixation_detection_dd(*trial['samples'])
+        seconds = best_of(lambda: gazeplotter.figure_to_array(
+            gazeplotter.draw_heatmap(Efix, DISPSIZE, headless=True)), repeat)
+        results.append({'benchmark': 'draw_heatmap', 'trial': label, 'source': trial['name'],
+                        'fixations': len(Efix), 'seconds': seconds})
+    seconds = best_of(lambda: gazeplotter.gaussian(200, 200 / 6), repeat)
+    results.append({'benchmark': 'gaussian', 'trial': '200x200', 'seconds': seconds})
+    return results
+
+
+def run_corpus(trials):
+    results = []
+    nsamples = sum(len(t['samples'][0]) for t in trials)
+    for name, detector in detectors().items():
+        t0 = time.perf_counter()
+        for trial in trials:
+            detector(*trial['samples'])
+        seconds = time.perf_counter() - t0
+        results.append({'benchmark': name, 'trials': len(trials), 'samples': nsamples, 'seconds': seconds,
+                        'samples_per_sec': nsamples / seconds, 'peak_rss_mb': peak_rss_mb()})
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    import matplotlib
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': numpy.__version__, 'matplotlib': matplotlib.__version__, 'numba': numba_version,
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance):
+    # returns the benchmarks that are more than tolerance times slower than
+    # in the baseline
+    def keyed(res):
+        return dict(((r['benchmark'], r.get('trial', 'corpus')), r['seconds'])
+                    for r in res['trials'] + res['corpus'])
+    old, new = keyed(baseline), keyed(results)
+    slower = []
+    for key in sorted(set(old) & set(new)):
+        ratio = new[key] / old[key] if old[key] > 0 else float('inf')
+        print("%-24s %-18s %10.3f ms  %10.3f ms  x%.2f%s" % (key[0], key[1], 1000 * old[key], 1000 * new[key], ratio,
+                                                              '  SLOWER' if ratio > tolerance else ''))
+        if ratio > tolerance:
+            slower.append(key)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the detectors and plotters on the ICARE data")
+    parser.add_argument('--data', default=os.path.join(ROOT, 'data'), help="path to the data directory")
+    parser.add_argument('--repeat', type=int, default=5, help="number of runs per benchmark, of which the best counts")
+    parser.add_argument('--no-corpus', action='store_true', help="skip the full-corpus pass")
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    parser.add_argument('--compare', default=None, help="JSON results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="slowdown factor over the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    trials = load_corpus(args.data)
+    print("loaded %d trials in %.1f s" % (len(trials), time.perf_counter() - t0))
+    chosen = representative(trials)
+    # the corpus pass runs first, so that its peak RSS does not include the
+    # figures of the plotting benchmarks
+    results = {'environment': environment(),
+               'representative': dict((label, t['name']) for label, t in chosen.items()),
+               'loaded_rss_mb': peak_rss_mb(),
+               'corpus': [] if args.no_corpus else run_corpus(trials)}
+    results['trials'] = run_trials(chosen, args.repeat)
+    for r in results['trials']:
+        print("%-24s %-18s %10.3f ms" % (r['benchmark'], r['trial'], 1000 * r['seconds']))
+    for r in results['corpus']:
+        print("%-24s %-18s %10.3f s  %12.0f samples/s  peak RSS %7.1f MB" %
+              (r['benchmark'], 'corpus', r['seconds'], r['samples_per_sec'], r['peak_rss_mb']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# Fixation backend cross-check
+#
+# Runs fixation_detection with every backend ('python', 'numpy', 'numba'
+# and 'auto') on the trials of the ICARE data, and compares their events
+# with each other and with the sample loop that fixation_detection had
+# before it had backends. Events have to be identical, bit for bit.
+#
+#	python benchmarks/check_backends.py [--every 1] [--data data]
+#
+# Every trial is checked with missing samples coded as 0.0 and as NaN, for
+# each maxdist in MAXDIST. If numba is not installed, 'numba' and 'auto'
+# fall back on 'numpy', which is reported. The exit status is 1 if any trial
+# differs.
+
+import os
+import sys
+import argparse
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BACKENDS = ('python', 'numpy', 'numba', 'auto')
+MAXDIST = (5, 25, 60)
+
+
+def reference_fixations(x, y, time, missing=0.0, maxdist=25, mindur=50):
+    # the sample loop of fixation_detection before it had backends
+    from pygazeanalyser.detectors import remove_missing
+
+    x, y, time = remove_missing(x, y, time, missing)
+    fs = []
+    fe = []
+    fp = []
+    si = 0
+    fixstart = False
+    for i in range(1, len(x)):
+        squared_distance = ((x[si] - x[i]) ** 2 + (y[si] - y[i]) ** 2)
+        dist = 0.0
+        if squared_distance > 0:
+            dist = squared_distance ** 0.5
+        if dist <= maxdist and not fixstart:
+            si = 0 + i
+            fixstart = True
+            fs.append(i)
+        elif dist > maxdist and fixstart:
+            fixstart = False
+            if time[i - 1] - time[fs[-1]] >= mindur:
+                fe.append(i - 1)
+                fp.append(si)
+            else:
+                fs.pop(-1)
+            si = 0 + i
+        elif not fixstart:
+            si += 1
+    if len(fs) > len(fe):
+        fe.append(len(x) - 1)
+        fp.append(si)
+    fs, fe, fp = numpy.array(fs, dtype=int), numpy.array(fe, dtype=int), numpy.array(fp, dtype=int)
+    return numpy.column_stack([time[fs], time[fe], time[fe] - time[fs], x[fp], y[fp]]).reshape(-1, 5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the backends of fixation_detection")
+    parser.add_argument('--data', default=os.path.join(ROOT, 'data'), help="path to the data directory")
+    parser.add_argument('--every', type=int, default=1, help="check every n-th trial")
+    args = parser.parse_args(argv)
+
+    from pygazeanalyser import detectors
+    from pygazeanalyser.icarereader import list_trials, read_trial
+
+    if detectors._numba_fixation_loop() is None:
+        print("numba is not installed; 'numba' and 'auto' run the 'numpy' backend")
+
+    trials = []
+    for number, (participant, dataset, trial, image, path) in enumerate(list_trials(args.data)):
+        if number % args.every == 0:
+            trials.append(("%d/%s/%d" % (participant, dataset, trial), read_trial(path)))
+
+    differ = []
+    for coding, missing in (('0.0', 0.0), ('NaN', numpy.nan)):
+        for maxdist in MAXDIST:
+            failed = 0
+            for name, (x, y, t) in trials:
+                if coding == '0.0':
+                    nan = numpy.isnan(x) | numpy.isnan(y)
+                    x, y = numpy.where(nan, 0.0, x), numpy.where(nan, 0.0, y)
+                expected = reference_fixations(x, y, t, missing=missing, maxdist=maxdist)
+                for backend in BACKENDS:
+                    Sfix, Efix = detectors.fixation_detection(x, y, t, missing=missing, maxdist=maxdist,
+                                                              backend=backend)
+                    Efix = numpy.array(Efix, dtype=float).reshape(-1, 5)
+                    if not (numpy.array_equal(Efix, expected) and
+                            numpy.array_equal(numpy.array(Sfix, dtype=float).ravel(), expected[:, 0])):
+                        differ.append((name, coding, maxdist, backend))
+                        failed += 1
+            print("missing=%-4s maxdist=%-3d %5d trials x %d backends  %d differ" %
+                  (coding, maxdist, len(trials), len(BACKENDS), failed))
+    for name, coding, maxdist, backend in differ[:20]:
+        print("differs: %s missing=%s maxdist=%d backend=%s" % (name, coding, maxdist, backend))
+    return 1 if differ else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
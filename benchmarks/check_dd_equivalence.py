@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Dispersion detector equivalence check
+#
+# Runs fixation_detection_dd (and fixation_detection_dd_batch) on the trials
+# of the ICARE data, and compares their events with those of the original
+# pairwise implementation, which grows every window sample by sample and
+# measures its dispersion with detectors.get_max_dist_points and
+# detectors.get_max_dist. Both window modes are checked: 'samples' windows
+# against the original algorithm as it was, and 'time' windows against the
+# same algorithm with the window end found from the timestamps.
+#
+#	python benchmarks/check_dd_equivalence.py [--every 3] [--data data]
+#
+# Missing samples are coded as 0.0, as the original implementation only
+# removed samples equal to missing. The pairwise reference is slow, so only
+# every --every'th trial is checked by default (--every 1 for all). The exit
+# status is 1 if any trial differs.
+
+import os
+import sys
+import math
+import argparse
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# (maxdist, mindur, hz) settings that are checked
+SETTINGS = [(25, 50, 60), (35, 100, 60), (15, 150, 120)]
+WINDOWS = ('samples', 'time')
+
+
+def reference_dd(x, y, time, maxdist=25, mindur=50, missing=0.0, hz=60, window='samples'):
+    # the original pairwise fixation_detection_dd, with the 'time' window
+    # end added
+    from pygazeanalyser.detectors import get_max_dist_points, get_max_dist
+
+    keep = numpy.array((x == missing).astype(int) + (y == missing).astype(int) != 2)
+    x, y, time = x[keep], y[keep], time[keep]
+    Sfix = []
+    Efix = []
+    n = len(x)
+    si = 0
+    timeframe_points = mindur / 1000 * hz
+    while si < n:
+        if window == 'samples':
+            i = math.ceil(si + timeframe_points) + 1
+            if i >= n:
+                break
+        else:
+            i = int(numpy.searchsorted(time, time[si] + mindur, side='left')) + 1
+            if i > n:
+                break
+        points = numpy.array([[x[a], y[a]] for a in range(si, i)])
+        if get_max_dist_points(points) <= maxdist:
+            while i < n:
+                p = numpy.array([x[i], y[i]])
+                if not get_max_dist(points, p) <= maxdist:
+                    break
+                points = numpy.append(points, [p], axis=0)
+                i += 1
+            fix = numpy.average(points, axis=0)
+            Sfix.append([time[si]])
+            Efix.append([time[si], time[i - 1], time[i - 1] - time[si], fix[0], fix[1]])
+            si = i
+        else:
+            si += 1
+    return Sfix, Efix
+
+
+def same(a, b):
+    # events are compared as floats, so that numpy and Python scalars match
+    return all(numpy.array_equal(numpy.array(u, dtype=float), numpy.array(v, dtype=float)) for u, v in zip(a, b))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare fixation_detection_dd with the pairwise implementation")
+    parser.add_argument('--data', default=os.path.join(ROOT, 'data'), help="path to the data directory")
+    parser.add_argument('--every', type=int, default=3, help="check every n-th trial")
+    args = parser.parse_args(argv)
+
+    from pygazeanalyser.detectors import fixation_detection_dd, fixation_detection_dd_batch, concatenate_trials
+    from pygazeanalyser.icarereader import list_trials, read_trial
+
+    trials = []
+    for number, (participant, dataset, trial, image, path) in enumerate(list_trials(args.data)):
+        if number % args.every != 0:
+            continue
+        x, y, t = read_trial(path)
+        nan = numpy.isnan(x) | numpy.isnan(y)
+        trials.append(("%d/%s/%d" % (participant, dataset, trial),
+                       (numpy.where(nan, 0.0, x), numpy.where(nan, 0.0, y), t)))
+
+    differ = []
+    for window in WINDOWS:
+        for maxdist, mindur, hz in SETTINGS:
+            params = dict(maxdist=maxdist, mindur=mindur, hz=hz, window=window)
+            batch = fixation_detection_dd_batch(*concatenate_trials(s for name, s in trials), **params)
+            failed = 0
+            for (name, samples), batched in zip(trials, batch):
+                expected = reference_dd(*samples, **params)
+                result = fixation_detection_dd(*samples, **params)
+                if not (same(result, expected) and same(batched, expected)):
+                    differ.append((name, params))
+                    failed += 1
+            print("%-8s maxdist=%-3d mindur=%-4d hz=%-4d %5d trials  %d differ" %
+                  (window, maxdist, mindur, hz, len(trials), failed))
+    for name, params in differ[:20]:
+        print("differs: %s %s" % (name, params))
+    return 1 if differ else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
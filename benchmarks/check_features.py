@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Feature check against images.csv
+#
+# Runs compute_features on the ICARE data, and compares every column in
+# FEATURE_COLUMNS with the value that images.csv has for the same trial.
+# len and p_nan reproduce the file and have to be identical; the other
+# columns are only reported, as they do not reproduce it (see the header of
+# pygazeanalyser/features.py): switches differs on a few trials, and the
+# fixation counts depend on a detector and parameters that are not known.
+#
+#	python benchmarks/check_features.py [--data data] [--maxdist 25]
+#		[--mindur 50]
+#
+# Values are compared as floats, with NaN equal to NaN and to an empty
+# field. The exit status is 1 if len or p_nan differs on any trial.
+
+import os
+import sys
+import csv
+import math
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# columns that have to be identical to images.csv
+REPRODUCED = ('len', 'p_nan')
+
+
+def same(a, b):
+    a = float('nan') if a in ('', None) else float(a)
+    b = float('nan') if b in ('', None) else float(b)
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare compute_features with the columns of images.csv")
+    parser.add_argument('--data', default=os.path.join(ROOT, 'data'), help="path to the data directory")
+    parser.add_argument('--maxdist', type=float, default=25, help="maxdist of fixation_detection_dd")
+    parser.add_argument('--mindur', type=float, default=50, help="mindur of fixation_detection_dd")
+    args = parser.parse_args(argv)
+
+    from pygazeanalyser.features import compute_features, FEATURE_COLUMNS
+
+    with open(os.path.join(args.data, 'images.csv'), newline='') as f:
+        expected = dict(((int(row['participant']), row['dataset'], int(row['trial'])), row)
+                        for row in csv.DictReader(f))
+    rows = compute_features(args.data, maxdist=args.maxdist, mindur=args.mindur)
+
+    failed = False
+    for column in FEATURE_COLUMNS:
+        differ = [row for row in rows
+                  if not same(row[column], expected[(row['participant'], row['dataset'], row['trial'])][column])]
+        print("%-20s %5d trials  %5d differ%s" % (column, len(rows), len(differ),
+                                               '' if column in REPRODUCED else '  (reported only)'))
+        if column in REPRODUCED and differ:
+            failed = True
+            for row in differ[:20]:
+                print("differs: %d/%s/%d %s=%s, images.csv has %s" %
+                      (row['participant'], row['dataset'], row['trial'], column, row[column],
+                       expected[(row['participant'], row['dataset'], row['trial'])][column]))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Heatmap Aggregation
+#
+# Pools the fixations of many trials into one heatmap per key, e.g. per
+# (dataset, image) or per dataset. Every trial is added to a running float32
+# density map as soon as it is detected, so that memory scales with the
+# number of distinct keys instead of the total number of fixations.
+# Aggregators built on separate workers (or separate runs) are combined with
+# merge; as float32 addition depends on the order of the additions, maps
+# built from differently split trials are equal up to float32 rounding (a
+# relative difference in the order of 1e-6), not bit for bit. With one
+# worker, the trials are added in the order of images.csv.
+#
+# The maps are the sum of the Gaussian kernels that gazeplotter.draw_heatmap
+# draws, and can be shown with draw_display and imshow like any heatmap from
+# gazeplotter.compute_heatmap.
+
+import os
+
+import numpy
+
+from pygazeanalyser.detectors import fixation_detection_dd
+from pygazeanalyser.gazeplotter import parse_fixations, _heatmap
+from pygazeanalyser.runner import load_trials, map_shared, trial_grouping
+
+
+# # # # #
+# CONSTANTS
+
+NORMALIZATIONS = (None, 'trial', 'participant')
+
+
+class HeatmapAggregator(object):
+    """Running sum of fixation heatmaps, with one map per key
+
+	arguments
+
+	dispsize		-	tuple or list indicating the size of the display,
+				e.g. (1920,1200)
+
+	keyword arguments
+
+	durationweight	-	Boolean indicating whether the fixation duration is
+				to be taken into account as a weight (default = True)
+	gwh			-	width and height of the Gaussian kernel in pixels
+				(default = 200)
+	gsdwh		-	standard deviation of the Gaussian kernel in pixels,
+				or None for gwh/6 (default = None)
+	normalize		-	None to add up the kernels of all fixations, 'trial'
+				to scale the map of every trial to a sum of 1 before it
+				is added, so that every trial weighs equally, or
+				'participant' to scale the pooled map of every
+				participant to a sum of 1, so that every participant
+				weighs equally regardless of the number of trials and
+				fixations (default = None)
+
+	With normalize='participant', a map is kept for every participant of
+	every key, rather than one per key; the maps of a key are only
+	combined when heatmap is called.
+	"""
+
+    def __init__(self, dispsize, durationweight=True, gwh=200, gsdwh=None, normalize=None):
+        if normalize not in NORMALIZATIONS:
+            raise Exception("ERROR in HeatmapAggregator: normalize should be one of %s, not '%s'" %
+                            (NORMALIZATIONS, normalize))
+        self.dispsize = (int(dispsize[0]), int(dispsize[1]))
+        self.durationweight = durationweight
+        self.gwh = gwh
+        self.gsdwh = gwh/6 if gsdwh is None else gsdwh
+        self.normalize = normalize
+        # key -> float32 map, or key -> {participant: float32 map} when
+        # normalizing per participant
+        self.maps = {}
+        # key -> number of trials that were added
+        self.trials = {}
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __contains__(self, key):
+        return key in self.maps
+
+    def keys(self):
+        """Returns the keys of all maps, in the order they were first added"""
+        return list(self.maps.keys())
+
+    def add(self, key, fixations, participant=None):
+        """Adds the fixations of a single trial to the map of a key
+
+	arguments
+
+	key			-	any hashable, e.g. a (dataset, image) tuple
+	fixations		-	a list of fixation ending events from a single trial,
+				or an EventTable of fixations
+
+	keyword arguments
+
+	participant	-	the participant of the trial; required when
+				normalizing per participant (default = None)
+	"""
+        if self.normalize == 'participant' and participant is None:
+            raise Exception("ERROR in HeatmapAggregator.add: a participant is needed to normalize per participant")
+        fix = parse_fixations(fixations)
+        h, w = self.dispsize[1], self.dispsize[0]
+        if self.normalize == 'participant':
+            maps = self.maps.setdefault(key, {})
+            if participant not in maps:
+                maps[participant] = numpy.zeros((h, w), dtype=numpy.float32)
+            out = maps[participant]
+        else:
+            if key not in self.maps:
+                self.maps[key] = numpy.zeros((h, w), dtype=numpy.float32)
+            out = self.maps[key]
+        self.trials[key] = self.trials.get(key, 0) + 1
+
+        if self.normalize == 'trial':
+            heatmap = _heatmap(fix, self.dispsize, self.gwh, self.gsdwh, self.durationweight)
+            total = heatmap.sum()
+            if total > 0:
+                out += heatmap / total
+        else:
+            # add the kernels straight into the running map
+            _heatmap(fix, self.dispsize, self.gwh, self.gsdwh, self.durationweight, out=out)
+
+    def merge(self, other):
+        """Adds the maps of another aggregator with the same settings to
+        this one, e.g. the partial result of a worker; returns self. The
+        sums are in float32, so the result is equal to adding all trials to
+        one aggregator up to float32 rounding"""
+        if (other.dispsize, other.durationweight, other.gwh, other.gsdwh, other.normalize) != \
+                (self.dispsize, self.durationweight, self.gwh, self.gsdwh, self.normalize):
+            raise Exception("ERROR in HeatmapAggregator.merge: the aggregators have different settings")
+        for key, value in other.maps.items():
+            if self.normalize == 'participant':
+                maps = self.maps.setdefault(key, {})
+                for participant, m in value.items():
+                    if participant in maps:
+                        maps[participant] += m
+                    else:
+                        maps[participant] = m.copy()
+            elif key in self.maps:
+                self.maps[key] += value
+            else:
+                self.maps[key] = value.copy()
+            self.trials[key] = self.trials.get(key, 0) + other.trials[key]
+        return self
+
+    def heatmap(self, key):
+        """Returns the pooled map of a key, as a float32 numpy array of shape
+        (dispsize[1], dispsize[0]); with normalize='participant', this is
+        the average of the normalized maps of all participants"""
+        if key not in self.maps:
+            raise KeyError("no heatmap for key %s" % (key,))
+        if self.normalize != 'participant':
+            return self.maps[key].copy()
+        heatmap = numpy.zeros((self.dispsize[1], self.dispsize[0]), dtype=numpy.float32)
+        maps = self.maps[key]
+        for m in maps.values():
+            total = m.sum(dtype=float)
+            if total > 0:
+                heatmap += m / numpy.float32(total)
+        heatmap /= len(maps)
+        return heatmap
+
+    def participants(self, key):
+        """Returns the number of participants in the map of a key, or None
+        if the aggregator does not keep track of participants"""
+        if self.normalize != 'participant':
+            return None
+        return len(self.maps[key])
+
+
+def aggregate_heatmaps(datadir, dispsize, by=('dataset', 'image'), trials=None, store=None, workers=None,
+                       chunksize=16, detector=fixation_detection_dd, durationweight=True, gwh=200, gsdwh=None,
+                       normalize=None, **params):
+    """Detects the fixations of every trial and pools them into one heatmap
+    per dataset and image (or per any other combination of trial fields)
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+	dispsize	-	tuple or list indicating the size of the display,
+				e.g. (1920,1200)
+
+	keyword arguments
+
+	by		-	tuple of the trial fields that make up the key, out of
+				'participant', 'dataset', 'trial' and 'image'; e.g.
+				('dataset',) for one map per task
+				(default = ('dataset', 'image'))
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	store		-	SampleStore to read the samples from, or None
+				(default = None)
+	workers	-	number of detection processes, as in
+				runner.run_detection (default = None)
+	chunksize	-	number of trials that a worker folds into one partial
+				aggregator, which is merged into the result as soon as
+				it is done (default = 16)
+	detector	-	fixation detector (default = fixation_detection_dd)
+
+	durationweight, gwh, gsdwh and normalize are passed on to the
+	HeatmapAggregator, and all further keyword arguments to the detector
+
+	returns
+	aggregator	-	HeatmapAggregator with a map for every key
+	"""
+
+    trials, group = trial_grouping(datadir, by, trials, 'aggregate_heatmaps')
+
+    settings = dict(durationweight=durationweight, gwh=gwh, gsdwh=gsdwh, normalize=normalize)
+    keys, samples, offsets = load_trials(datadir, trials=trials, store=store)
+    entries = [(group(key), key[0]) for key in keys]
+    spans = list(zip(offsets[:-1], offsets[1:]))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # SERIAL
+    if workers <= 1 or len(keys) <= chunksize:
+        return _aggregate_chunk(samples, (spans, entries, detector, dispsize, settings, params))
+
+    # PARALLEL
+    # the trials are grouped by key (in the order in which the keys first
+    # occur, keeping the order of the trials within a key) and cut into
+    # chunks, so that a chunk only touches a few keys; every worker folds a
+    # chunk into a partial aggregator as it detects its trials, and only the
+    # partial maps are sent back, to be merged in the order of the chunks
+    first = {}
+    for key, participant in entries:
+        first.setdefault(key, len(first))
+    order = sorted(range(len(entries)), key=lambda i: first[entries[i][0]])
+    chunks = [order[s:s + chunksize] for s in range(0, len(order), max(1, chunksize))]
+    jobs = [([spans[i] for i in chunk], [entries[i] for i in chunk], detector, dispsize, settings, params)
+            for chunk in chunks]
+    aggregator = HeatmapAggregator(dispsize, **settings)
+    for partial in map_shared(_aggregate_chunk, samples, jobs, workers):
+        aggregator.merge(partial)
+    return aggregator
+
+
+def _aggregate_chunk(samples, job):
+    # detects the fixations of the trials in the (start, end) sample spans,
+    # and adds each trial to a new aggregator right away
+    spans, entries, detector, dispsize, settings, params = job
+    aggregator = HeatmapAggregator(dispsize, **settings)
+    for (key, participant), (s, e) in zip(entries, spans):
+        Sfix, Efix = detector(samples[0, s:e], samples[1, s:e], samples[2, s:e], table=True, **params)
+        aggregator.add(key, Efix, participant=participant)
+    return aggregator
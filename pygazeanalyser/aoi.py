@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Areas of Interest
+#
+# Assigns fixations to the regions of a stimulus, e.g. the shapes of an SVRT
+# image or the pawns of a Checkerboard, and derives dwell times, transitions
+# and switch counts from the sequence of regions. The regions of an image
+# are drawn into a label raster of the size of the stimulus, with one pixel
+# per display pixel, so that assigning any number of fixations is a single
+# lookup of their pixels in that raster, instead of a point-in-polygon test
+# per fixation and region:
+#	aoimap = AOIMap()
+#	aoimap.add_rectangle('left', 0, 0, 256, 512)
+#	aoimap.add_polygon('pawn', [(300, 100), (400, 100), (350, 200)])
+#	regions = aoimap.assign(Efix)
+#	dwell = dwell_times(regions, Efix['duration'], len(aoimap))
+# Region coordinates are relative to the top left of the stimulus area, as
+# the lines in images.csv, and fixations are in display coordinates.
+
+import numpy
+
+from pygazeanalyser.features import STIMULUS_RECT
+
+
+# # # # #
+# CONSTANTS
+
+# region of fixations that do not fall on any region
+OUTSIDE = -1
+
+
+class AOIMap(object):
+    """Regions of interest of a single stimulus, kept as a label raster
+
+	keyword arguments
+
+	rect		-	(left, top, width, height) of the stimulus area on the
+				display (default = STIMULUS_RECT)
+
+	Regions are numbered in the order in which they are added, starting at
+	0; names holds the name of every region. Where regions overlap, the
+	region that was added last is on top.
+	"""
+
+    def __init__(self, rect=STIMULUS_RECT):
+        self.rect = tuple(rect)
+        self.names = []
+        self.labels = numpy.full((int(rect[3]), int(rect[2])), OUTSIDE, dtype=numpy.int32)
+
+    @classmethod
+    def from_labels(cls, labels, names=None, rect=STIMULUS_RECT):
+        """Returns an AOIMap from a label image of the size of the stimulus
+        area, in which every distinct non-zero value is one region, as
+        added by add_labels"""
+        aoimap = cls(rect=rect)
+        aoimap.add_labels(labels, names=names)
+        return aoimap
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name):
+        """Returns the number of the region with a name"""
+        try:
+            return self.names.index(name)
+        except ValueError:
+            raise KeyError("no region '%s' in the AOI map" % name)
+
+    def add_rectangle(self, name, left, top, width, height):
+        """Adds a rectangular region, and returns its number"""
+        region = self._new_region(name)
+        l, t = max(0, int(round(left))), max(0, int(round(top)))
+        self.labels[t:max(t, int(round(top + height))), l:max(l, int(round(left + width)))] = region
+        return region
+
+    def add_polygon(self, name, vertices):
+        """Adds a polygon, given as a sequence of (x, y) vertices, and returns
+        its number; a pixel belongs to the polygon if its centre does, by
+        the even-odd rule"""
+        vertices = numpy.asarray(vertices, dtype=float).reshape(-1, 2)
+        region = self._new_region(name)
+        if len(vertices) < 3:
+            return region
+        # only the pixels in the bounding box of the polygon are tested, with
+        # one vectorised pass over those pixels for every edge
+        height, width = self.labels.shape
+        l = max(0, int(numpy.floor(vertices[:, 0].min())))
+        r = min(width, int(numpy.ceil(vertices[:, 0].max())) + 1)
+        t = max(0, int(numpy.floor(vertices[:, 1].min())))
+        b = min(height, int(numpy.ceil(vertices[:, 1].max())) + 1)
+        if l >= r or t >= b:
+            return region
+        px, py = numpy.meshgrid(numpy.arange(l, r) + 0.5, numpy.arange(t, b) + 0.5)
+        inside = numpy.zeros(px.shape, dtype=bool)
+        for (x1, y1), (x2, y2) in zip(vertices, numpy.roll(vertices, -1, axis=0)):
+            if y1 == y2:
+                continue
+            crosses = (py >= min(y1, y2)) & (py < max(y1, y2))
+            inside ^= crosses & (px < x1 + (py - y1) * (x2 - x1) / (y2 - y1))
+        self.labels[t:b, l:r][inside] = region
+        return region
+
+    def add_mask(self, name, mask):
+        """Adds a region from a boolean mask of the size of the stimulus
+        area, and returns its number"""
+        mask = numpy.asarray(mask, dtype=bool)
+        if mask.shape != self.labels.shape:
+            raise Exception("ERROR in AOIMap.add_mask: mask of shape %s does not match the stimulus area %s" %
+                            (mask.shape, self.labels.shape))
+        region = self._new_region(name)
+        self.labels[mask] = region
+        return region
+
+    def add_labels(self, labels, names=None):
+        """Adds a region for every distinct non-zero value of a label image
+        of the size of the stimulus area, e.g. a segmentation of the
+        stimulus, in the order of the values; names is a list with a name
+        for every value, or None to use the values as names"""
+        labels = numpy.asarray(labels)
+        if labels.shape != self.labels.shape:
+            raise Exception("ERROR in AOIMap.add_labels: labels of shape %s do not match the stimulus area %s" %
+                            (labels.shape, self.labels.shape))
+        values, inverse = numpy.unique(labels, return_inverse=True)
+        nonzero = numpy.flatnonzero(values != 0)
+        if names is None:
+            names = [values[i].item() for i in nonzero]
+        regions = numpy.full(len(values), OUTSIDE, dtype=numpy.int32)
+        for i, name in zip(nonzero, names):
+            regions[i] = self._new_region(name)
+        drawn = regions[inverse.reshape(labels.shape)]
+        self.labels[drawn != OUTSIDE] = drawn[drawn != OUTSIDE]
+        return [int(regions[i]) for i in nonzero]
+
+    def lookup(self, x, y):
+        """Returns the region of every point, as a numpy array of region
+        numbers with OUTSIDE for points (and NaN points) that do not fall on
+        any region
+
+	arguments
+
+	x		-	numpy array of x positions on the display
+	y		-	numpy array of y positions on the display
+	"""
+        px = numpy.floor(numpy.asarray(x, dtype=float) - self.rect[0])
+        py = numpy.floor(numpy.asarray(y, dtype=float) - self.rect[1])
+        height, width = self.labels.shape
+        # NaN compares False, so missing points are outside as well
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        regions = numpy.full(px.shape, OUTSIDE, dtype=numpy.int32)
+        regions[inside] = self.labels[py[inside].astype(int), px[inside].astype(int)]
+        return regions
+
+    def assign(self, Efix):
+        """Returns the region of every fixation in an Efix EventTable (or
+        list of Efix events), from its endx and endy"""
+        if hasattr(Efix, 'columns'):
+            return self.lookup(Efix['endx'], Efix['endy'])
+        events = numpy.array(Efix, dtype=float).reshape(-1, 5)
+        return self.lookup(events[:, 3], events[:, 4])
+
+    def _new_region(self, name):
+        if name in self.names:
+            raise Exception("ERROR in AOIMap: region '%s' already exists" % name)
+        self.names.append(name)
+        return len(self.names) - 1
+
+
+# # # # #
+# MEASURES
+
+def dwell_times(regions, durations, nregions):
+    """Returns the total fixation duration on every region
+
+	arguments
+
+	regions	-	numpy array with the region of every fixation, as
+				returned by AOIMap.assign
+	durations	-	numpy array with the duration of every fixation,
+				e.g. Efix['duration']
+	nregions	-	number of regions, e.g. len(aoimap)
+
+	returns
+	dwell		-	numpy array of nregions total durations; fixations
+				outside all regions are not counted
+	"""
+
+    regions = numpy.asarray(regions)
+    on = regions != OUTSIDE
+    return numpy.bincount(regions[on], weights=numpy.asarray(durations, dtype=float)[on], minlength=nregions)
+
+
+def transition_matrix(regions, nregions):
+    """Returns the number of transitions between every pair of regions
+
+	arguments
+
+	regions	-	numpy array with the region of every fixation, in the
+				order of the fixations
+	nregions	-	number of regions
+
+	returns
+	transitions	-	integer numpy array of shape (nregions, nregions), in
+				which [a, b] counts the consecutive fixations on region
+				a and then region b; fixations outside all regions are
+				skipped, and refixations of a region are on the
+				diagonal
+	"""
+
+    regions = numpy.asarray(regions)
+    regions = regions[regions != OUTSIDE]
+    pairs = regions[:-1] * nregions + regions[1:]
+    return numpy.bincount(pairs, minlength=nregions * nregions).reshape(nregions, nregions)
+
+
+def switch_count(regions):
+    """Returns the number of times that consecutive fixations lie on
+    different regions, skipping fixations outside all regions (as
+    features.line_switches skips points on the line)"""
+    regions = numpy.asarray(regions)
+    regions = regions[regions != OUTSIDE]
+    return int(numpy.count_nonzero(regions[1:] != regions[:-1]))
+
+
+def aoi_measures(Efix, aoimap):
+    """Returns the region of every fixation of a trial, and the measures
+    derived from them
+
+	arguments
+
+	Efix		-	EventTable or list of ending fixation events
+	aoimap	-	AOIMap of the trial's stimulus
+
+	returns
+	measures	-	dict with 'regions' (region of every fixation),
+				'dwell' (dwell time per region), 'fixations' (number
+				of fixations per region), 'transitions' (transition
+				matrix) and 'switches' (switch count)
+	"""
+
+    regions = aoimap.assign(Efix)
+    if hasattr(Efix, 'columns'):
+        durations = Efix['duration']
+    else:
+        durations = numpy.array(Efix, dtype=float).reshape(-1, 5)[:, 2]
+    nregions = len(aoimap)
+    return {'regions': regions,
+            'dwell': dwell_times(regions, durations, nregions),
+            'fixations': numpy.bincount(regions[regions != OUTSIDE], minlength=nregions),
+            'transitions': transition_matrix(regions, nregions),
+            'switches': switch_count(regions)}
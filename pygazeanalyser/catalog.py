@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Metadata Catalog
+#
+# Index of all trials in images.csv, joined with the scores of the session
+# (participant and dataset) that every trial belongs to in scores.csv. The
+# index is a numpy record array with one row per trial, so that trials can be
+# selected with a single mask, e.g. all correctly classified cr5 trials of
+# sessions in which the rule was solved:
+#	catalog = Catalog('data', cachefile='data/catalog.npz')
+#	rows = catalog.select(dataset='cr5', correct=True, solved=1)
+#	files = catalog.sample_files(rows)
+# Paths are built from the participant, dataset, trial and image of a row,
+# without listing any directories. With a cache file, the index is only
+# built from the CSV files when either of them changed since it was saved.
+
+import os
+import csv
+
+import numpy
+
+from pygazeanalyser.icarereader import trial_filename
+
+
+# # # # #
+# FORMAT
+
+# fields with a fixed type; all other columns of images.csv and scores.csv
+# are stored as floats, with NaN for empty values
+KEY_FIELDS = [	('participant', 'i4'),
+			('dataset', 'U16'),
+			('image', 'U64'),
+			('trial', 'i4'),
+			('true_value', 'i1'),
+			('pred_value', 'i1'),
+			('correct', '?')]
+# prefix of scores.csv columns whose name is also a column of images.csv
+SESSION_PREFIX = 'session_'
+
+
+class Catalog(object):
+    """Index of the trials of an ICARE data directory
+
+	arguments
+
+	datadir	-	path to the ICARE data directory, which contains
+				images.csv and scores.csv
+
+	keyword arguments
+
+	cachefile	-	path to a .npz file in which the index is kept between
+				runs, or None to build it every time (default = None)
+
+	The index is a numpy record array in the order of images.csv, with the
+	fields in KEY_FIELDS, where correct is whether true_value equals
+	pred_value, followed by all other columns of images.csv and then all
+	columns of the trial's session in scores.csv (NaN for trials without a
+	session).
+	"""
+
+    def __init__(self, datadir, cachefile=None):
+        self.datadir = datadir
+        self.index = None
+        fingerprint = _fingerprint(datadir)
+        if cachefile is not None and os.path.isfile(cachefile):
+            with numpy.load(cachefile) as cached:
+                if numpy.array_equal(cached['fingerprint'], fingerprint):
+                    self.index = cached['index']
+        if self.index is None:
+            self.index = build_index(datadir)
+            if cachefile is not None:
+                tmp = cachefile + '.tmp'
+                with open(tmp, 'wb') as f:
+                    numpy.savez(f, index=self.index, fingerprint=fingerprint)
+                os.replace(tmp, cachefile)
+        self._rows = {}
+        for row, entry in enumerate(self.index):
+            self._rows[(int(entry['participant']), str(entry['dataset']), int(entry['trial']))] = row
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return tuple(key) in self._rows
+
+    def fields(self):
+        """Returns the names of all fields of the index"""
+        return list(self.index.dtype.names)
+
+    def row(self, participant, dataset, trial):
+        """Returns the index row of a single trial"""
+        try:
+            return self.index[self._rows[(int(participant), dataset, int(trial))]]
+        except KeyError:
+            raise KeyError("no trial %s of participant %s on dataset %s in the catalog" %
+                           (trial, participant, dataset))
+
+    def select(self, rows=None, **criteria):
+        """Returns the index rows that meet all criteria
+
+	keyword arguments
+
+	rows		-	index rows to select from, or None for all trials
+				(default = None)
+
+	every further keyword argument is a field of the index, with either a
+	value that the field must equal, a list, tuple or set of allowed
+	values, or a function that takes the field's numpy array and returns
+	a boolean mask, e.g. select(dataset='cr5', participant=[3, 4],
+	accuracy=lambda a: a > 0.8)
+	"""
+        if rows is None:
+            rows = self.index
+        mask = numpy.ones(len(rows), dtype=bool)
+        for field, value in criteria.items():
+            if field not in rows.dtype.names:
+                raise KeyError("no field '%s' in the catalog" % field)
+            column = rows[field]
+            if callable(value):
+                mask &= numpy.asarray(value(column), dtype=bool)
+            elif isinstance(value, (list, tuple, set)):
+                mask &= numpy.isin(column, list(value))
+            else:
+                mask &= column == value
+        return rows[mask]
+
+    def trials(self, rows=None):
+        """Returns (participant, dataset, trial, image) tuples of the rows,
+        as taken by runner.run_detection and runner.load_trials"""
+        if rows is None:
+            rows = self.index
+        return [(int(r['participant']), str(r['dataset']), int(r['trial']), str(r['image'])) for r in rows]
+
+    def sample_files(self, rows=None):
+        """Returns the paths of the sample files of the rows; files of
+        trials without samples do not exist"""
+        return [trial_filename(self.datadir, *trial) for trial in self.trials(rows)]
+
+    def image_files(self, rows=None):
+        """Returns the paths of the stimulus images of the rows, which are
+        stored next to the sample files"""
+        return [os.path.splitext(f)[0] + '.png' for f in self.sample_files(rows)]
+
+
+def build_index(datadir):
+    """Returns the index of a Catalog, read from images.csv and scores.csv
+	in datadir"""
+
+    with open(os.path.join(datadir, 'images.csv'), newline='') as f:
+        reader = csv.DictReader(f)
+        images = list(reader)
+        imagefields = [c for c in reader.fieldnames if c != '']
+    with open(os.path.join(datadir, 'scores.csv'), newline='') as f:
+        reader = csv.DictReader(f)
+        sessions = dict(((int(r['participant']), r['dataset']), r) for r in reader)
+        scorefields = [c for c in reader.fieldnames if c not in ('', 'participant', 'dataset')]
+
+    keys = [name for name, dtype in KEY_FIELDS]
+    extra = [c for c in imagefields if c not in keys]
+    scorenames = [SESSION_PREFIX + c if c in imagefields or c in keys else c for c in scorefields]
+    dtype = numpy.dtype(KEY_FIELDS + [(c, 'f8') for c in extra + scorenames])
+
+    index = numpy.zeros(len(images), dtype=dtype)
+    for row, r in enumerate(images):
+        session = sessions.get((int(r['participant']), r['dataset']), {})
+        index[row] = tuple([int(r['participant']), r['dataset'], r['image'], int(r['trial']),
+                            int(r['true_value']), int(r['pred_value']), r['true_value'] == r['pred_value']]
+                           + [_float(r[c]) for c in extra] + [_float(session.get(c, '')) for c in scorefields])
+    return index
+
+
+def _float(value):
+    # CSV value to float, with NaN for empty values
+    return float(value) if value != '' else numpy.nan
+
+
+def _fingerprint(datadir):
+    # size and modification time of the CSV files the index is built from
+    fingerprint = []
+    for name in ('images.csv', 'scores.csv'):
+        stat = os.stat(os.path.join(datadir, name))
+        fingerprint.extend([stat.st_size, stat.st_mtime_ns])
+    return numpy.array(fingerprint, dtype=numpy.int64)
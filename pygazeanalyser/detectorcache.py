@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Detector Cache
+#
+# Persistent cache of the results of the detectors (and any other function
+# that returns events or arrays), so that rerunning an analysis on the same
+# data with the same parameters reads the events from disk instead of
+# detecting them again:
+#	cache = DetectorCache('cache', maxsize=2**30)
+#	detector = cache.wrap(fixation_detection_dd)
+#	Sfix, Efix = detector(x, y, time, maxdist=25)
+#	results = run_detection(detector, 'data')
+#	print(cache.stats())
+#
+# A result is stored under the SHA-256 of the function's name and code and
+# of its positional and keyword arguments, with arrays hashed by their
+# dtype, shape and contents, so that changed data or parameters never return
+# a stale result. The code is that of the function and of the functions of
+# its module that it calls, with their default values, so that changes to a
+# detector do not return stale results either; changes elsewhere (e.g. in
+# numpy) do not count, and require clear(). Every result is one uncompressed .npz file with an array per
+# returned value (per column for event lists), which keeps the dtypes of
+# the values. An SQLite index keeps the size and last use of every file,
+# and the hit and miss counts; when the files exceed maxsize bytes, the
+# least recently used ones are removed. Files are written to a temporary
+# name and then renamed, and the index is only changed in SQLite
+# transactions, so any number of processes (e.g. the workers of
+# runner.run_detection) can share a cache.
+
+import os
+import json
+import time
+import types
+import inspect
+import sqlite3
+import hashlib
+import functools
+
+import numpy
+
+from pygazeanalyser.events import EventTable
+
+
+# # # # #
+# FORMAT
+
+# changes whenever the file format changes, so that old files are not read
+CACHE_VERSION = 2
+
+
+class DetectorCache(object):
+    """On-disk cache of detector results
+
+	arguments
+
+	cachedir	-	path to the directory of the cache; created if it does
+				not exist
+
+	keyword arguments
+
+	maxsize	-	maximal total size of the cached results in bytes, or
+				None for no limit (default = 1073741824, i.e. 1 GB)
+
+	Results that are a tuple of EventTables, event lists (lists of
+	equally long lists of numbers) and numpy arrays are cached, with the
+	dtypes of their values; the values of cached event lists are Python
+	scalars, where the detector may have returned numpy scalars. Other
+	results are returned without being cached.
+	"""
+
+    def __init__(self, cachedir, maxsize=1 << 30):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir, exist_ok=True)
+        self._db = None
+        self._pid = None
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, used REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+            db.executemany("INSERT OR IGNORE INTO stats VALUES (?, 0)", [(n,) for n in ('hits', 'misses', 'evictions')])
+
+    def __getstate__(self):
+        # the SQLite connection is opened again in every process
+        return {'cachedir': self.cachedir, 'maxsize': self.maxsize}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._db = None
+        self._pid = None
+
+    def wrap(self, detector):
+        """Returns a cached version of a detector, which can be called like
+        the detector and sent to worker processes (e.g. passed to
+        runner.run_detection)"""
+        return CachedDetector(detector, self)
+
+    def call(self, detector, *args, **kwargs):
+        """Returns detector(*args, **kwargs), from the cache if it was
+        computed before"""
+        key = self.key(detector, args, kwargs)
+        result = self.get(key)
+        if result is not None:
+            return result
+        result = detector(*args, **kwargs)
+        self.put(key, result)
+        return result
+
+    def key(self, detector, args, kwargs):
+        """Returns the cache key of a call"""
+        h = hashlib.sha256()
+        h.update(json.dumps([CACHE_VERSION, detector.__module__, detector.__name__]).encode())
+        h.update(_fingerprint(detector).encode())
+        for arg in args:
+            _hash_value(h, arg)
+        # keyword arguments are hashed like the positional ones, so that
+        # array arguments count with their full contents
+        for name in sorted(kwargs):
+            h.update(("\0%s=" % name).encode())
+            _hash_value(h, kwargs[name])
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns the cached result of a key, or None"""
+        try:
+            with numpy.load(self._filename(key)) as stored:
+                result = _decode(stored)
+        except (OSError, ValueError, KeyError):
+            with self._connection() as db:
+                db.execute("UPDATE stats SET value = value + 1 WHERE name = 'misses'")
+            return None
+        with self._connection() as db:
+            db.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+            db.execute("UPDATE stats SET value = value + 1 WHERE name = 'hits'")
+        return result
+
+    def put(self, key, result):
+        """Stores a result under a key, unless it can not be encoded; returns
+        whether it was stored"""
+        arrays = _encode(result)
+        if arrays is None:
+            return False
+        filename = self._filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.replace(tmp, filename)
+        with self._connection() as db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, os.path.getsize(filename), time.time()))
+        self._evict()
+        return True
+
+    def stats(self):
+        """Returns a dict with the number of hits, misses and evictions
+        since the cache was created (or reset_stats was called), over all
+        processes, and the number of entries and their total size in
+        bytes"""
+        db = self._connection()
+        stats = dict(db.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        stats.update({'entries': entries, 'bytes': size})
+        return stats
+
+    def reset_stats(self):
+        """Sets the hit, miss and eviction counts to zero"""
+        with self._connection() as db:
+            db.execute("UPDATE stats SET value = 0")
+
+    def clear(self):
+        """Removes all cached results"""
+        with self._connection() as db:
+            keys = [k for (k,) in db.execute("SELECT key FROM entries").fetchall()]
+            db.execute("DELETE FROM entries")
+        for key in keys:
+            _remove(self._filename(key))
+
+    def _evict(self):
+        # removes the least recently used results until the total size is
+        # within maxsize
+        if self.maxsize is None:
+            return
+        with self._connection() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.maxsize:
+                return
+            removed = []
+            for key, size in db.execute("SELECT key, size FROM entries ORDER BY used").fetchall():
+                if total <= self.maxsize:
+                    break
+                removed.append(key)
+                total -= size
+            db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in removed])
+            db.execute("UPDATE stats SET value = value + ? WHERE name = 'evictions'", (len(removed),))
+        for key in removed:
+            _remove(self._filename(key))
+
+    def _filename(self, key):
+        return os.path.join(self.cachedir, key[:2], key + '.npz')
+
+    def _connection(self):
+        # one connection per process; the timeout makes concurrent writers
+        # wait for each other instead of failing
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(os.path.join(self.cachedir, 'index.sqlite'), timeout=60)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._db
+
+
+class CachedDetector(object):
+    """A detector whose results are taken from a DetectorCache; see
+    DetectorCache.wrap"""
+
+    def __init__(self, detector, cache):
+        self.detector = detector
+        self.cache = cache
+        self.__name__ = detector.__name__
+        self.__module__ = detector.__module__
+        self.__doc__ = detector.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.cache.call(self.detector, *args, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def _fingerprint(function):
+    # SHA-256 of the code and default values of a function and of the
+    # functions of its module that it refers to, or '' for callables that
+    # are not functions
+    function = inspect.unwrap(function)
+    if not isinstance(function, types.FunctionType):
+        return ''
+    h = hashlib.sha256()
+    seen = set()
+    todo = [function]
+    while todo:
+        f = inspect.unwrap(todo.pop())
+        if f in seen:
+            continue
+        seen.add(f)
+        h.update(repr((f.__name__, f.__defaults__, f.__kwdefaults__)).encode())
+        codes = [f.__code__]
+        while codes:
+            code = codes.pop()
+            h.update(code.co_code)
+            for const in code.co_consts:
+                if isinstance(const, types.CodeType):
+                    codes.append(const)
+                elif isinstance(const, frozenset):
+                    # sets of strings have a different order in every process
+                    h.update(repr(sorted(const, key=repr)).encode())
+                else:
+                    h.update(repr(const).encode())
+            # functions of the same module that the code refers to by name
+            for name in code.co_names:
+                value = f.__globals__.get(name)
+                if isinstance(value, types.FunctionType) and value.__module__ == function.__module__:
+                    todo.append(value)
+    return h.hexdigest()
+
+
+def _hash_value(h, value):
+    # adds an argument to a hash: arrays, lists and tuples with their dtype,
+    # shape and bytes, and anything else with its repr
+    if isinstance(value, (numpy.ndarray, list, tuple)):
+        value = numpy.ascontiguousarray(value)
+        if value.dtype != object:
+            h.update(("%s%s" % (value.dtype.str, value.shape)).encode())
+            h.update(value.tobytes())
+            return
+        value = value.tolist()
+    h.update(repr(value).encode())
+
+
+def _encode(result):
+    # the values of a result as arrays, with their kinds; None for results
+    # that are not a tuple of EventTables, event lists and arrays. Event
+    # lists are stored column by column, so that every column keeps its
+    # dtype (e.g. integer timestamps)
+    if not isinstance(result, tuple):
+        return None
+    arrays = {'kinds': numpy.array([], dtype='U8')}
+    kinds = []
+    for i, value in enumerate(result):
+        if isinstance(value, EventTable):
+            kinds.append('table')
+            arrays['columns%d' % i] = numpy.array(value.columns)
+            arrays['value%d' % i] = value.data
+        elif isinstance(value, numpy.ndarray):
+            kinds.append('array')
+            arrays['value%d' % i] = value
+        elif isinstance(value, list) and all(isinstance(event, list) for event in value):
+            width = len(value[0]) if value else 0
+            if any(len(event) != width for event in value):
+                return None
+            kinds.append('list')
+            arrays['width%d' % i] = numpy.array(width)
+            for column in range(width):
+                arrays['value%d_%d' % (i, column)] = numpy.array([event[column] for event in value])
+        else:
+            return None
+    if any(array.dtype == object for array in arrays.values()):
+        return None
+    arrays['kinds'] = numpy.array(kinds, dtype='U8')
+    return arrays
+
+
+def _decode(stored):
+    # the result of a file written by _encode
+    result = []
+    for i, kind in enumerate(stored['kinds']):
+        if kind == 'table':
+            result.append(EventTable([str(c) for c in stored['columns%d' % i]], stored['value%d' % i]))
+        elif kind == 'array':
+            result.append(stored['value%d' % i])
+        else:
+            columns = [stored['value%d_%d' % (i, column)].tolist() for column in range(int(stored['width%d' % i]))]
+            result.append([list(event) for event in zip(*columns)])
+    return tuple(result)
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -37,13 +37,17 @@
 
 __author__ = "Edwin Dalmaijer"
 
-import math
 import numpy
 
 from itertools import combinations
 
+from pygazeanalyser.profiling import timed, arg_length
+from pygazeanalyser.events import EventTable, START_COLUMNS, FIXATION_COLUMNS, SACCADE_COLUMNS, BLINK_COLUMNS, \
+    GAP_COLUMNS
 
-def blink_detection(x, y, time, missing=0.0, minlen=10):
+
+@timed('blink_detection', items=arg_length)
+def blink_detection(x, y, time, missing=0.0, minlen=10, table=False):
     """Detects blinks, defined as a period of missing data that lasts for at
 	least a minimal amount of samples
 	
@@ -58,6 +62,8 @@ def blink_detection(x, y, time, missing=0.0, minlen=10):
 	missing	-	value to be used for missing data (default = 0.0)
 	minlen	-	integer indicating the minimal amount of consecutive
 				missing samples
+	table	-	Boolean indicating whether the events are to be returned
+				as EventTables instead of lists (default = False)
 	
 	returns
 	Sblk, Eblk
@@ -65,52 +71,172 @@ def blink_detection(x, y, time, missing=0.0, minlen=10):
 				Eblk	-	list of lists, each containing [starttime, endtime, duration]
 	"""
 
-    # empty list to contain data
-    Sblk = []
-    Eblk = []
-
-    # check where the missing samples are
-    mx = numpy.array(x == missing, dtype=int)
-    my = numpy.array(y == missing, dtype=int)
-    miss = numpy.array((mx + my) == 2, dtype=int)
-
-    # check where the starts and ends are (+1 to counteract shift to left)
-    diff = numpy.diff(miss)
-    starts = numpy.where(diff == 1)[0] + 1
-    ends = numpy.where(diff == -1)[0] + 1
-
-    # compile blink starts and ends
-    for i in range(len(starts)):
-        # get starting index
-        s = starts[i]
-        # get ending index
-        if i < len(ends):
-            e = ends[i]
-        elif len(ends) > 0:
-            e = ends[-1]
-        else:
-            e = -1
-        # append only if the duration in samples is equal to or greater than
-        # the minimal duration
-        if e - s >= minlen:
-            # add starting time
-            Sblk.append([time[s]])
-            # add ending time
-            Eblk.append([time[s], time[e], time[e] - time[s]])
-
-    return Sblk, Eblk
-
-
-def remove_missing(x, y, time, missing):
-    mx = numpy.array(x == missing, dtype=int)
-    my = numpy.array(y == missing, dtype=int)
-    x = x[(mx + my) != 2]
-    y = y[(mx + my) != 2]
-    time = time[(mx + my) != 2]
+    # runs of missing samples, including those at the start or end of the
+    # trial; a blink ends at the first valid sample after it, or at the last
+    # sample of the trial
+    bs, be = _runs(_missing_mask(x, y, missing))
+    # keep only blinks of at least minlen samples
+    keep = be - bs >= minlen
+    bs = bs[keep]
+    be = numpy.minimum(be[keep], len(time) - 1)
+    return _event_output(time[bs], BLINK_COLUMNS,
+                         [time[bs], time[be], time[be] - time[bs]], table)
+
+
+@timed('gap_detection', items=arg_length)
+def gap_detection(x, y, time, missing=0.0, minlen=50, maxlen=None, maxinterval=None, table=False):
+    """Detects blinks and periods of data loss in a single pass; blinks are
+	runs of missing samples that last for a minimal amount of time, gaps
+	are all runs of missing samples as well as intervals between samples
+	that are longer than expected from the sampling rate
+
+	arguments
+
+	x		-	numpy array of x positions
+	y		-	numpy array of y positions
+	time		-	numpy array of tracker timestamps in milliseconds
+
+	keyword arguments
+
+	missing	-	value to be used for missing data; NaN is always
+				considered missing (default = 0.0)
+	minlen	-	minimal duration of blinks in milliseconds (default = 50)
+	maxlen	-	maximal duration of blinks in milliseconds, so that
+				longer periods of data loss are not reported as
+				blinks, or None for no maximum (default = None)
+	maxinterval	-	longest interval between consecutive samples in
+				milliseconds that is not data loss, or None for 1.5
+				times the median interval (default = None)
+	table	-	Boolean indicating whether the events are to be returned
+				as EventTables instead of lists (default = False)
+
+	returns
+	Sblk, Eblk, Egap
+				Sblk	-	list of lists, each containing [starttime]
+				Eblk	-	list of lists, each containing [starttime, endtime, duration]
+				Egap	-	list of lists, each containing [starttime, endtime, duration, samples],
+						where samples is the number of missing samples in
+						the gap; the percentage of missing samples in a
+						trial is 100 * sum(samples) / len(x)
+	"""
+    time = numpy.asarray(time, dtype=float)
+    n = len(time)
+    miss = _missing_mask(x, y, missing)
+
+    # BLINKS
+    # runs of missing samples, ending at the first valid sample after the
+    # run, or at the last sample of the trial
+    bs, be = _runs(miss)
+    be = numpy.minimum(be, n - 1)
+    dur = time[be] - time[bs]
+    keep = dur >= minlen
+    if maxlen is not None:
+        keep &= dur <= maxlen
+    bs, be = bs[keep], be[keep]
+    Sblk, Eblk = _event_output(time[bs], BLINK_COLUMNS, [time[bs], time[be], time[be] - time[bs]], table)
+
+    # GAPS
+    # the interval from sample i to i+1 is lost when sample i is missing, or
+    # when it is too long; the last sample has an empty interval
+    interval = numpy.append(numpy.diff(time), 0.0)
+    if maxinterval is None:
+        maxinterval = 1.5 * numpy.median(interval[:-1]) if n > 1 else numpy.inf
+    gs, ge = _runs(miss | (interval > maxinterval))
+    ge = numpy.minimum(ge, n - 1)
+    nmiss = numpy.concatenate(([0], numpy.cumsum(miss)))
+    # a run that ends at the trial end includes the last sample
+    samples = nmiss[numpy.where(ge == n - 1, n, ge)] - nmiss[gs]
+    Sgap, Egap = _event_output(time[gs], GAP_COLUMNS, [time[gs], time[ge], time[ge] - time[gs], samples], table)
+
+    return Sblk, Eblk, Egap
+
+
+def _missing_mask(x, y, missing):
+    # samples are missing when both coordinates have the missing value, or
+    # when either is NaN
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    return ((x == missing) & (y == missing)) | numpy.isnan(x) | numpy.isnan(y)
+
+
+@timed('remove_missing', items=arg_length)
+def remove_missing(x, y, time, missing=0.0, return_index=False):
+    """Removes the missing samples, i.e. those of which both coordinates have
+    the missing value, or either coordinate is NaN
+
+	arguments
+
+	x		-	numpy array of x positions
+	y		-	numpy array of y positions
+	time		-	numpy array of timestamps
+
+	keyword arguments
+
+	missing	-	value to be used for missing data (default = 0.0)
+	return_index	-	Boolean indicating whether the indices of the kept
+				samples in the original arrays are to be returned as
+				well, to relate the indices of events to the raw data
+				(default = False)
+
+	returns
+	x, y, time (, index)
+	"""
+
+    keep = ~_missing_mask(x, y, missing)
+    x, y, time = numpy.compress(keep, x), numpy.compress(keep, y), numpy.compress(keep, time)
+    if return_index:
+        return x, y, time, numpy.flatnonzero(keep)
     return x, y, time
 
 
-def fixation_detection(x, y, time, missing=0.0, maxdist=25, mindur=50):
+@timed('remove_missing', items=arg_length)
+def remove_missing_samples(samples, missing=0.0, return_index=False, out=None):
+    """Removes the missing samples from a stacked array of x, y and time, in
+    a single pass over all three rows; see remove_missing
+
+	arguments
+
+	samples	-	numpy array of shape (3, n) with x, y and time, e.g. as
+				returned by runner.load_trials
+
+	keyword arguments
+
+	missing	-	value to be used for missing data (default = 0.0)
+	return_index	-	Boolean indicating whether the indices of the kept
+				samples are to be returned as well (default = False)
+	out		-	numpy array of shape (3, m) with m >= n to write the
+				kept samples into, which may be samples itself to
+				filter it in place, or None for a new array
+				(default = None)
+
+	returns
+	samples (, index)
+				samples	-	numpy array of shape (3, k) with the k kept
+						samples; a view into out if it was given
+	"""
+
+    samples = numpy.asarray(samples)
+    keep = ~_missing_mask(samples[0], samples[1], missing)
+    index = numpy.flatnonzero(keep)
+    if out is None:
+        kept = samples.take(index, axis=1)
+    else:
+        # forward compaction, one block at a time: a kept sample never moves
+        # to a later position (index[j] >= j), so the block written to
+        # [j, j + step) is gathered from positions at or after j, which no
+        # earlier block has overwritten; only a block is buffered, where a
+        # single take into overlapping memory would copy all samples first
+        kept = out[:, :len(index)]
+        step = 1 << 16
+        for j in range(0, len(index), step):
+            kept[:, j:j + step] = samples[:, index[j:j + step]]
+    if return_index:
+        return kept, index
+    return kept
+
+
+@timed('fixation_detection', items=arg_length)
+def fixation_detection(x, y, time, missing=0.0, maxdist=25, mindur=50, table=False, backend='auto'):
     """Detects fixations, defined as consecutive samples with an inter-sample
 	distance of less than a set amount of pixels (disregarding missing data)
 	
@@ -127,6 +253,14 @@ def fixation_detection(x, y, time, missing=0.0, maxdist=25, mindur=50):
 	mindur	-	minimal duration of a fixation in milliseconds; detected
 				fixation cadidates will be disregarded if they are below
 				this duration (default = 100)
+	table	-	Boolean indicating whether the events are to be returned
+				as EventTables instead of lists (default = False)
+	backend	-	implementation of the sample loop: 'python' for a plain
+				loop, 'numpy' for a search over chunks of samples,
+				'numba' for the plain loop compiled with numba (which
+				falls back to 'numpy' if numba is not installed), or
+				'auto' for 'numba' (default = 'auto'); all backends
+				detect exactly the same fixations
 	
 	returns
 	Sfix, Efix
@@ -135,15 +269,47 @@ def fixation_detection(x, y, time, missing=0.0, maxdist=25, mindur=50):
 	"""
 
     x, y, time = remove_missing(x, y, time, missing)
-
-    # empty list to contain data
-    Sfix = []
-    Efix = []
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+
+    # indices of fixation starts, ends and of the fixated sample, and whether
+    # the last fixation was still running at the end of the trial
+    if backend in ('auto', 'numba'):
+        loop = _numba_fixation_loop()
+        if loop is None:
+            backend = 'numpy'
+    if backend in ('auto', 'numba'):
+        fs, fe, fp, running = loop(x, y, float(maxdist))
+    elif backend == 'numpy':
+        fs, fe, fp, running = _fixation_search(x, y, maxdist)
+    elif backend == 'python':
+        fs, fe, fp, running = _fixation_loop(x, y, maxdist)
+    else:
+        raise Exception("ERROR in fixation_detection: unknown backend '%s'" % backend)
+
+    # only keep the fixations that lasted long enough; a fixation that runs
+    # until the end of the trial is always kept
+    keep = time[fe] - time[fs] >= mindur
+    if running:
+        keep[-1] = True
+    fs, fe, fp = fs[keep], fe[keep], fp[keep]
+    return _event_output(time[fs], FIXATION_COLUMNS,
+                         [time[fs], time[fe], time[fe] - time[fs], x[fp], y[fp]], table)
+
+
+def _fixation_loop(x, y, maxdist):
+    # sample loop of fixation_detection; also compiled by numba, so it only
+    # uses scalar operations on preallocated arrays
+    n = len(x)
+    fs = numpy.zeros(n, dtype=numpy.int64)
+    fe = numpy.zeros(n, dtype=numpy.int64)
+    fp = numpy.zeros(n, dtype=numpy.int64)
+    k = 0
 
     # loop through all coordinates
     si = 0
     fixstart = False
-    for i in range(1, len(x)):
+    for i in range(1, n):
         # calculate Euclidean distance from the current fixation coordinate
         # to the next coordinate
         squared_distance = ((x[si] - x[i]) ** 2 + (y[si] - y[i]) ** 2)
@@ -155,26 +321,116 @@ def fixation_detection(x, y, time, missing=0.0, maxdist=25, mindur=50):
             # start a new fixation
             si = 0 + i
             fixstart = True
-            Sfix.append([time[i]])
+            fs[k] = i
         elif dist > maxdist and fixstart:
             # end the current fixation
             fixstart = False
-            # only store the fixation if the duration is ok
-            if time[i - 1] - Sfix[-1][0] >= mindur:
-                Efix.append([Sfix[-1][0], time[i - 1], time[i - 1] - Sfix[-1][0], x[si], y[si]])
-            # delete the last fixation start if it was too short
-            else:
-                Sfix.pop(-1)
+            fe[k] = i - 1
+            fp[k] = si
+            k += 1
             si = 0 + i
         elif not fixstart:
             si += 1
     # add last fixation end (we can lose it if dist > maxdist is false for the last point)
-    if len(Sfix) > len(Efix):
-        Efix.append([Sfix[-1][0], time[len(x) - 1], time[len(x) - 1] - Sfix[-1][0], x[si], y[si]])
-    return Sfix, Efix
+    if fixstart:
+        fe[k] = n - 1
+        fp[k] = si
+        k += 1
+    return fs[:k], fe[:k], fp[:k], fixstart
+
 
+_NUMBA_LOOP = []
 
-def fixation_detection_dd(x, y, time, maxdist=25, mindur=50):
+
+def _numba_fixation_loop():
+    # returns _fixation_loop compiled by numba, or None if numba is not
+    # installed; numba is only imported (and the loop compiled) on first use
+    if not _NUMBA_LOOP:
+        try:
+            import numba
+        except ImportError:
+            _NUMBA_LOOP.append(None)
+        else:
+            _NUMBA_LOOP.append(numba.njit(cache=True, nogil=True)(_fixation_loop))
+    return _NUMBA_LOOP[0]
+
+
+def _fixation_search(x, y, maxdist):
+    # same result as _fixation_loop, but with the distances computed by array
+    # operations; outside of a fixation, every sample is compared to the
+    # previous one, and a fixation starting at sample s lasts until the
+    # first sample further than maxdist from s (a NaN distance counts as 0,
+    # as in the loop)
+    n = len(x)
+    if n < 2:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64), \
+            numpy.zeros(0, dtype=numpy.int64), False
+    # samples that are close to their predecessor, i.e. possible starts
+    with numpy.errstate(invalid='ignore'):
+        close = numpy.flatnonzero(~(_loop_dist(x[:-1] - x[1:], y[:-1] - y[1:]) > maxdist)) + 1
+    # first possible start at or after every sample
+    nextstart = numpy.full(n + 1, n, dtype=numpy.int64)
+    nextstart[close] = close
+    nextstart = numpy.minimum.accumulate(nextstart[::-1])[::-1]
+    # end (exclusive) of the fixation that would start at every possible
+    # start, found by comparing all unresolved starts to the sample k ahead;
+    # starts of longer fixations are resolved by a search over chunks, but
+    # only if a fixation actually starts there
+    end = numpy.full(n, -1, dtype=numpy.int64)
+    todo = close
+    for k in range(1, 9):
+        end[todo[todo + k >= n]] = n
+        todo = todo[todo + k < n]
+        with numpy.errstate(invalid='ignore'):
+            far = _loop_dist(x[todo] - x[todo + k], y[todo] - y[todo + k]) > maxdist
+        end[todo[far]] = todo[far] + k
+        todo = todo[~far]
+    # follow the fixations from the start of the trial
+    nextstart = nextstart.tolist()
+    end = end.tolist()
+    fs = []
+    i = 1
+    while True:
+        si = nextstart[i]
+        if si >= n:
+            break
+        if end[si] < 0:
+            end[si] = _fixation_end(x, y, si, maxdist, si + 9)
+        fs.append(si)
+        if end[si] >= n:
+            break
+        # the sample that ended the fixation is the next point of comparison
+        i = end[si] + 1
+    fs = numpy.array(fs, dtype=numpy.int64)
+    fe = numpy.array([end[si] - 1 for si in fs], dtype=numpy.int64)
+    return fs, fe, fs.copy(), len(fe) > 0 and fe[-1] == n - 1
+
+
+def _fixation_end(x, y, si, maxdist, i):
+    # index of the first sample from i onwards that lies further than
+    # maxdist from sample si, or len(x); searched in chunks of growing size
+    n = len(x)
+    step = 64
+    while i < n:
+        j = min(n, i + step)
+        with numpy.errstate(invalid='ignore'):
+            far = numpy.flatnonzero(_loop_dist(x[si] - x[i:j], y[si] - y[i:j]) > maxdist)
+        if len(far) > 0:
+            return i + far[0]
+        i = j
+        step *= 2
+    return n
+
+
+def _loop_dist(dx, dy):
+    # distances as computed in _fixation_loop, where a squared distance that
+    # is not positive (or NaN) gives a distance of 0
+    squared_distance = dx ** 2 + dy ** 2
+    return numpy.where(squared_distance > 0, squared_distance ** 0.5, 0.0)
+
+
+@timed('fixation_detection_dd', items=arg_length)
+def fixation_detection_dd(x, y, time, maxdist=25, mindur=50, missing=0.0, table=False, hz=60, window='samples'):
     """Detects fixations, defined as a group of samples with a distance dispersion
     of less than a set amount of pixels (disregarding missing data).
     Algorithm taken from:
@@ -182,6 +438,11 @@ def fixation_detection_dd(x, y, time, maxdist=25, mindur=50):
     Attention, Perception, & Psychophysics 71, 881–895 (2009). https://doi.org/10.3758/APP.71.4.881
     Copyright (C) 2020  Rick Spiegl
 
+    The dispersion of a window is tracked through the running bounding box
+    of its samples instead of comparing every pair of samples, which keeps
+    the detection linear in the number of samples. The returned events are
+    identical to those of the original pairwise implementation.
+
 	arguments
 
 	x		-	numpy array of x positions
@@ -194,6 +455,18 @@ def fixation_detection_dd(x, y, time, maxdist=25, mindur=50):
 	mindur	-	minimal duration of a fixation in milliseconds; detected
 				fixation cadidates will be disregarded if they are below
 				this duration (default = 100)
+	missing	-	value to be used for missing data (default = 0.0)
+	table	-	Boolean indicating whether the events are to be returned
+				as EventTables instead of lists (default = False)
+	hz		-	sampling rate in Hz, used to convert mindur into a
+				number of samples in 'samples' windows (default = 60)
+	window	-	'samples' for windows of the number of samples that
+				covers mindur at the sampling rate hz, or 'time' for
+				windows that run from a sample up to and including the
+				first sample at least mindur milliseconds later, found
+				from the timestamps, which need to be non-decreasing;
+				'time' windows follow the real duration of jittery or
+				high-rate recordings (default = 'samples')
 
 	returns
 	Sfix, Efix
@@ -201,44 +474,242 @@ def fixation_detection_dd(x, y, time, maxdist=25, mindur=50):
 				Efix	-	list of lists, each containing [starttime, endtime, duration, endx, endy]
 	"""
 
-    x, y, time = remove_missing(x, y, time)
+    x, y, time = remove_missing(x, y, time, missing)
 
-    # empty list to contain data
-    Sfix = []
-    Efix = []
-    # loop through all coordinates
-    si = 0
-    timeframe_points = mindur / 1000 * 60
-    while si < len(x):
-        points = numpy.array([[x[si], y[si]]])
-        i = math.ceil(si + timeframe_points) + 1
-        if i >= len(x):
-            break
+    offsets = numpy.array([0, len(x)])
+    return _dispersion_events(x, y, time, offsets, maxdist, mindur, table, hz, window)[0]
 
-        for a in range(si + 1, i):
-            points = numpy.append(points, [[x[a], y[a]]], axis=0)
-        dist = get_max_dist_points(points)
-
-        if dist <= maxdist:
-            p = numpy.array([x[i], y[i]])
-            dist = get_max_dist(points, p)
-            while dist <= maxdist:
-                points = numpy.append(points, [p], axis=0)
-                i += 1
-                if i >= len(x):
-                    break
-
-                p = numpy.array([x[i], y[i]])
-                dist = get_max_dist(points, p)
-
-            fix = numpy.average(points, axis=0)
-            Sfix.append([time[si]])
-            Efix.append([time[si], time[i - 1], time[i - 1] - time[si], fix[0], fix[1]])
-            si = i
-        else:
-            si += 1
 
-    return Sfix, Efix
+@timed('fixation_detection_dd_batch', items=arg_length)
+def fixation_detection_dd_batch(x, y, time, offsets, maxdist=25, mindur=50, missing=0.0, table=False, hz=60,
+                                window='samples'):
+    """Runs fixation_detection_dd on a batch of trials in a single call. The
+    trials are passed concatenated, with offsets marking where each trial
+    starts and ends; see concatenate_trials.
+
+	arguments
+
+	x		-	numpy array of x positions of all trials
+	y		-	numpy array of y positions of all trials
+	time		-	numpy array of EyeTribe timestamps of all trials
+	offsets	-	numpy array of len(trials) + 1 sample indices; the
+				samples of trial n are x[offsets[n]:offsets[n+1]]
+
+	keyword arguments
+
+	maxdist	-	maximal inter sample distance in pixels (default = 25)
+	mindur	-	minimal duration of a fixation in milliseconds (default = 50)
+	missing	-	value to be used for missing data (default = 0.0)
+	table	-	Boolean indicating whether the events are to be returned
+				as EventTables instead of lists (default = False)
+	hz		-	sampling rate in Hz (default = 60)
+	window	-	'samples' or 'time' (default = 'samples'); see
+				fixation_detection_dd
+
+	returns
+	events
+				events	-	list with a (Sfix, Efix) tuple for every trial, as
+						returned by fixation_detection_dd
+	"""
+
+    offsets = numpy.asarray(offsets, dtype=int)
+    # remove missing samples from all trials at once, and shift the trial
+    # offsets by the number of samples that were removed before them
+    keep = ~_missing_mask(x, y, missing)
+    kept = numpy.concatenate(([0], numpy.cumsum(keep)))
+    return _dispersion_events(x[keep], y[keep], time[keep], kept[offsets], maxdist, mindur, table, hz, window)
+
+
+def concatenate_trials(trials):
+    """Concatenates a sequence of (x, y, time) trials into the flat arrays
+    and offsets expected by fixation_detection_dd_batch
+
+	arguments
+
+	trials	-	sequence of (x, y, time) tuples of numpy arrays
+
+	returns
+	x, y, time, offsets
+	"""
+
+    trials = list(trials)
+    lengths = [len(t[0]) for t in trials]
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths, dtype=int)))
+    if not trials:
+        empty = numpy.zeros(0)
+        return empty, empty, empty, offsets
+    x = numpy.concatenate([t[0] for t in trials])
+    y = numpy.concatenate([t[1] for t in trials])
+    time = numpy.concatenate([t[2] for t in trials])
+    return x, y, time, offsets
+
+
+@timed('resample', items=arg_length)
+def resample(x, y, time, hz, missing=0.0, maxgap=None):
+    """Interpolates the samples of a trial linearly onto a uniform grid, so
+    that jittery or irregular recordings can be analysed at a fixed rate
+
+	arguments
+
+	x		-	numpy array of x positions
+	y		-	numpy array of y positions
+	time		-	numpy array of non-decreasing timestamps in
+				milliseconds
+	hz		-	sampling rate of the grid in Hz
+
+	keyword arguments
+
+	missing	-	value to be used for missing data, both in the input
+				(where NaN is missing as well) and in the output
+				(default = 0.0)
+	maxgap	-	longest interval in milliseconds between two valid
+				samples that is interpolated; grid points in longer
+				gaps, e.g. blinks, are set to missing, or None for two
+				grid intervals (default = None)
+
+	returns
+	x, y, time
+				the samples at time[0], time[0] + 1000/hz, ... up to
+				time[-1]
+	"""
+
+    time = numpy.asarray(time, dtype=float)
+    step = 1000.0 / hz
+    if maxgap is None:
+        maxgap = 2 * step
+    if len(time) == 0:
+        empty = numpy.zeros(0)
+        return empty, empty.copy(), empty.copy()
+    grid = time[0] + numpy.arange(int(numpy.floor((time[-1] - time[0]) / step)) + 1) * step
+    valid = ~_missing_mask(x, y, missing)
+    tv = time[valid]
+    xs = numpy.full(len(grid), float(missing))
+    ys = numpy.full(len(grid), float(missing))
+    if len(tv) == 0:
+        return xs, ys, grid
+    # the valid samples before (left) and after (right) every grid point
+    right = numpy.searchsorted(tv, grid, side='right')
+    left = right - 1
+    exact = (left >= 0) & (tv[numpy.maximum(left, 0)] == grid)
+    inside = (left >= 0) & (right < len(tv))
+    gap = numpy.where(inside, tv[numpy.minimum(right, len(tv) - 1)] - tv[numpy.maximum(left, 0)], numpy.inf)
+    ok = exact | (gap <= maxgap)
+    xs[ok] = numpy.interp(grid[ok], tv, numpy.asarray(x, dtype=float)[valid])
+    ys[ok] = numpy.interp(grid[ok], tv, numpy.asarray(y, dtype=float)[valid])
+    return xs, ys, grid
+
+
+def _dispersion_events(x, y, time, offsets, maxdist, mindur, table, hz=60, window='samples'):
+    windows = _dispersion_windows(x, y, time, offsets, mindur, hz, window)
+    return _dispersion_fixations(x, y, time, offsets, windows, maxdist, table)
+
+
+def _dispersion_windows(x, y, time, offsets, mindur, hz=60, window='samples'):
+    # INITIAL WINDOWS
+    # every sample si of a trial with n samples opens a window [si, i); i is
+    # the index of the window end within the trial. Returns the window ends,
+    # the index of every sample within its trial, the samples whose window
+    # is considered and the dispersion of those windows, which only depend
+    # on mindur, so that they can be shared between values of maxdist
+    lengths = numpy.diff(offsets)
+    trial = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    local = numpy.arange(len(x)) - offsets[:-1][trial]
+    if window == 'samples':
+        # i = ceil(si + timeframe_points) + 1, with the number of samples
+        # that cover the minimal fixation duration; windows with i >= n are
+        # not considered, as the original algorithm stops at the first of
+        # those
+        timeframe_points = mindur / 1000 * hz
+        ends = numpy.ceil(local + timeframe_points).astype(int) + 1
+        valid = numpy.flatnonzero(ends < lengths[trial])
+    elif window == 'time':
+        # i is one past the first sample at least mindur after si, found by a
+        # binary search in the timestamps of the trial; windows for which
+        # there is no such sample are not considered
+        ends = numpy.empty(len(x), dtype=int)
+        for first, last in zip(offsets[:-1], offsets[1:]):
+            t = time[first:last]
+            ends[first:last] = numpy.searchsorted(t, t + mindur, side='left') + 1
+        valid = numpy.flatnonzero(ends <= lengths[trial])
+    else:
+        raise Exception("ERROR in fixation_detection_dd: unknown window '%s'" % window)
+    dispersion = numpy.zeros(0)
+    if len(valid) > 0:
+        # the dispersion of a window is the diagonal of its bounding box, as
+        # the largest pairwise difference along an axis is max - min
+        bounds = numpy.empty(2 * len(valid), dtype=int)
+        bounds[0::2] = valid
+        bounds[1::2] = valid + ends[valid] - local[valid]
+        # reduceat needs every bound to be an index, so 'time' windows that
+        # end with the last sample get a padding sample to end on
+        px, py = (x, y) if bounds[-1] < len(x) else (numpy.append(x, 0.0), numpy.append(y, 0.0))
+        hix = numpy.maximum.reduceat(px, bounds)[0::2]
+        lox = numpy.minimum.reduceat(px, bounds)[0::2]
+        hiy = numpy.maximum.reduceat(py, bounds)[0::2]
+        loy = numpy.minimum.reduceat(py, bounds)[0::2]
+        dispersion = dist_euclidean((hix - lox, hiy - loy))
+    return ends, local, valid, dispersion
+
+
+def _dispersion_fixations(x, y, time, offsets, windows, maxdist, table):
+    # FIXATIONS
+    # start at every window (from _dispersion_windows) with a dispersion of
+    # at most maxdist that lies after the previous fixation
+    ends, local, valid, dispersion = windows
+    candidates = valid[dispersion <= maxdist]
+    events = []
+    for t in range(len(offsets) - 1):
+        # indices of fixation starts and ends, and the average positions
+        fs = []
+        fe = []
+        fx = []
+        fy = []
+        first, last = offsets[t], offsets[t + 1]
+        k = numpy.searchsorted(candidates, first)
+        while k < len(candidates) and candidates[k] < last:
+            si = candidates[k]
+            i = _dispersion_extend(x, y, si, si + ends[si] - local[si], last, maxdist)
+            fix = numpy.average(numpy.column_stack((x[si:i], y[si:i])), axis=0)
+            fs.append(si)
+            fe.append(i - 1)
+            fx.append(fix[0])
+            fy.append(fix[1])
+            k = numpy.searchsorted(candidates, i, side='left')
+        fs = numpy.array(fs, dtype=int)
+        fe = numpy.array(fe, dtype=int)
+        events.append(_event_output(time[fs], FIXATION_COLUMNS,
+                                    [time[fs], time[fe], time[fe] - time[fs], numpy.array(fx), numpy.array(fy)],
+                                    table))
+
+    return events
+
+
+def _dispersion_extend(x, y, si, i, n, maxdist):
+    # grows the fixation window [si, i) one sample at a time, for as long as
+    # the next sample lies within maxdist of the window; the distance of a
+    # sample to the window only depends on the window's bounding box, which
+    # is tracked with running extrema over chunks of growing size
+    lox, hix = numpy.amin(x[si:i]), numpy.amax(x[si:i])
+    loy, hiy = numpy.amin(y[si:i]), numpy.amax(y[si:i])
+    step = max(8, i - si)
+    while i < n:
+        j = min(n, i + step)
+        px = x[i:j]
+        py = y[i:j]
+        # bounding box of the window before each of the chunk's samples
+        hx = numpy.maximum.accumulate(numpy.concatenate(([hix], px[:-1])))
+        lx = numpy.minimum.accumulate(numpy.concatenate(([lox], px[:-1])))
+        hy = numpy.maximum.accumulate(numpy.concatenate(([hiy], py[:-1])))
+        ly = numpy.minimum.accumulate(numpy.concatenate(([loy], py[:-1])))
+        dist = dist_euclidean((numpy.maximum(hx - px, px - lx), numpy.maximum(hy - py, py - ly)))
+        outside = numpy.flatnonzero(~(dist <= maxdist))
+        if len(outside) > 0:
+            return i + outside[0]
+        hix, lox = max(hx[-1], px[-1]), min(lx[-1], px[-1])
+        hiy, loy = max(hy[-1], py[-1]), min(ly[-1], py[-1])
+        i = j
+        step *= 2
+    return n
 
 
 def get_max_dist_points(points):
@@ -256,7 +727,8 @@ def dist_euclidean(coordinate):
     return (coordinate[0] ** 2 + coordinate[1] ** 2) ** 0.5
 
 
-def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340):
+@timed('saccade_detection', items=arg_length)
+def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340, table=False):
     """Detects saccades, defined as consecutive samples with an inter-sample
 	velocity of over a velocity threshold or an acceleration threshold
 	
@@ -275,6 +747,8 @@ def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340):
 	maxvel	-	velocity threshold in pixels/second (default = 40)
 	maxacc	-	acceleration threshold in pixels / second**2
 				(default = 340)
+	table	-	Boolean indicating whether the events are to be returned
+				as EventTables instead of lists (default = False)
 	
 	returns
 	Ssac, Esac
@@ -282,11 +756,11 @@ def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340):
 			Esac	-	list of lists, each containing [starttime, endtime, duration, startx, starty, endx, endy]
 	"""
     x, y, time = remove_missing(x, y, time, missing)
+    vel, acc = _saccade_velocity(x, y, time)
+    return _saccade_events(x, y, time, vel, acc, minlen, maxvel, maxacc, table)
 
-    # CONTAINERS
-    Ssac = []
-    Esac = []
 
+def _saccade_velocity(x, y, time):
     # INTER-SAMPLE MEASURES
     # the distance between samples is the square root of the sum
     # of the squared horizontal and vertical interdistances
@@ -303,6 +777,15 @@ def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340):
     # the acceleration is the sample-to-sample difference in
     # eye movement velocity
     acc = numpy.diff(vel)
+    return vel, acc
+
+
+def _saccade_events(x, y, time, vel, acc, minlen, maxvel, maxacc, table):
+    # CONTAINERS
+    # indices of saccade starts, and of the starts and ends of complete saccades
+    ss = []
+    es = []
+    ee = []
 
     # SACCADE START AND END
     t0i = 0
@@ -322,7 +805,7 @@ def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340):
             t1 = time[t1i]
 
             # add to saccade starts
-            Ssac.append([t1])
+            ss.append(t1i)
 
             # detect saccade endings
             sacends = numpy.where((vel[1 + t1i:] < maxvel).astype(int) + (acc[t1i:] < maxacc).astype(int) == 2)[0]
@@ -337,10 +820,11 @@ def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340):
                 # ignore saccades that did not last long enough
                 if dur >= minlen:
                     # add to saccade ends
-                    Esac.append([t1, t2, dur, x[t1i], y[t1i], x[t2i], y[t2i]])
+                    es.append(t1i)
+                    ee.append(t2i)
                 else:
                     # remove last saccade start on too low duration
-                    Ssac.pop(-1)
+                    ss.pop(-1)
 
                 # update t0i
                 t0i = 0 + t2i
@@ -349,4 +833,142 @@ def saccade_detection(x, y, time, missing=0.0, minlen=5, maxvel=40, maxacc=340):
         else:
             stop = True
 
-    return Ssac, Esac
+    ss = numpy.array(ss, dtype=int)
+    es = numpy.array(es, dtype=int)
+    ee = numpy.array(ee, dtype=int)
+    return _event_output(time[ss], SACCADE_COLUMNS,
+                         [time[es], time[ee], time[ee] - time[es], x[es], y[es], x[ee], y[ee]], table)
+
+
+@timed('saccade_detection_ivt', items=arg_length)
+def saccade_detection_ivt(x, y, time, missing=0.0, minlen=5, maxvel=None, peakfactor=6, onsetfactor=3,
+                          initvel=None, tolerance=1.0, maxiter=100, table=False):
+    """Detects saccades as runs of samples with an inter-sample velocity
+	over a threshold (I-VT); by default, the threshold is derived from the
+	velocity noise of the trial, as in Nystrom & Holmqvist (2010): runs
+	over an onset threshold are saccades if they reach a peak threshold
+
+	arguments
+
+	x		-	numpy array of x positions
+	y		-	numpy array of y positions
+	time		-	numpy array of tracker timestamps in milliseconds
+
+	keyword arguments
+
+	missing	-	value to be used for missing data (default = 0.0)
+	minlen	-	minimal length of saccades in milliseconds; all detected
+				saccades with len(sac) < minlen will be ignored
+				(default = 5)
+	maxvel	-	fixed velocity threshold in pixels/second, used as both
+				the onset and the peak threshold, or None for adaptive
+				thresholds (default = None)
+	peakfactor	-	number of standard deviations of the fixational velocity
+				above its mean for the adaptive peak threshold
+				(default = 6)
+	onsetfactor	-	number of standard deviations of the fixational velocity
+				above its mean for the adaptive onset threshold
+				(default = 3)
+	initvel	-	initial peak threshold in pixels/second for the
+				adaptive thresholds, or None to start from all
+				velocities of the trial (default = None)
+	tolerance	-	the adaptive thresholds are final once the peak
+				threshold changes by less than this many pixels/second
+				(default = 1.0)
+	maxiter	-	maximal number of iterations of the adaptive thresholds
+				(default = 100)
+	table	-	Boolean indicating whether the events are to be returned
+				as EventTables instead of lists (default = False)
+
+	returns
+	Ssac, Esac
+			Ssac	-	list of lists, each containing [starttime]
+			Esac	-	list of lists, each containing [starttime, endtime, duration, startx, starty, endx, endy]
+	"""
+    x, y, time = remove_missing(x, y, time, missing)
+
+    # INTER-SAMPLE VELOCITY
+    # vel[i] is the velocity between sample i and i+1, in pixels/second;
+    # samples without a positive inter-sample time have no velocity
+    inttime = numpy.diff(time) / 1000.0
+    vel = numpy.full(len(inttime), numpy.nan)
+    valid = inttime > 0
+    vel[valid] = numpy.hypot(numpy.diff(x), numpy.diff(y))[valid] / inttime[valid]
+
+    # THRESHOLDS
+    if maxvel is None:
+        peakvel, onsetvel = velocity_threshold(vel, peakfactor=peakfactor, onsetfactor=onsetfactor,
+                                               initvel=initvel, tolerance=tolerance, maxiter=maxiter)
+    else:
+        peakvel = onsetvel = maxvel
+
+    # SACCADE START AND END
+    # runs of velocities over the onset threshold that reach the peak
+    # threshold; a run over vel[s:e] moves from sample s to sample e
+    with numpy.errstate(invalid='ignore'):
+        starts, ends = _runs(vel > onsetvel)
+        if len(starts) > 0:
+            peaks = numpy.maximum.reduceat(numpy.nan_to_num(vel, nan=-numpy.inf), starts)
+            keep = peaks > peakvel
+            starts, ends = starts[keep], ends[keep]
+    # ignore saccades that did not last long enough
+    keep = time[ends] - time[starts] >= minlen
+    ss, ee = starts[keep], ends[keep]
+    return _event_output(time[ss], SACCADE_COLUMNS,
+                         [time[ss], time[ee], time[ee] - time[ss], x[ss], y[ss], x[ee], y[ee]], table)
+
+
+def velocity_threshold(vel, peakfactor=6, onsetfactor=3, initvel=None, tolerance=1.0, maxiter=100):
+    """Returns the adaptive peak and onset velocity thresholds of a trial
+	(Nystrom & Holmqvist, 2010): starting from initvel, the peak threshold
+	is repeatedly set to the mean plus peakfactor standard deviations of
+	all velocities under the previous threshold, until it changes by less
+	than tolerance
+
+	arguments
+
+	vel		-	numpy array of inter-sample velocities; NaN values
+				are ignored
+
+	keyword arguments
+
+	see saccade_detection_ivt
+
+	returns
+	peakvel, onsetvel
+			peakvel	-	peak velocity threshold
+			onsetvel	-	onset velocity threshold, i.e. the mean plus
+					onsetfactor standard deviations of the velocities
+					under the peak threshold
+	"""
+    vel = numpy.asarray(vel, dtype=float)
+    vel = vel[numpy.isfinite(vel)]
+    if len(vel) == 0:
+        return numpy.inf, numpy.inf
+    peakvel = numpy.inf if initvel is None else float(initvel)
+    mean, sd = numpy.mean(vel), numpy.std(vel)
+    for i in range(maxiter):
+        under = vel[vel < peakvel]
+        if len(under) == 0:
+            break
+        mean, sd = numpy.mean(under), numpy.std(under)
+        previous = peakvel
+        peakvel = mean + peakfactor * sd
+        if abs(peakvel - previous) < tolerance:
+            break
+    return peakvel, mean + onsetfactor * sd
+
+
+def _runs(mask):
+    # returns the start and end (exclusive) indices of all runs of True in a
+    # boolean array, from the sign changes of the padded mask
+    edges = numpy.diff(numpy.concatenate(([0], numpy.asarray(mask, dtype=numpy.int8), [0])))
+    return numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+
+
+def _event_output(starts, columns, values, table):
+    # returns the starting and ending events, either in the list-of-lists
+    # format or as EventTables; values holds one array per ending event column
+    if table:
+        return EventTable(START_COLUMNS, [starts]), EventTable(columns, values)
+    return [[t] for t in starts], [list(event) for event in zip(*values)]
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Event Export
+#
+# Writes the events that the detectors find in all trials into one columnar
+# dataset, as Parquet or Arrow IPC (Feather) files, partitioned by
+# participant and dataset in hive style:
+#	<outdir>/participant=3/dataset=svrt19/part-0.parquet
+# Every event is one row of SCHEMA, with NaN for the columns that an event
+# type does not have (e.g. startx of a fixation). read_events only opens the
+# partitions that match a selection, and skips row groups by their column
+# statistics, e.g. to load the saccades on svrt19 of all participants:
+#	table = read_events('events', dataset='svrt19', event_type='saccade')
+# The files can be read by any Arrow-based tool as well (pandas, polars,
+# DuckDB, R's arrow package).
+#
+# This module requires pyarrow, which is imported on first use.
+
+import os
+
+import numpy
+
+from pygazeanalyser.detectors import fixation_detection_dd, saccade_detection_ivt, blink_detection
+from pygazeanalyser.runner import load_trials, detect_loaded, trial_images
+
+
+# # # # #
+# FORMAT
+
+# columns of the exported events, with their Arrow types; participant and
+# dataset are stored in the directory names of the partitions
+SCHEMA = [	('participant', 'int32'),
+			('dataset', 'string'),
+			('image', 'string'),
+			('trial', 'int32'),
+			('event_type', 'string'),
+			('start', 'float64'),
+			('end', 'float64'),
+			('dur', 'float64'),
+			('x', 'float64'),
+			('y', 'float64'),
+			('startx', 'float64'),
+			('starty', 'float64')]
+PARTITIONS = ('participant', 'dataset')
+# event table column that every exported column is taken from; x and y are
+# the end position, i.e. the position of a fixation
+EVENT_COLUMNS = {	'start': 'starttime',
+				'end': 'endtime',
+				'dur': 'duration',
+				'x': 'endx',
+				'y': 'endy',
+				'startx': 'startx',
+				'starty': 'starty'}
+# detectors that export_events runs by default, by event type
+DETECTORS = {	'fixation': fixation_detection_dd,
+			'saccade': saccade_detection_ivt,
+			'blink': blink_detection}
+FORMATS = {'parquet': 'parquet', 'arrow': 'ipc', 'feather': 'ipc'}
+
+
+def export_events(datadir, outdir, detectors=None, params=None, trials=None, store=None, workers=None,
+                  format='parquet'):
+    """Detects the events of every trial and writes them into a partitioned
+    Parquet or Arrow dataset; existing partitions of the same participant
+    and dataset are replaced
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+	outdir	-	path to the directory of the dataset; created if it does
+				not exist
+
+	keyword arguments
+
+	detectors	-	dict of event type to detector, or None for DETECTORS
+				(default = None)
+	params	-	dict of event type to a dict of keyword arguments for
+				its detector, or None (default = None)
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	store		-	SampleStore to read the samples from, or None
+				(default = None)
+	workers	-	number of detection processes, as in
+				runner.run_detection (default = None)
+	format	-	'parquet', or 'arrow' (or 'feather') for Arrow IPC files
+				(default = 'parquet')
+
+	returns
+	events	-	number of events that were written
+	"""
+
+    pa, ds = _pyarrow('export_events')
+    if format not in FORMATS:
+        raise Exception("ERROR in export_events: unknown format '%s'" % format)
+    if detectors is None:
+        detectors = DETECTORS
+    if params is None:
+        params = {}
+    trials, images = trial_images(datadir, trials)
+
+    # the samples are read once, and every detector runs on the same ones
+    keys, samples, offsets = load_trials(datadir, trials=trials, store=store)
+    tables = []
+    for event_type, detector in detectors.items():
+        results = detect_loaded(detector, keys, samples, offsets, workers=workers, table=True,
+                                **params.get(event_type, {}))
+        tables.append(events_table([(key, images[key], events[1]) for key, events in results], event_type))
+    table = pa.concat_tables(tables)
+    # rows of the same trial next to each other, and every partition sorted by
+    # event type, so that row group statistics are selective
+    table = table.sort_by([('participant', 'ascending'), ('dataset', 'ascending'), ('event_type', 'ascending'),
+                           ('trial', 'ascending'), ('start', 'ascending')])
+    ds.write_dataset(table, outdir, format=FORMATS[format], partitioning=_partitioning(pa, ds),
+                     existing_data_behavior='delete_matching')
+    return table.num_rows
+
+
+def events_table(results, event_type):
+    """Returns a pyarrow Table in the export SCHEMA of the events of many
+    trials
+
+	arguments
+
+	results	-	list of ((participant, dataset, trial), image, events)
+				tuples, where events is the EventTable of ending events
+				that a detector returned for the trial
+	event_type	-	name of the event type, e.g. 'fixation'
+	"""
+
+    pa, ds = _pyarrow('events_table')
+    counts = numpy.array([len(events) for key, image, events in results], dtype=int)
+    columns = {
+        'participant': numpy.repeat([key[0] for key, image, events in results], counts).astype(numpy.int32),
+        'dataset': numpy.repeat(numpy.array([key[1] for key, image, events in results], dtype=object), counts),
+        'image': numpy.repeat(numpy.array([image for key, image, events in results], dtype=object), counts),
+        'trial': numpy.repeat([key[2] for key, image, events in results], counts).astype(numpy.int32),
+        'event_type': numpy.full(counts.sum(), event_type, dtype=object)}
+    for name, column in EVENT_COLUMNS.items():
+        values = [events[column] if column in events.columns else numpy.full(len(events), numpy.nan)
+                  for key, image, events in results]
+        columns[name] = numpy.concatenate(values) if values else numpy.zeros(0)
+    schema = _schema(pa)
+    return pa.table([pa.array(columns[name], type=schema.field(name).type) for name in schema.names],
+                    schema=schema)
+
+
+def read_events(outdir, columns=None, format='parquet', **criteria):
+    """Returns the exported events that meet all criteria, as a pyarrow
+    Table; only the partitions and row groups that can contain matching
+    events are read
+
+	arguments
+
+	outdir	-	path to the directory of the dataset
+
+	keyword arguments
+
+	columns	-	list of the columns to read, or None for all columns
+				(default = None)
+	format	-	format the dataset was written in (default = 'parquet')
+
+	every further keyword argument is a column of SCHEMA, with either a
+	value that the column must equal, or a list, tuple or set of allowed
+	values, e.g. read_events('events', dataset='svrt19',
+	event_type=['fixation', 'saccade'])
+
+	The table can be converted with table.to_pandas(), or to numpy arrays
+	with table.column(name).to_numpy().
+	"""
+
+    pa, ds = _pyarrow('read_events')
+    if format not in FORMATS:
+        raise Exception("ERROR in read_events: unknown format '%s'" % format)
+    if not os.path.isdir(outdir):
+        raise Exception("ERROR in read_events: no events found at '%s'" % outdir)
+    dataset = ds.dataset(outdir, schema=_schema(pa), format=FORMATS[format], partitioning=_partitioning(pa, ds))
+    condition = None
+    for name, value in criteria.items():
+        if name not in dataset.schema.names:
+            raise KeyError("no column '%s' in the events" % name)
+        if isinstance(value, (list, tuple, set)):
+            expression = ds.field(name).isin(list(value))
+        else:
+            expression = ds.field(name) == value
+        condition = expression if condition is None else condition & expression
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def _pyarrow(caller):
+    # returns pyarrow and pyarrow.dataset, which are only needed here
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise Exception("ERROR in %s: exporting events requires pyarrow" % caller)
+    return pyarrow, pyarrow.dataset
+
+
+def _schema(pa):
+    return pa.schema([(name, pa.type_for_alias(dtype)) for name, dtype in SCHEMA])
+
+
+def _partitioning(pa, ds):
+    schema = _schema(pa)
+    return ds.partitioning(pa.schema([schema.field(name) for name in PARTITIONS]), flavor='hive')
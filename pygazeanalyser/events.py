@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Event Tables
+#
+# Columnar alternative to the list-of-lists event format (Sfix, Efix, Ssac,
+# Esac, Sblk, Eblk) returned by the detectors. An EventTable keeps every
+# column in one contiguous numpy array, so that plotting and aggregation code
+# can use whole columns without copying events back out of Python lists.
+
+import numpy
+
+
+# # # # #
+# COLUMNS
+
+# column names of the ending events, in the order of the list-of-lists format
+START_COLUMNS = ('starttime',)
+FIXATION_COLUMNS = ('starttime', 'endtime', 'duration', 'endx', 'endy')
+SACCADE_COLUMNS = ('starttime', 'endtime', 'duration', 'startx', 'starty', 'endx', 'endy')
+BLINK_COLUMNS = ('starttime', 'endtime', 'duration')
+# periods of data loss, with the number of missing samples in each
+GAP_COLUMNS = ('starttime', 'endtime', 'duration', 'samples')
+
+
+class EventTable(object):
+    """Table of events with named columns, stored as a (columns, events)
+    numpy array; every column is a contiguous view into that array
+
+	arguments
+
+	columns	-	sequence of column names, e.g. FIXATION_COLUMNS
+	data		-	sequence with one array of values for each column, or a
+				2D array with one row for each column
+
+	Columns can be accessed by name (table['endx']) or as attributes
+	(table.endx). Iterating over a table yields one row per event, so
+	code written for the list-of-lists format keeps working, e.g.
+	for st, et, dur, sx, sy, ex, ey in saccades.
+	"""
+
+    __slots__ = ('columns', 'data')
+
+    def __init__(self, columns, data):
+        self.columns = tuple(columns)
+        self.data = numpy.array(data, dtype=float, ndmin=2)
+        if self.data.shape[0] != len(self.columns):
+            if self.data.size == 0:
+                self.data = numpy.zeros((len(self.columns), 0))
+            else:
+                raise ValueError("EventTable got %d columns of data for %d column names" %
+                                 (self.data.shape[0], len(self.columns)))
+
+    @classmethod
+    def from_events(cls, columns, events):
+        """Returns an EventTable from a list of lists of events, e.g. an Efix
+        list as returned by the detectors"""
+        data = numpy.array(events, dtype=float).reshape(-1, len(columns)).T
+        return cls(columns, data)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """Returns a single EventTable with the events of all tables, which
+        need to have the same columns"""
+        tables = list(tables)
+        if not tables:
+            raise ValueError("EventTable.concatenate needs at least one table")
+        columns = tables[0].columns
+        for table in tables[1:]:
+            if table.columns != columns:
+                raise ValueError("EventTable.concatenate got tables with different columns")
+        return cls(columns, numpy.concatenate([table.data for table in tables], axis=1))
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __iter__(self):
+        return iter(self.data.T)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return self.data[self.columns.index(key)]
+            except ValueError:
+                raise KeyError(key)
+        return self.data.T[key]
+
+    def __getattr__(self, name):
+        # slots that have not been set yet (e.g. while unpickling) must not
+        # be looked up as columns
+        if name.startswith('_') or name in EventTable.__slots__:
+            raise AttributeError(name)
+        try:
+            return self.data[self.columns.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        return "EventTable(%s, %d events)" % (", ".join(self.columns), len(self))
+
+    def tolist(self):
+        """Returns the events in the list-of-lists format"""
+        return self.data.T.tolist()
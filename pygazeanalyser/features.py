@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Trial Features
+#
+# Computes per-trial features from the samples of a trial, named like the
+# derived columns of images.csv:
+#	len			-	number of samples
+#	p_nan			-	percentage of missing samples, rounded to 2 decimals
+#	switches		-	number of times the gaze crossed the line between
+#					(line_start_x, line_start_y) and (line_end_x,
+#					line_end_y), counted over the valid samples that fall
+#					on the stimulus (NaN if none does)
+#	fixations		-	number of detected fixations
+#	switches_fixations	-	number of times consecutive fixations on the
+#					stimulus lie on different sides of the line (NaN
+#					if no fixation is on the stimulus)
+# Only len and p_nan reproduce images.csv on every trial. switches
+# reproduces it on all but 44 of its 2342 trials, all on boards whose line
+# runs along a pixel column, where samples exactly on the line are counted
+# differently. fixations and switches_fixations are new
+# features, which do not reproduce the file: the detector and parameters
+# behind its columns are not known, and no setting of fixation_detection_dd
+# or fixation_detection that was tried matches the fixation counts of more
+# than 39% of the trials. benchmarks/check_features.py compares the
+# features with the file. The line is a property of the image and is read
+# from images.csv, not computed. Line coordinates are relative to the top
+# left of the stimulus, which is shown in a 512x512 pixel area at (703, 54)
+# of the 1920x1200 display (see data/gui.png).
+#
+# Results are cached per trial file, and within that per line and per
+# detector and parameters, so that a changed trial file or a changed
+# threshold only recomputes the affected values.
+
+import os
+import csv
+import json
+
+import numpy
+
+from pygazeanalyser.detectors import remove_missing, fixation_detection_dd
+from pygazeanalyser.icarereader import read_trial, trial_filename
+
+
+# # # # #
+# CONSTANTS
+
+# left, top, width and height of the stimulus area on the display
+STIMULUS_RECT = (703, 54, 512, 512)
+# features, named and ordered like the derived columns of images.csv
+FEATURE_COLUMNS = ('switches_fixations', 'fixations', 'p_nan', 'len', 'switches')
+LINE_COLUMNS = ('line_start_x', 'line_start_y', 'line_end_x', 'line_end_y')
+# changes whenever a feature is computed differently, so that cached values
+# are computed again
+FEATURE_VERSION = 2
+
+
+# # # # #
+# FEATURES
+
+def line_switches(x, y, line, rect=STIMULUS_RECT):
+    """Returns the number of times that consecutive points lie on different
+    sides of a line, counting only the points within the stimulus area
+
+	arguments
+
+	x		-	numpy array of x positions on the display
+	y		-	numpy array of y positions on the display
+	line		-	(startx, starty, endx, endy) of the line, relative to
+				the stimulus area
+
+	keyword arguments
+
+	rect		-	(left, top, width, height) of the stimulus area on the
+				display (default = STIMULUS_RECT)
+
+	returns
+	switches	-	integer number of side changes, or NaN if no point
+				lies within the stimulus area; points on the line and
+				missing (NaN) points are ignored
+
+	The stimulus area includes its right and bottom edge, as that matches
+	the switches column of images.csv on more trials.
+	"""
+
+    px = numpy.asarray(x, dtype=float) - rect[0]
+    py = numpy.asarray(y, dtype=float) - rect[1]
+    inside = (px >= 0) & (px <= rect[2]) & (py >= 0) & (py <= rect[3])
+    if not numpy.any(inside):
+        return float('nan')
+    px = px[inside]
+    py = py[inside]
+    sx, sy, ex, ey = line
+    side = numpy.sign((ex - sx) * (py - sy) - (ey - sy) * (px - sx))
+    side = side[side != 0]
+    return int(numpy.count_nonzero(side[1:] != side[:-1]))
+
+
+def trial_features(x, y, time, line=None, detector=fixation_detection_dd, missing=0.0, rect=STIMULUS_RECT, **params):
+    """Returns the features of a single trial
+
+	arguments
+
+	x		-	numpy array of x positions (NaN for missing samples)
+	y		-	numpy array of y positions (NaN for missing samples)
+	time		-	numpy array of timestamps
+
+	keyword arguments
+
+	line		-	(startx, starty, endx, endy) of the image's line, or
+				None if the image has no line (default = None)
+	detector	-	fixation detector (default = fixation_detection_dd)
+	missing	-	value used for missing data in the trial, in addition
+				to NaN (default = 0.0)
+	rect		-	(left, top, width, height) of the stimulus area on the
+				display (default = STIMULUS_RECT)
+
+	all further keyword arguments are passed on to the detector
+
+	returns
+	features	-	dict with a value for every column in FEATURE_COLUMNS;
+				the switch counts are NaN when no line is given
+	"""
+
+    features = _sample_features(x, y, time, line, missing, rect)
+    features.update(_fixation_features(x, y, time, line, detector, missing, rect, params))
+    return features
+
+
+def compute_features(datadir, cachefile=None, detector=fixation_detection_dd, missing=0.0, rect=STIMULUS_RECT, **params):
+    """Computes the features of every trial in images.csv
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+
+	keyword arguments
+
+	cachefile	-	path to a JSON file in which the features are cached
+				between calls, or None to not cache (default = None)
+	detector	-	fixation detector (default = fixation_detection_dd)
+	missing	-	value used for missing data, in addition to NaN
+				(default = 0.0)
+	rect		-	(left, top, width, height) of the stimulus area on the
+				display (default = STIMULUS_RECT)
+
+	all further keyword arguments are passed on to the detector
+
+	returns
+	rows		-	list of dicts, one for every images.csv row that has a
+				trial file, with participant, dataset, image and trial
+				followed by the columns in FEATURE_COLUMNS
+	"""
+
+    cache = FeatureCache(cachefile)
+    fixkey = _params_key(detector, missing, rect, params)
+    rows = []
+    with open(os.path.join(datadir, 'images.csv'), newline='') as f:
+        for row in csv.DictReader(f):
+            participant, dataset, trial, image = int(row['participant']), row['dataset'], int(row['trial']), row['image']
+            filename = trial_filename(datadir, participant, dataset, trial, image)
+            if not os.path.isfile(filename):
+                continue
+            line = None
+            if all(row[c] != '' for c in LINE_COLUMNS):
+                line = tuple(float(row[c]) for c in LINE_COLUMNS)
+            linekey = json.dumps([FEATURE_VERSION, line, rect, missing])
+            entry = cache.entry(os.path.relpath(filename, datadir), filename)
+            # only read the trial file when one of the parts is not cached
+            samples = None
+            if linekey not in entry['samples']:
+                samples = read_trial(filename)
+                entry['samples'][linekey] = _sample_features(*samples, line=line, missing=missing, rect=rect)
+            if linekey + fixkey not in entry['fixations']:
+                if samples is None:
+                    samples = read_trial(filename)
+                entry['fixations'][linekey + fixkey] = _fixation_features(*samples, line=line, detector=detector,
+                                                                         missing=missing, rect=rect, params=params)
+            features = {'participant': participant, 'dataset': dataset, 'image': image, 'trial': trial}
+            features.update(entry['samples'][linekey])
+            features.update(entry['fixations'][linekey + fixkey])
+            rows.append(dict((k, features[k]) for k in ('participant', 'dataset', 'image', 'trial') + FEATURE_COLUMNS))
+    cache.save()
+    return rows
+
+
+class JSONCache(object):
+    """Dict of cache entries that is stored in a JSON file; the base of
+    FeatureCache and scanpath.ScanpathCache
+
+	arguments
+
+	filename	-	path to the cache file, or None for a cache that is
+				not stored
+	"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        if filename is not None and os.path.isfile(filename):
+            with open(filename) as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        """Writes the cache to its file, through a temporary file, so that
+        an interrupted save leaves the previous file intact"""
+        if self.filename is None:
+            return
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.filename)
+
+
+class FeatureCache(JSONCache):
+    """Cache of trial features in a JSON file, with one entry per trial file;
+    an entry is discarded as soon as the size or modification time of its
+    trial file changes
+
+	arguments
+
+	filename	-	path to the cache file, or None for a cache that is
+				not stored
+	"""
+
+    def entry(self, key, filename):
+        """Returns the cached entry of a trial file, which is a dict with a
+        'samples' and a 'fixations' dict of features"""
+        stat = os.stat(filename)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        entry = self.entries.get(key)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            entry = {'fingerprint': fingerprint, 'samples': {}, 'fixations': {}}
+            self.entries[key] = entry
+        return entry
+
+
+def _params_key(detector, missing, rect, params):
+    # identifies the detector and its parameters in the cache
+    return json.dumps([detector.__module__ + '.' + detector.__name__, missing, rect, sorted(params.items())])
+
+
+def _sample_features(x, y, time, line, missing, rect):
+    # remove_missing and the detectors drop NaN samples themselves; they are
+    # only counted here for p_nan
+    nan = numpy.isnan(x) | numpy.isnan(y)
+    n = len(x)
+    features = {'len': n, 'p_nan': round(100.0 * int(numpy.count_nonzero(nan)) / n, 2) if n > 0 else float('nan')}
+    if line is None:
+        features['switches'] = float('nan')
+    else:
+        x, y, time = remove_missing(x, y, time, missing)
+        features['switches'] = line_switches(x, y, line, rect=rect)
+    return features
+
+
+def _fixation_features(x, y, time, line, detector, missing, rect, params):
+    Sfix, Efix = detector(x, y, time, missing=missing, table=True, **params)
+    features = {'fixations': len(Efix)}
+    if line is None or len(Efix) == 0:
+        features['switches_fixations'] = float('nan')
+    else:
+        features['switches_fixations'] = line_switches(Efix['endx'], Efix['endy'], line, rect=rect)
+    return features
@@ -30,10 +30,15 @@ __author__ = "Edwin Dalmaijer"
 
 # native
 import os
+import types
+import functools
+from collections import OrderedDict
 # external
 import numpy
-import matplotlib
-from matplotlib import pyplot, image
+# matplotlib is imported when the first plot is drawn (see _matplotlib)
+# internal
+from pygazeanalyser.events import EventTable, FIXATION_COLUMNS
+from pygazeanalyser.profiling import timed
 
 
 # # # # #
@@ -71,15 +76,26 @@ COLS = {	"butter": [	'#fce94f',
 					'#2e3436'],
 		}
 # FONT
-FONT = {	'family': 'Ubuntu',
+# applied to matplotlib's rc settings when the first plot is drawn, without
+# the families that are not installed (see _installed_font), so that a
+# missing Ubuntu font falls back on the font that comes with matplotlib
+FONT = {	'family': ['Ubuntu', 'DejaVu Sans'],
 		'size': 12}
-matplotlib.rc('font', **FONT)
+
+# HEATMAP
+# number of Gaussian kernels that are kept in memory; can be changed at any
+# time, which empties the cache
+KERNEL_CACHE_SIZE = 32
+# a heatmap is computed as a convolution of all fixations at once, rather
+# than by adding one Gaussian per fixation, when the kernels of all
+# fixations together cover more than this many times the display area
+HEATMAP_FFT_RATIO = 30
 
 
 # # # # #
 # FUNCTIONS
 
-def draw_fixations(fixations, dispsize, imagefile=None, durationsize=True, durationcolour=True, alpha=0.5, savefilename=None):
+def draw_fixations(fixations, dispsize, imagefile=None, durationsize=True, durationcolour=True, alpha=0.5, savefilename=None, headless=False):
 	
 	"""Draws circles on the fixation locations, optionally on top of an image,
 	with optional weigthing of the duration for circle size and colour
@@ -88,7 +104,8 @@ def draw_fixations(fixations, dispsize, imagefile=None, durationsize=True, durat
 	
 	fixations		-	a list of fixation ending events from a single trial,
 					as produced by edfreader.read_edf, e.g.
-					edfdata[trialnr]['events']['Efix']
+					edfdata[trialnr]['events']['Efix'], or an EventTable
+					of fixations
 	dispsize		-	tuple or list indicating the size of the display,
 					e.g. (1024,768)
 	
@@ -110,6 +127,10 @@ def draw_fixations(fixations, dispsize, imagefile=None, durationsize=True, durat
 					is completely untransparant (default = 0.5)
 	savefilename	-	full path to the file in which the heatmap should be
 					saved, or None to not save the file (default = None)
+	headless		-	Boolean indicating whether the figure is to be drawn
+					on its own Agg canvas rather than through pyplot, so
+					that pyplot does not keep it open; use
+					figure_to_array to get its pixels (default = False)
 	
 	returns
 	
@@ -121,32 +142,22 @@ def draw_fixations(fixations, dispsize, imagefile=None, durationsize=True, durat
 	fix = parse_fixations(fixations)
 	
 	# IMAGE
-	fig, ax = draw_display(dispsize, imagefile=imagefile)
+	fig, ax = draw_display(dispsize, imagefile=imagefile, headless=headless)
 
 	# CIRCLES
-	# duration weigths
-	if durationsize:
-		siz = 1 * (fix['dur']/30.0)
-	else:
-		siz = 1 * numpy.median(fix['dur']/30.0)
-	if durationcolour:
-		col = fix['dur']
-	else:
-		col = COLS['chameleon'][2]
-	# draw circles
-	ax.scatter(fix['x'],fix['y'], s=siz, c=col, marker='o', cmap='jet', alpha=alpha, edgecolors='none')
+	_plot_fixations(ax, fix, durationsize, durationcolour, alpha)
 
 	# FINISH PLOT
 	# invert the y axis, as (0,0) is top left on a display
 	ax.invert_yaxis()
 	# save the figure if a file name was provided
 	if savefilename != None:
-		fig.savefig(savefilename)
+		_save_figure(fig, savefilename)
 	
 	return fig
 
 
-def draw_heatmap(fixations, dispsize, imagefile=None, durationweight=True, alpha=0.5, savefilename=None):
+def draw_heatmap(fixations, dispsize, imagefile=None, durationweight=True, alpha=0.5, savefilename=None, headless=False):
 	
 	"""Draws a heatmap of the provided fixations, optionally drawn over an
 	image, and optionally allocating more weight to fixations with a higher
@@ -156,7 +167,8 @@ def draw_heatmap(fixations, dispsize, imagefile=None, durationweight=True, alpha
 	
 	fixations		-	a list of fixation ending events from a single trial,
 					as produced by edfreader.read_edf, e.g.
-					edfdata[trialnr]['events']['Efix']
+					edfdata[trialnr]['events']['Efix'], or an EventTable
+					of fixations
 	dispsize		-	tuple or list indicating the size of the display,
 					e.g. (1024,768)
 	
@@ -175,6 +187,10 @@ def draw_heatmap(fixations, dispsize, imagefile=None, durationweight=True, alpha
 					is completely untransparant (default = 0.5)
 	savefilename	-	full path to the file in which the heatmap should be
 					saved, or None to not save the file (default = None)
+	headless		-	Boolean indicating whether the figure is to be drawn
+					on its own Agg canvas rather than through pyplot, so
+					that pyplot does not keep it open; use
+					figure_to_array to get its pixels (default = False)
 	
 	returns
 	
@@ -186,65 +202,22 @@ def draw_heatmap(fixations, dispsize, imagefile=None, durationweight=True, alpha
 	fix = parse_fixations(fixations)
 	
 	# IMAGE
-	fig, ax = draw_display(dispsize, imagefile=imagefile)
+	fig, ax = draw_display(dispsize, imagefile=imagefile, headless=headless)
 
 	# HEATMAP
-	# Gaussian
-	gwh = 200
-	gsdwh = gwh/6
-	gaus = gaussian(gwh,gsdwh)
-	# matrix of zeroes
-	strt = gwh/2
-	heatmapsize = dispsize[1] + 2*strt, dispsize[0] + 2*strt
-	heatmap = numpy.zeros(heatmapsize, dtype=float)
-	# create heatmap
-	for i in range(0,len(fix['dur'])):
-		# get x and y coordinates
-		#x and y - indexes of heatmap array. must be integers
-		x = strt + int(fix['x'][i]) - int(gwh/2)
-		y = strt + int(fix['y'][i]) - int(gwh/2)
-		# correct Gaussian size if either coordinate falls outside of
-		# display boundaries
-		if (not 0 < x < dispsize[0]) or (not 0 < y < dispsize[1]):
-			hadj=[0,gwh];vadj=[0,gwh]
-			if 0 > x:
-				hadj[0] = abs(x)
-				x = 0
-			elif dispsize[0] < x:
-				hadj[1] = gwh - int(x-dispsize[0])
-			if 0 > y:
-				vadj[0] = abs(y)
-				y = 0
-			elif dispsize[1] < y:
-				vadj[1] = gwh - int(y-dispsize[1])
-			# add adjusted Gaussian to the current heatmap
-			try:
-				heatmap[y:y+vadj[1],x:x+hadj[1]] += gaus[vadj[0]:vadj[1],hadj[0]:hadj[1]] * fix['dur'][i]
-			except:
-				# fixation was probably outside of display
-				pass
-		else:				
-			# add Gaussian to the current heatmap
-			heatmap[y:y+gwh,x:x+gwh] += gaus * fix['dur'][i]
-	# resize heatmap
-	heatmap = heatmap[strt:dispsize[1]+strt,strt:dispsize[0]+strt]
-	# remove zeros
-	lowbound = numpy.mean(heatmap[heatmap>0])
-	heatmap[heatmap<lowbound] = numpy.NaN
-	# draw heatmap on top of image
-	ax.imshow(heatmap, cmap='jet', alpha=alpha)
+	_plot_heatmap(ax, fix, dispsize, durationweight, alpha)
 
 	# FINISH PLOT
 	# invert the y axis, as (0,0) is top left on a display
 	ax.invert_yaxis()
 	# save the figure if a file name was provided
 	if savefilename != None:
-		fig.savefig(savefilename)
+		_save_figure(fig, savefilename)
 	
 	return fig
 
 
-def draw_raw(x, y, dispsize, imagefile=None, savefilename=None):
+def draw_raw(x, y, dispsize, imagefile=None, savefilename=None, headless=False):
 	
 	"""Draws the raw x and y data
 	
@@ -266,6 +239,10 @@ def draw_raw(x, y, dispsize, imagefile=None, savefilename=None):
 					the display (default = None)
 	savefilename	-	full path to the file in which the heatmap should be
 					saved, or None to not save the file (default = None)
+	headless		-	Boolean indicating whether the figure is to be drawn
+					on its own Agg canvas rather than through pyplot, so
+					that pyplot does not keep it open; use
+					figure_to_array to get its pixels (default = False)
 	
 	returns
 	
@@ -274,21 +251,21 @@ def draw_raw(x, y, dispsize, imagefile=None, savefilename=None):
 	"""
 	
 	# image
-	fig, ax = draw_display(dispsize, imagefile=imagefile)
+	fig, ax = draw_display(dispsize, imagefile=imagefile, headless=headless)
 
 	# plot raw data points
-	ax.plot(x, y, 'o', color=COLS['aluminium'][0], markeredgecolor=COLS['aluminium'][5])
+	_plot_raw(ax, x, y)
 
 	# invert the y axis, as (0,0) is top left on a display
 	ax.invert_yaxis()
 	# save the figure if a file name was provided
 	if savefilename != None:
-		fig.savefig(savefilename)
+		_save_figure(fig, savefilename)
 	
 	return fig
 
 
-def draw_scanpath(fixations, saccades, dispsize, imagefile=None, alpha=0.5, savefilename=None):
+def draw_scanpath(fixations, saccades, dispsize, imagefile=None, alpha=0.5, savefilename=None, headless=False):
 	
 	"""Draws a scanpath: a series of arrows between numbered fixations,
 	optionally drawn over an image
@@ -297,10 +274,12 @@ def draw_scanpath(fixations, saccades, dispsize, imagefile=None, alpha=0.5, save
 	
 	fixations		-	a list of fixation ending events from a single trial,
 					as produced by edfreader.read_edf, e.g.
-					edfdata[trialnr]['events']['Efix']
+					edfdata[trialnr]['events']['Efix'], or an EventTable
+					of fixations
 	saccades		-	a list of saccade ending events from a single trial,
 					as produced by edfreader.read_edf, e.g.
-					edfdata[trialnr]['events']['Esac']
+					edfdata[trialnr]['events']['Esac'], or an EventTable
+					of saccades
 	dispsize		-	tuple or list indicating the size of the display,
 					e.g. (1024,768)
 	
@@ -316,6 +295,10 @@ def draw_scanpath(fixations, saccades, dispsize, imagefile=None, alpha=0.5, save
 					is completely untransparant (default = 0.5)
 	savefilename	-	full path to the file in which the heatmap should be
 					saved, or None to not save the file (default = None)
+	headless		-	Boolean indicating whether the figure is to be drawn
+					on its own Agg canvas rather than through pyplot, so
+					that pyplot does not keep it open; use
+					figure_to_array to get its pixels (default = False)
 	
 	returns
 	
@@ -324,38 +307,263 @@ def draw_scanpath(fixations, saccades, dispsize, imagefile=None, alpha=0.5, save
 	"""
 	
 	# image
-	fig, ax = draw_display(dispsize, imagefile=imagefile)
-
-	# FIXATIONS
-	# parse fixations
-	fix = parse_fixations(fixations)
-	# draw fixations
-	ax.scatter(fix['x'],fix['y'], s=(1 * fix['dur'] / 30.0), c=COLS['chameleon'][2], marker='o', cmap='jet', alpha=alpha, edgecolors='none')
-	# draw annotations (fixation numbers)
-	for i in range(len(fixations)):
-		ax.annotate(str(i+1), (fix['x'][i],fix['y'][i]), color=COLS['aluminium'][5], alpha=1, horizontalalignment='center', verticalalignment='center', multialignment='center')
+	fig, ax = draw_display(dispsize, imagefile=imagefile, headless=headless)
 
-	# SACCADES
-	if saccades:
-		# loop through all saccades
-		for st, et, dur, sx, sy, ex, ey in saccades:
-			# draw an arrow between every saccade start and ending
-			ax.arrow(sx, sy, ex-sx, ey-sy, alpha=alpha, fc=COLS['aluminium'][0], ec=COLS['aluminium'][5], fill=True, shape='full', width=10, head_width=20, head_starts_at_zero=False, overhang=0)
+	# FIXATIONS AND SACCADES
+	_plot_scanpath(ax, fixations, saccades, alpha)
 
 	# invert the y axis, as (0,0) is top left on a display
 	ax.invert_yaxis()
 	# save the figure if a file name was provided
 	if savefilename != None:
-		fig.savefig(savefilename)
+		_save_figure(fig, savefilename)
 	
 	return fig
 
 
+def compute_heatmap(fixations, dispsize, durationweight=True, gwh=200, gsdwh=None, threshold=False):
+	
+	"""Returns the heatmap matrix of the provided fixations, as drawn by
+	draw_heatmap, without creating a figure
+	
+	arguments
+	
+	fixations		-	a list of fixation ending events from a single trial,
+					or an EventTable of fixations, or a dict as returned
+					by parse_fixations
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+	
+	keyword arguments
+	
+	durationweight	-	Boolean indicating whether the fixation duration is
+					to be taken into account as a weight for the heatmap
+					intensity; longer duration = hotter (default = True)
+	gwh			-	width and height of the Gaussian kernel in pixels
+					(default = 200)
+	gsdwh		-	standard deviation of the Gaussian kernel in pixels,
+					or None for gwh/6 (default = None)
+	threshold		-	Boolean indicating whether all pixels below the mean
+					of the non-zero pixels are to be set to NaN, as
+					draw_heatmap does before drawing (default = False)
+	
+	returns
+	
+	heatmap		-	a numpy array of shape (dispsize[1], dispsize[0])
+	"""
+	
+	if not isinstance(fixations, dict):
+		fixations = parse_fixations(fixations)
+	if gsdwh == None:
+		gsdwh = gwh/6
+	heatmap = _heatmap(fixations, dispsize, gwh, gsdwh, durationweight)
+	if threshold and numpy.any(heatmap>0):
+		# remove zeros
+		lowbound = numpy.mean(heatmap[heatmap>0])
+		heatmap[heatmap<lowbound] = numpy.nan
+	
+	return heatmap
+
+
+@timed('figure_encode')
+def figure_to_array(fig):
+	
+	"""Renders a figure and returns its pixels
+	
+	arguments
+	
+	fig			-	a matplotlib Figure on an Agg canvas, e.g. as returned
+					by any of the draw functions with headless=True
+	
+	returns
+	
+	rgba			-	a numpy array of shape (height, width, 4) with the
+					RGBA values (uint8) of the rendered figure
+	"""
+	
+	fig.canvas.draw()
+	
+	return numpy.array(fig.canvas.buffer_rgba())
+
+
+# # # # #
+# BATCH RENDERING
+
+class BatchRenderer(object):
+	
+	"""Draws the plots of many trials, reusing one headless figure per
+	display size rather than creating a new figure for every plot
+	
+	keyword arguments
+	
+	cachesize		-	number of display screens (black background with the
+					flipped image drawn onto it) that are kept in memory,
+					least recently used first out; a 1920x1200 screen
+					takes 27 MB, and the cache pays off when several
+					plots are drawn for the same trial (default = 4)
+	
+	The plotting methods take the same arguments as the corresponding
+	draw functions. They return the RGBA pixels of the plot (see
+	figure_to_array), or save the plot and return None if a savefilename
+	is given. As the figures are reused, all artists of the previous plot
+	are removed before drawing the next one. Use the renderer as a context
+	manager, or call close, to release its figures and screens, e.g.:
+	
+	with BatchRenderer() as renderer:
+		for fixations, imagefile in trials:
+			renderer.heatmap(fixations, (1920,1200), imagefile=imagefile)
+	"""
+	
+	def __init__(self, cachesize=4):
+		
+		self.cachesize = cachesize
+		# display size: (figure, axes, background image artist)
+		self._figures = {}
+		# (display size, image file): screen
+		self._screens = OrderedDict()
+	
+	def __enter__(self):
+		
+		return self
+	
+	def __exit__(self, *exc):
+		
+		self.close()
+		return False
+	
+	def fixations(self, fixations, dispsize, imagefile=None, durationsize=True, durationcolour=True, alpha=0.5, savefilename=None):
+		
+		"""Draws fixations like draw_fixations"""
+		
+		fix = parse_fixations(fixations)
+		ax = self._axes(dispsize, imagefile)
+		_plot_fixations(ax, fix, durationsize, durationcolour, alpha)
+		return self._finish(dispsize, savefilename)
+	
+	def heatmap(self, fixations, dispsize, imagefile=None, durationweight=True, alpha=0.5, savefilename=None):
+		
+		"""Draws a heatmap like draw_heatmap"""
+		
+		fix = parse_fixations(fixations)
+		ax = self._axes(dispsize, imagefile)
+		_plot_heatmap(ax, fix, dispsize, durationweight, alpha)
+		return self._finish(dispsize, savefilename)
+	
+	def raw(self, x, y, dispsize, imagefile=None, savefilename=None):
+		
+		"""Draws raw samples like draw_raw"""
+		
+		ax = self._axes(dispsize, imagefile)
+		_plot_raw(ax, x, y)
+		return self._finish(dispsize, savefilename)
+	
+	def scanpath(self, fixations, saccades, dispsize, imagefile=None, alpha=0.5, savefilename=None):
+		
+		"""Draws a scanpath like draw_scanpath"""
+		
+		ax = self._axes(dispsize, imagefile)
+		_plot_scanpath(ax, fixations, saccades, alpha)
+		return self._finish(dispsize, savefilename)
+	
+	def close(self):
+		
+		"""Releases all figures and cached screens"""
+		
+		for fig, ax, background in self._figures.values():
+			fig.clear()
+		self._figures.clear()
+		self._screens.clear()
+	
+	def _screen(self, dispsize, imagefile):
+		
+		key = (dispsize, imagefile)
+		if key in self._screens:
+			self._screens.move_to_end(key)
+		else:
+			screen = display_screen(dispsize, imagefile=imagefile)
+			screen.flags.writeable = False
+			self._screens[key] = screen
+			while len(self._screens) > self.cachesize:
+				self._screens.popitem(last=False)
+		return self._screens[key]
+	
+	def _axes(self, dispsize, imagefile):
+		
+		dispsize = (int(dispsize[0]), int(dispsize[1]))
+		if dispsize not in self._figures:
+			fig, ax = draw_display(dispsize, headless=True)
+			self._figures[dispsize] = (fig, ax, ax.images[0])
+		fig, ax, background = self._figures[dispsize]
+		# remove everything but the background from the previous plot
+		for artist in list(ax.collections) + list(ax.patches) + list(ax.texts) + list(ax.lines) + list(ax.images):
+			if artist is not background:
+				artist.remove()
+		background.set_data(self._screen(dispsize, imagefile))
+		ax.axis([0,dispsize[0],0,dispsize[1]])
+		return ax
+	
+	def _finish(self, dispsize, savefilename):
+		
+		fig, ax, background = self._figures[(int(dispsize[0]), int(dispsize[1]))]
+		# invert the y axis, as (0,0) is top left on a display
+		ax.invert_yaxis()
+		if savefilename != None:
+			_save_figure(fig, savefilename)
+			return None
+		return figure_to_array(fig)
+
+
 # # # # #
 # HELPER FUNCTIONS
 
+# the matplotlib modules used for drawing, set by _matplotlib
+_MPL = None
+
+
+def _matplotlib(pyplot=False):
+
+	# imports matplotlib and applies FONT on the first call, so that
+	# importing this module (e.g. in the worker processes of the runner,
+	# which only need parse_fixations and _heatmap) does not load the
+	# plotting stack; returns the modules and classes used for drawing;
+	# pyplot is only imported when it is asked for, as headless figures
+	# are drawn on their own Agg canvas
+	global _MPL
+	if _MPL is None:
+		import matplotlib
+		from matplotlib import image, font_manager
+		from matplotlib.axes import Axes
+		from matplotlib.figure import Figure
+		from matplotlib.backends.backend_agg import FigureCanvasAgg
+		matplotlib.rc('font', **_installed_font(font_manager))
+		_MPL = types.SimpleNamespace(matplotlib=matplotlib, pyplot=None, image=image, Axes=Axes,
+			Figure=Figure, FigureCanvasAgg=FigureCanvasAgg)
+	if pyplot and _MPL.pyplot is None:
+		from matplotlib import pyplot as _pyplot
+		_MPL.pyplot = _pyplot
+	return _MPL
+
+
+def _installed_font(font_manager):
+
+	# FONT without the families that are not installed, as matplotlib warns
+	# about a missing family every time it draws text; the default family
+	# is kept if none of them is installed
+	font = dict(FONT)
+	families = FONT['family']
+	if isinstance(families, str):
+		families = [families]
+	installed = set(f.name for f in font_manager.fontManager.ttflist)
+	generic = set(font_manager.font_family_aliases)
+	families = [f for f in families if f in installed or f.lower() in generic]
+	if families:
+		font['family'] = families
+	else:
+		del font['family']
+	return font
+
 
-def draw_display(dispsize, imagefile=None):
+def draw_display(dispsize, imagefile=None, headless=False):
 	
 	"""Returns a matplotlib.pyplot Figure and its axes, with a size of
 	dispsize, a black background colour, and optionally with an image drawn
@@ -373,6 +581,10 @@ def draw_display(dispsize, imagefile=None):
 					may be smaller than the display size, the function
 					assumes that the image was presented at the centre of
 					the display (default = None)
+	headless		-	Boolean indicating whether the figure is to be drawn
+					on its own Agg canvas rather than through pyplot, so
+					that pyplot does not keep it open; use
+					figure_to_array to get its pixels (default = False)
 	
 	returns
 	fig, ax		-	matplotlib.pyplot Figure and its axes: field of zeros
@@ -380,10 +592,62 @@ def draw_display(dispsize, imagefile=None):
 					if an imagefile was passed
 	"""
 	
+	# construct screen (black background), with the image drawn onto it
+	screen = display_screen(dispsize, imagefile=imagefile)
+	# dots per inch
+	dpi = 100.0
+	# determine the figure size in inches
+	figsize = (dispsize[0]/dpi, dispsize[1]/dpi)
+	# create a figure
+	mpl = _matplotlib(pyplot=not headless)
+	if headless:
+		fig = mpl.Figure(figsize=figsize, dpi=dpi, frameon=False)
+		mpl.FigureCanvasAgg(fig)
+	else:
+		fig = mpl.pyplot.figure(figsize=figsize, dpi=dpi, frameon=False)
+	ax = mpl.Axes(fig, [0,0,1,1])
+	ax.set_axis_off()
+	fig.add_axes(ax)
+	# plot display
+	ax.axis([0,dispsize[0],0,dispsize[1]])
+	ax.imshow(screen)#, origin='upper')
+	
+	return fig, ax
+
+
+@timed('figure_encode')
+def _save_figure(fig, savefilename):
+	
+	# renders the figure to a file
+	fig.savefig(savefilename)
+
+
+@timed('display_screen')
+def display_screen(dispsize, imagefile=None):
+	
+	"""Returns the pixels of the display as drawn by draw_display: a black
+	background with a size of dispsize, and optionally an image drawn onto
+	its centre
+	
+	arguments
+	
+	dispsize		-	tuple or list indicating the size of the display,
+					e.g. (1024,768)
+	
+	keyword arguments
+	
+	imagefile		-	full path to an image file, or None for no image
+					(default = None)
+	
+	returns
+	screen		-	a numpy array of shape (dispsize[1], dispsize[0], 3);
+					float32 for PNG images and no image, uint8 otherwise
+	"""
+	
 	# construct screen (black background)
-	_, ext = os.path.splitext(imagefile)
-	ext = ext.lower()
-	data_type = 'float32' if ext == '.png' else 'uint8'
+	data_type = 'float32'
+	if imagefile != None and os.path.splitext(imagefile)[1].lower() != '.png':
+		data_type = 'uint8'
 	screen = numpy.zeros((dispsize[1],dispsize[0],3), dtype=data_type)
 	# if an image location has been passed, draw the image
 	if imagefile != None:
@@ -391,35 +655,73 @@ def draw_display(dispsize, imagefile=None):
 		if not os.path.isfile(imagefile):
 			raise Exception("ERROR in draw_display: imagefile not found at '%s'" % imagefile)
 		# load image
-		img = image.imread(imagefile)
+		img = _matplotlib().image.imread(imagefile)
 		# flip image over the horizontal axis
 		# (do not do so on Windows, as the image appears to be loaded with
 		# the correct side up there; what's up with that? :/)
 		if not os.name == 'nt':
 			img = numpy.flipud(img)
+		# greyscale images have no colour axis
+		if img.ndim == 2:
+			img = img[:,:,numpy.newaxis]
 		# width and height of the image
 		w, h = len(img[0]), len(img)
 		# x and y position of the image on the display
-		x = dispsize[0]/2 - w/2
-		y = dispsize[1]/2 - h/2
-		# draw the image on the screen
-		screen[y:y+h,x:x+w,:] += img
-	# dots per inch
-	dpi = 100.0
-	# determine the figure size in inches
-	figsize = (dispsize[0]/dpi, dispsize[1]/dpi)
-	# create a figure
-	fig = pyplot.figure(figsize=figsize, dpi=dpi, frameon=False)
-	ax = pyplot.Axes(fig, [0,0,1,1])
-	ax.set_axis_off()
-	fig.add_axes(ax)
-	# plot display
-	ax.axis([0,dispsize[0],0,dispsize[1]])
-	ax.imshow(screen)#, origin='upper')
+		x = int(dispsize[0]/2 - w/2)
+		y = int(dispsize[1]/2 - h/2)
+		# draw the image on the screen (without its alpha channel)
+		screen[y:y+h,x:x+w,:] += img[:,:,:3]
 	
-	return fig, ax
+	return screen
+
+
+def _plot_fixations(ax, fix, durationsize, durationcolour, alpha):
+	
+	# duration weigths
+	if durationsize:
+		siz = 1 * (fix['dur']/30.0)
+	else:
+		siz = 1 * numpy.median(fix['dur']/30.0)
+	if durationcolour:
+		col = fix['dur']
+	else:
+		col = COLS['chameleon'][2]
+	# draw circles
+	ax.scatter(fix['x'],fix['y'], s=siz, c=col, marker='o', cmap='jet', alpha=alpha, edgecolors='none')
+
+
+def _plot_heatmap(ax, fix, dispsize, durationweight, alpha):
+	
+	heatmap = compute_heatmap(fix, dispsize, durationweight=durationweight, threshold=True)
+	# draw heatmap on top of image
+	ax.imshow(heatmap, cmap='jet', alpha=alpha)
+
+
+def _plot_raw(ax, x, y):
+	
+	ax.plot(x, y, 'o', color=COLS['aluminium'][0], markeredgecolor=COLS['aluminium'][5])
 
 
+def _plot_scanpath(ax, fixations, saccades, alpha):
+	
+	# FIXATIONS
+	# parse fixations
+	fix = parse_fixations(fixations)
+	# draw fixations
+	ax.scatter(fix['x'],fix['y'], s=(1 * fix['dur'] / 30.0), c=COLS['chameleon'][2], marker='o', alpha=alpha, edgecolors='none')
+	# draw annotations (fixation numbers)
+	for i in range(len(fixations)):
+		ax.annotate(str(i+1), (fix['x'][i],fix['y'][i]), color=COLS['aluminium'][5], alpha=1, horizontalalignment='center', verticalalignment='center', multialignment='center')
+
+	# SACCADES
+	if saccades:
+		# loop through all saccades
+		for st, et, dur, sx, sy, ex, ey in saccades:
+			# draw an arrow between every saccade start and ending
+			ax.arrow(sx, sy, ex-sx, ey-sy, alpha=alpha, fc=COLS['aluminium'][0], ec=COLS['aluminium'][5], fill=True, shape='full', width=10, head_width=20, head_starts_at_zero=False, overhang=0)
+
+
+@timed('gaussian')
 def gaussian(x, sx, y=None, sy=None):
 	
 	"""Returns an array of numpy arrays (a matrix) containing values between
@@ -442,16 +744,129 @@ def gaussian(x, sx, y=None, sy=None):
 	# centers	
 	xo = x/2
 	yo = y/2
-	# matrix of zeros
-	M = numpy.zeros([y,x],dtype=float)
 	# gaussian matrix
-	for i in range(x):
-		for j in range(y):
-			M[j,i] = numpy.exp(-1.0 * (((float(i)-xo)**2/(2*sx*sx)) + ((float(j)-yo)**2/(2*sy*sy)) ) )
+	i = numpy.arange(x, dtype=float)
+	j = numpy.arange(y, dtype=float)[:,numpy.newaxis]
+	M = numpy.exp(-1.0 * (((i-xo)**2/(2*sx*sx)) + ((j-yo)**2/(2*sy*sy)) ) )
 
 	return M
 
 
+def gaussian_kernel(x, sx, y=None, sy=None):
+	
+	"""Returns the same matrix as gaussian, but from a cache of the most
+	recently used kernels (see KERNEL_CACHE_SIZE); the returned matrix is
+	shared between calls and therefore read-only
+	
+	arguments
+	x		-- width in pixels
+	sx		-- width standard deviation
+	
+	keyword argments
+	y		-- height in pixels (default = x)
+	sy		-- height standard deviation (default = sx)
+	"""
+	
+	global _cached_gaussian
+	
+	if y == None:
+		y = x
+	if sy == None:
+		sy = sx
+	
+	# the cache is built on first use, and again whenever
+	# KERNEL_CACHE_SIZE has changed
+	if _cached_gaussian is None or _cached_gaussian.cache_parameters()['maxsize'] != KERNEL_CACHE_SIZE:
+		_cached_gaussian = functools.lru_cache(maxsize=KERNEL_CACHE_SIZE)(_readonly_gaussian)
+	
+	return _cached_gaussian(int(x), float(sx), int(y), float(sy))
+
+
+# lru_cache of _readonly_gaussian, see gaussian_kernel
+_cached_gaussian = None
+
+
+def _readonly_gaussian(x, sx, y, sy):
+	
+	M = gaussian(x, sx, y, sy)
+	M.flags.writeable = False
+	
+	return M
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_gaussian_fft(gwh, gsdwh, shape):
+	
+	# Fourier transform of a Gaussian kernel, zero-padded to shape
+	return numpy.fft.rfft2(gaussian_kernel(gwh, gsdwh), s=shape)
+
+
+@timed('heatmap', items=lambda args, result: len(args[0]['x']))
+def _heatmap(fix, dispsize, gwh, gsdwh, durationweight, out=None):
+	
+	"""Returns a heatmap of display size, in which a Gaussian kernel of gwh
+	pixels with standard deviation gsdwh is centred on every fixation and
+	optionally weighted by the fixation duration; kernels are clipped at
+	the display edges; if an array is passed as out, the kernels are added
+	to it rather than to a new array
+	"""
+	
+	w, h = int(dispsize[0]), int(dispsize[1])
+	if out is None:
+		heatmap = numpy.zeros((h, w), dtype=float)
+	else:
+		heatmap = out
+	# top left of every kernel on the display (the kernel centre is on the
+	# integer part of the fixation coordinate)
+	valid = numpy.isfinite(fix['x']) & numpy.isfinite(fix['y'])
+	x = fix['x'][valid].astype(int) - gwh//2
+	y = fix['y'][valid].astype(int) - gwh//2
+	if durationweight:
+		weight = numpy.asarray(fix['dur'], dtype=float)[valid]
+	else:
+		weight = numpy.ones(len(x))
+	# skip kernels that do not overlap with the display
+	visible = (x > -gwh) & (x < w) & (y > -gwh) & (y < h) & (weight != 0)
+	x, y, weight = x[visible], y[visible], weight[visible]
+	if len(x) == 0:
+		return heatmap
+	
+	# few fixations: add a clipped kernel per fixation
+	gh, gw = h + 2*gwh, w + 2*gwh
+	if len(x) * gwh * gwh <= HEATMAP_FFT_RATIO * gh * gw:
+		gaus = gaussian_kernel(gwh, gsdwh)
+		# clipped kernel bounds on the display (h0:h1, v0:v1) and within
+		# the kernel (kh0:kh1, kv0:kv1), for all fixations at once
+		h0 = numpy.maximum(x, 0)
+		h1 = numpy.minimum(x+gwh, w)
+		v0 = numpy.maximum(y, 0)
+		v1 = numpy.minimum(y+gwh, h)
+		kh0, kh1 = h0-x, h1-x
+		kv0, kv1 = v0-y, v1-y
+		for i in range(len(x)):
+			heatmap[v0[i]:v1[i],h0[i]:h1[i]] += gaus[kv0[i]:kv1[i],kh0[i]:kh1[i]] * weight[i]
+		return heatmap
+	
+	# many fixations: put the weights of all fixations on a grid, with a
+	# margin of gwh pixels on every side, and convolve it with the kernel
+	impulses = numpy.zeros((gh, gw), dtype=float)
+	numpy.add.at(impulses, (y+gwh, x+gwh), weight)
+	convolved = numpy.fft.irfft2(numpy.fft.rfft2(impulses) * _cached_gaussian_fft(gwh, gsdwh, (gh, gw)), s=(gh, gw))[gwh:gwh+h,gwh:gwh+w]
+	# pixels that are not covered by any kernel are exactly zero, as they
+	# would be when adding kernels one by one; this is determined from a box
+	# sum over the number of fixations on the grid
+	counts = numpy.zeros((gh+1, gw+1), dtype=int)
+	numpy.add.at(counts, (y+gwh+1, x+gwh+1), 1)
+	counts = counts.cumsum(axis=0).cumsum(axis=1)
+	covered = (counts[gwh+1:gwh+h+1,gwh+1:gwh+w+1] - counts[1:h+1,gwh+1:gwh+w+1]
+		- counts[gwh+1:gwh+h+1,1:w+1] + counts[1:h+1,1:w+1]) > 0
+	convolved[~covered] = 0.0
+	heatmap += convolved
+	
+	return heatmap
+
+
+@timed('parse_fixations', items=lambda args, result: len(result['x']))
 def parse_fixations(fixations):
 	
 	"""Returns all relevant data from a list of fixation ending events
@@ -460,24 +875,27 @@ def parse_fixations(fixations):
 	
 	fixations		-	a list of fixation ending events from a single trial,
 					as produced by edfreader.read_edf, e.g.
-					edfdata[trialnr]['events']['Efix']
+					edfdata[trialnr]['events']['Efix'], or an EventTable
+					of fixations as returned by the detectors with
+					table=True
 
 	returns
 	
 	fix		-	a dict with three keys: 'x', 'y', and 'dur' (each contain
 				a numpy array) for the x and y coordinates and duration of
-				each fixation
+				each fixation; for an EventTable, these are views of its
+				columns rather than copies
 	"""
 	
-	# empty arrays to contain fixation coordinates
-	fix = {	'x':numpy.zeros(len(fixations)),
-			'y':numpy.zeros(len(fixations)),
-			'dur':numpy.zeros(len(fixations))}
-	# get all fixation coordinates
-	for fixnr in range(len( fixations)):
-		stime, etime, dur, ex, ey = fixations[fixnr]
-		fix['x'][fixnr] = ex
-		fix['y'][fixnr] = ey
-		fix['dur'][fixnr] = dur
+	# use the columns of an EventTable directly
+	if isinstance(fixations, EventTable):
+		return {	'x':fixations['endx'],
+				'y':fixations['endy'],
+				'dur':fixations['duration']}
+	# convert all fixations at once
+	events = numpy.array(fixations, dtype=float).reshape(-1, len(FIXATION_COLUMNS))
+	fix = {	'x':events[:,3],
+			'y':events[:,4],
+			'dur':events[:,2]}
 	
 	return fix
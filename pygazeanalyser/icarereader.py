@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# ICARE Reader
+#
+# Reads the per-trial sample files of the ICARE dataset. The data directory
+# holds one directory per participant, containing one directory per dataset
+# (task), in which every trial is stored as <n>_<image>.csv, where n is the
+# zero-based trial number. Every file has a ',x,y,times' header, followed by
+# one line per sample; missing samples have empty x and y fields, which are
+# read as NaN.
+
+import os
+import csv
+
+import numpy
+
+from pygazeanalyser.profiling import timed, result_length
+
+
+@timed('read_trial', items=result_length)
+def read_trial(filename):
+    """Returns the samples of a single trial file
+
+	arguments
+
+	filename	-	path to a trial file, e.g. 'data/3/sr/0_9379_1_0.csv'
+
+	returns
+	x, y, time
+				x	-	numpy array of x positions (NaN for missing samples)
+				y	-	numpy array of y positions (NaN for missing samples)
+				time	-	numpy array of timestamps in milliseconds
+	"""
+
+    if not os.path.isfile(filename):
+        raise Exception("ERROR in read_trial: file '%s' does not exist" % filename)
+    data = numpy.genfromtxt(filename, delimiter=',', skip_header=1, usecols=(1, 2, 3), ndmin=2)
+    return data[:, 0].copy(), data[:, 1].copy(), data[:, 2].copy()
+
+
+def trial_filename(datadir, participant, dataset, trial, image):
+    """Returns the path to the sample file of a trial, as listed in
+    images.csv (trial numbers there start at 1)
+	"""
+
+    return os.path.join(datadir, str(participant), dataset, "%d_%s.csv" % (int(trial) - 1, image))
+
+
+def list_trials(datadir):
+    """Returns all trial files in the data directory, sorted by participant,
+    dataset and trial
+
+	arguments
+
+	datadir	-	path to the data directory
+
+	returns
+	trials
+				trials	-	list of (participant, dataset, trial, image, path)
+						tuples, with the trial number starting at 1 as in
+						images.csv
+	"""
+
+    trials = []
+    for participant in os.listdir(datadir):
+        pdir = os.path.join(datadir, participant)
+        if not participant.isdigit() or not os.path.isdir(pdir):
+            continue
+        for dataset in os.listdir(pdir):
+            ddir = os.path.join(pdir, dataset)
+            if not os.path.isdir(ddir):
+                continue
+            for name in os.listdir(ddir):
+                base, ext = os.path.splitext(name)
+                n, _, image = base.partition('_')
+                if ext.lower() != '.csv' or not n.isdigit() or not image:
+                    continue
+                trials.append((int(participant), dataset, int(n) + 1, image, os.path.join(ddir, name)))
+    trials.sort()
+    return trials
+
+
+def read_images(filename):
+    """Returns the trials listed in images.csv, in the order of the file
+
+	arguments
+
+	filename	-	path to images.csv, e.g. 'data/images.csv'
+
+	returns
+	trials
+				trials	-	list of (participant, dataset, trial, image)
+						tuples, with the trial number starting at 1
+	"""
+
+    if not os.path.isfile(filename):
+        raise Exception("ERROR in read_images: file '%s' does not exist" % filename)
+    trials = []
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            trials.append((int(row['participant']), row['dataset'], int(row['trial']), row['image']))
+    return trials
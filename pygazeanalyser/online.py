@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Online Detection
+#
+# Incremental versions of the detectors, for samples that arrive one at a
+# time, e.g. from a PyTribe stream. Every detector takes samples with
+# push(x, y, t), and returns the events that were decided by that sample as
+# a list of starting and a list of ending events, in the format of the
+# corresponding function in detectors. flush() ends the stream, returns the
+# events that were still open, and resets the detector for the next trial.
+# Replaying the samples of a trial, and concatenating everything that push
+# and flush return, gives what the batch function returns for that trial
+# (see replay), exactly except as noted below.
+#
+# A detector only keeps the samples it can still need: a handful for the
+# fixation, saccade and blink detectors, and the samples of the window that
+# is being tested for the dispersion detector, which keeps running sums of
+# the samples of a fixation instead of the samples themselves. Its
+# fixation positions are the means of those sums, which equal the averages
+# of fixation_detection_dd up to floating-point rounding (exactly, for
+# whole pixel positions as in the ICARE data).
+
+import math
+
+import numpy
+
+
+class OnlineFixationDetector(object):
+    """Incremental version of detectors.fixation_detection
+
+	keyword arguments
+
+	missing	-	value to be used for missing data (default = 0.0)
+	maxdist	-	maximal inter sample distance in pixels (default = 25)
+	mindur	-	minimal duration of a fixation in milliseconds
+				(default = 50)
+	"""
+
+    def __init__(self, missing=0.0, maxdist=25, mindur=50):
+        self.missing = missing
+        self.maxdist = maxdist
+        self.mindur = mindur
+        self.reset()
+
+    def reset(self):
+        """Discards the current trial"""
+        # point of comparison, whether a fixation is running, the start time
+        # of that fixation, and the time of the previous sample
+        self._ref = None
+        self._fixstart = False
+        self._start = None
+        self._last = None
+
+    def push(self, x, y, t):
+        """Adds a sample, and returns the fixations it ended as Sfix, Efix"""
+        Sfix, Efix = [], []
+        if _removed(x, y, self.missing):
+            return Sfix, Efix
+        if self._ref is None:
+            self._ref = (x, y)
+            self._last = t
+            return Sfix, Efix
+        # the same distance as computed by fixation_detection
+        squared_distance = ((self._ref[0] - x) ** 2 + (self._ref[1] - y) ** 2)
+        dist = 0.0
+        if squared_distance > 0:
+            dist = squared_distance ** 0.5
+        if dist <= self.maxdist and not self._fixstart:
+            # start a new fixation
+            self._ref = (x, y)
+            self._fixstart = True
+            self._start = t
+        elif dist > self.maxdist and self._fixstart:
+            # end the current fixation, if it lasted long enough
+            self._fixstart = False
+            if self._last - self._start >= self.mindur:
+                Sfix.append([self._start])
+                Efix.append([self._start, self._last, self._last - self._start, self._ref[0], self._ref[1]])
+            self._ref = (x, y)
+        elif not self._fixstart:
+            self._ref = (x, y)
+        self._last = t
+        return Sfix, Efix
+
+    def flush(self):
+        """Ends the trial, and returns the fixation that was still running
+        (regardless of its duration, as fixation_detection does)"""
+        Sfix, Efix = [], []
+        if self._fixstart:
+            Sfix.append([self._start])
+            Efix.append([self._start, self._last, self._last - self._start, self._ref[0], self._ref[1]])
+        self.reset()
+        return Sfix, Efix
+
+
+class OnlineDispersionDetector(object):
+    """Incremental version of detectors.fixation_detection_dd
+
+	keyword arguments
+
+	missing	-	value to be used for missing data (default = 0.0)
+	maxdist	-	maximal dispersion in pixels (default = 25)
+	mindur	-	minimal duration of a fixation in milliseconds
+				(default = 50)
+	hz		-	sampling rate in Hz (default = 60)
+	window	-	'samples' or 'time' (default = 'samples'); see
+				detectors.fixation_detection_dd
+
+	A 'samples' window is tested once the sample after it has arrived, as
+	fixation_detection_dd only tests windows that end before the last
+	sample of a trial; a 'time' window is tested once its last sample has
+	arrived.
+	"""
+
+    def __init__(self, missing=0.0, maxdist=25, mindur=50, hz=60, window='samples'):
+        if window not in ('samples', 'time'):
+            raise Exception("ERROR in OnlineDispersionDetector: unknown window '%s'" % window)
+        self.missing = missing
+        self.maxdist = maxdist
+        self.mindur = mindur
+        self.window = window
+        # number of samples that cover the minimal fixation duration
+        self.timeframe_points = mindur / 1000 * hz
+        self.reset()
+
+    def reset(self):
+        """Discards the current trial"""
+        # number of samples so far, and the samples from index _base onwards
+        self._n = 0
+        self._base = 0
+        self._x = []
+        self._y = []
+        self._t = []
+        # first sample of the next window to test, and the first sample
+        # that may end a 'time' window starting there
+        self._pos = 0
+        self._scan = 0
+        # [start, end (exclusive), hix, lox, hiy, loy, sum of x, sum of y,
+        # start time, end time] of a running fixation, whose samples are
+        # dropped as they are added to it
+        self._fix = None
+
+    def push(self, x, y, t):
+        """Adds a sample, and returns the fixations it ended as Sfix, Efix"""
+        Sfix, Efix = [], []
+        if _removed(x, y, self.missing):
+            return Sfix, Efix
+        self._x.append(x)
+        self._y.append(y)
+        self._t.append(t)
+        self._n += 1
+        self._advance(Sfix, Efix)
+        return Sfix, Efix
+
+    def flush(self):
+        """Ends the trial, and returns the fixation that was still running"""
+        Sfix, Efix = [], []
+        if self._fix is not None:
+            self._emit(self._n, Sfix, Efix)
+        self.reset()
+        return Sfix, Efix
+
+    def _window_end(self, si):
+        # end (exclusive) of the window that starts at sample si, computed
+        # as in fixation_detection_dd, or None if it can not be tested yet
+        last = self._n - 1
+        if self.window == 'samples':
+            end = int(math.ceil(si + self.timeframe_points)) + 1
+            return end if end <= last else None
+        # the first sample at least mindur after si; as timestamps do not
+        # decrease, the search continues where it ended for the previous si
+        target = self._t[si - self._base] + self.mindur
+        self._scan = max(self._scan, si)
+        while self._scan <= last:
+            if self._t[self._scan - self._base] >= target:
+                return self._scan + 1
+            self._scan += 1
+        return None
+
+    def _advance(self, Sfix, Efix):
+        last = self._n - 1
+        while True:
+            if self._fix is not None:
+                # grow the fixation for as long as the new samples lie within
+                # maxdist of its bounding box
+                si, i, hix, lox, hiy, loy, sx, sy, start, end = self._fix
+                while i <= last:
+                    px = self._x[i - self._base]
+                    py = self._y[i - self._base]
+                    dx = _maximum(hix - px, px - lox)
+                    dy = _maximum(hiy - py, py - loy)
+                    if not math.sqrt(dx * dx + dy * dy) <= self.maxdist:
+                        break
+                    hix, lox = _maximum(hix, px), _minimum(lox, px)
+                    hiy, loy = _maximum(hiy, py), _minimum(loy, py)
+                    sx += px
+                    sy += py
+                    end = self._t[i - self._base]
+                    i += 1
+                self._fix = [si, i, hix, lox, hiy, loy, sx, sy, start, end]
+                self._trim(i)
+                if i > last:
+                    return
+                self._emit(i, Sfix, Efix)
+            # test the windows of which all samples have arrived
+            end = self._window_end(self._pos)
+            if end is None:
+                return
+            s, e = self._pos - self._base, end - self._base
+            wx = numpy.array(self._x[s:e])
+            wy = numpy.array(self._y[s:e])
+            hix, lox, hiy, loy = numpy.amax(wx), numpy.amin(wx), numpy.amax(wy), numpy.amin(wy)
+            dx, dy = hix - lox, hiy - loy
+            if math.sqrt(dx * dx + dy * dy) <= self.maxdist:
+                self._fix = [self._pos, end, hix, lox, hiy, loy, sum(self._x[s:e]), sum(self._y[s:e]),
+                             self._t[s], self._t[e - 1]]
+                self._trim(end)
+            else:
+                self._pos += 1
+                self._trim(self._pos)
+
+    def _emit(self, i, Sfix, Efix):
+        # ends the running fixation at sample i (exclusive)
+        si, sx, sy, start, end = self._fix[0], self._fix[6], self._fix[7], self._fix[8], self._fix[9]
+        Sfix.append([start])
+        Efix.append([start, end, end - start, sx / (i - si), sy / (i - si)])
+        self._fix = None
+        self._pos = i
+        self._trim(i)
+
+    def _trim(self, index):
+        # drops the samples before index
+        if index > self._base:
+            k = index - self._base
+            del self._x[:k], self._y[:k], self._t[:k]
+            self._base = index
+
+
+class OnlineSaccadeDetector(object):
+    """Incremental version of detectors.saccade_detection
+
+	keyword arguments
+
+	missing	-	value to be used for missing data (default = 0.0)
+	minlen	-	minimal length of saccades in milliseconds (default = 5)
+	maxvel	-	velocity threshold in pixels/second (default = 40)
+	maxacc	-	acceleration threshold in pixels / second**2
+				(default = 340)
+
+	A saccade is decided two samples after the velocity first drops below
+	the thresholds, as saccade_detection ends saccades there.
+	"""
+
+    def __init__(self, missing=0.0, minlen=5, maxvel=40, maxacc=340):
+        self.missing = missing
+        self.minlen = minlen
+        self.maxvel = maxvel
+        self.maxacc = maxacc
+        self.reset()
+
+    def reset(self):
+        """Discards the current trial"""
+        # number of samples so far, the previous sample and velocity
+        self._n = 0
+        self._prev = None
+        self._vel = None
+        # 'search' for a start from sample _from onwards, 'saccade' while
+        # looking for the end, or 'end' while waiting for the end sample
+        self._state = 'search'
+        self._from = 1
+        self._start = None
+        self._startindex = None
+        self._endsample = None
+        self._last = None
+
+    def push(self, x, y, t):
+        """Adds a sample, and returns the saccades it decided as Ssac, Esac"""
+        Ssac, Esac = [], []
+        if _removed(x, y, self.missing):
+            return Ssac, Esac
+        j = self._n
+        self._n += 1
+        sample = (x, y, t)
+        if self._state == 'end' and j == self._endsample:
+            self._finish(sample, Ssac, Esac)
+        if self._prev is not None:
+            # velocity between the previous sample (k) and this one, as
+            # computed by saccade_detection
+            k = j - 1
+            px, py, pt = self._prev
+            vel = _divide(math.sqrt((x - px) * (x - px) + (y - py) * (y - py)), (t - pt) / 1000.0)
+            if k >= 1:
+                acc = vel - self._vel
+                if self._state == 'search' and k >= self._from:
+                    if vel > self.maxvel or acc > self.maxacc:
+                        self._state = 'saccade'
+                        self._start = self._prev
+                        self._startindex = k
+                elif self._state == 'saccade' and k >= self._startindex + 1:
+                    if vel < self.maxvel and acc < self.maxacc:
+                        # the saccade ends two samples further on
+                        self._state = 'end'
+                        self._endsample = k + 2
+            self._vel = vel
+        self._prev = sample
+        return Ssac, Esac
+
+    def flush(self):
+        """Ends the trial; a saccade that was waiting for its end sample
+        ends at the last sample, and a saccade without an end is returned
+        as a starting event only, as saccade_detection does"""
+        Ssac, Esac = [], []
+        if self._state == 'end':
+            self._finish(self._prev, Ssac, Esac)
+        elif self._state == 'saccade':
+            Ssac.append([self._start[2]])
+        self.reset()
+        return Ssac, Esac
+
+    def _finish(self, end, Ssac, Esac):
+        # ends the saccade at sample end, if it lasted long enough
+        sx, sy, st = self._start
+        ex, ey, et = end
+        if et - st >= self.minlen:
+            Ssac.append([st])
+            Esac.append([st, et, et - st, sx, sy, ex, ey])
+        self._state = 'search'
+        self._from = self._endsample + 1
+
+
+class OnlineBlinkDetector(object):
+    """Incremental version of detectors.blink_detection
+
+	keyword arguments
+
+	missing	-	value to be used for missing data (default = 0.0)
+	minlen	-	minimal number of consecutive missing samples
+				(default = 10)
+	"""
+
+    def __init__(self, missing=0.0, minlen=10):
+        self.missing = missing
+        self.minlen = minlen
+        self.reset()
+
+    def reset(self):
+        """Discards the current trial"""
+        # number of samples so far, the first sample of the current run of
+        # missing samples, and the time of the last sample
+        self._n = 0
+        self._run = None
+        self._last = None
+
+    def push(self, x, y, t):
+        """Adds a sample, and returns the blinks it ended as Sblk, Eblk"""
+        Sblk, Eblk = [], []
+        missing = (x == self.missing and y == self.missing) or x != x or y != y
+        if missing and self._run is None:
+            self._run = (self._n, t)
+        elif not missing and self._run is not None:
+            # a blink ends at the first valid sample after it
+            start, st = self._run
+            if self._n - start >= self.minlen:
+                Sblk.append([st])
+                Eblk.append([st, t, t - st])
+            self._run = None
+        self._n += 1
+        self._last = t
+        return Sblk, Eblk
+
+    def flush(self):
+        """Ends the trial; a blink that runs until the end of the trial ends
+        at its last sample"""
+        Sblk, Eblk = [], []
+        if self._run is not None:
+            start, st = self._run
+            if self._n - start >= self.minlen:
+                Sblk.append([st])
+                Eblk.append([st, self._last, self._last - st])
+        self.reset()
+        return Sblk, Eblk
+
+
+def replay(detector, x, y, time):
+    """Pushes all samples of a trial into an online detector and flushes it
+
+	arguments
+
+	detector	-	one of the online detectors
+	x		-	numpy array of x positions
+	y		-	numpy array of y positions
+	time		-	numpy array of timestamps in milliseconds
+
+	returns
+	starts, ends	-	all events, in the format of the corresponding batch
+				detector
+	"""
+
+    starts, ends = [], []
+    for sample in zip(numpy.asarray(x, dtype=float).tolist(), numpy.asarray(y, dtype=float).tolist(),
+                      numpy.asarray(time, dtype=float).tolist()):
+        s, e = detector.push(*sample)
+        starts.extend(s)
+        ends.extend(e)
+    s, e = detector.flush()
+    starts.extend(s)
+    ends.extend(e)
+    return starts, ends
+
+
+def _removed(x, y, missing):
+    # samples that detectors.remove_missing drops
+    return (x == missing and y == missing) or x != x or y != y
+
+
+def _maximum(a, b):
+    # numpy.maximum of two floats, which is NaN if either is NaN
+    return a if a >= b or a != a else b
+
+
+def _minimum(a, b):
+    # numpy.minimum of two floats, which is NaN if either is NaN
+    return a if a <= b or a != a else b
+
+
+def _divide(a, b):
+    # float division with numpy's results for a zero divisor
+    if b == 0:
+        if a == 0 or a != a:
+            return float('nan')
+        return math.copysign(float('inf'), a) * math.copysign(1.0, b)
+    return a / b
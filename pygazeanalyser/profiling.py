@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Profiling
+#
+# Opt-in timing of the stages of an analysis: reading trial files, removing
+# missing samples, event detection, parsing fixations, kernel generation,
+# heatmap accumulation and figure encoding are marked with the timed
+# decorator. While profiling is enabled, every call of a marked function is
+# recorded with its wall time, its number of items (samples or fixations)
+# and, optionally, the memory it allocated; while it is disabled, a marked
+# function only costs one extra call and a check of a global.
+#
+# Profiling is enabled for a block of code with
+#	with profiling.profile() as prof:
+#		...
+#	print(prof.summary())
+#	prof.save_trace('trace.json')
+# or for a whole run by setting the environment variable
+# PYGAZEANALYSER_PROFILE, to 1 to print the summary on exit, or to the name
+# of a .json file to also write the trace there. Traces are in the Chrome
+# trace event format, which can be opened in chrome://tracing, Perfetto or
+# speedscope. Stages can be nested; the time of a stage includes that of
+# the stages it calls. Calls in other processes (e.g. the workers of
+# runner.run_detection) are not recorded.
+
+import os
+import sys
+import json
+import time
+import inspect
+import atexit
+import functools
+import threading
+import contextlib
+import tracemalloc
+from collections import OrderedDict
+
+import numpy
+
+
+# the Profile that calls are recorded in, or None when disabled
+_active = None
+# per-thread stack of memory counters of the running stages
+_local = threading.local()
+
+
+class Profile(object):
+    """Record of the calls to all marked stages
+
+	keyword arguments
+
+	allocations	-	Boolean indicating whether the memory allocated by
+				every stage is to be traced with tracemalloc, which
+				slows down all Python code considerably while
+				profiling (default = False)
+
+	stages holds, for every stage name, a dict with the number of calls,
+	the total time in seconds, the total number of items and the largest
+	amount of memory in bytes that a single call allocated (None if
+	allocations are not traced); events holds every call as a (name,
+	start, duration, thread, items) tuple, with times in seconds since the
+	start of the profile.
+	"""
+
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.stages = OrderedDict()
+        self.events = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        # whether tracemalloc was started for this profile
+        self._tracemalloc = False
+
+    def record(self, name, start, stop, items=0, allocated=None):
+        """Adds a single call of a stage, with start and stop as given by
+        time.perf_counter"""
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = {'calls': 0, 'seconds': 0.0, 'items': 0, 'allocated': None}
+                self.stages[name] = stage
+            stage['calls'] += 1
+            stage['seconds'] += stop - start
+            stage['items'] += items
+            if allocated is not None:
+                stage['allocated'] = max(allocated, stage['allocated'] or 0)
+            self.events.append((name, start - self._start, stop - start, threading.get_ident(), items))
+
+    def summary(self):
+        """Returns a table of all stages, slowest first"""
+        lines = ["%-24s %8s %10s %10s %12s %14s %10s" %
+                 ('stage', 'calls', 'total s', 'mean ms', 'items', 'items/s', 'alloc MB')]
+        for name, stage in sorted(self.stages.items(), key=lambda s: -s[1]['seconds']):
+            rate = stage['items'] / stage['seconds'] if stage['items'] and stage['seconds'] > 0 else 0
+            allocated = '' if stage['allocated'] is None else "%.1f" % (stage['allocated'] / 1048576.0)
+            lines.append("%-24s %8d %10.3f %10.3f %12d %14.0f %10s" %
+                         (name, stage['calls'], stage['seconds'], 1000.0 * stage['seconds'] / stage['calls'],
+                          stage['items'], rate, allocated))
+        return "\n".join(lines)
+
+    def save_trace(self, filename):
+        """Writes all calls to a file in the Chrome trace event format"""
+        pid = os.getpid()
+        events = []
+        for name, start, duration, thread, items in self.events:
+            events.append({'name': name, 'cat': 'pygazeanalyser', 'ph': 'X', 'pid': pid, 'tid': thread,
+                           'ts': 1e6 * start, 'dur': 1e6 * duration, 'args': {'items': items}})
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def timed(name, items=None):
+    """Decorator that marks a function as a profiling stage
+
+	arguments
+
+	name		-	name of the stage
+
+	keyword arguments
+
+	items		-	function that returns the number of items handled by a
+				call, given the call's arguments (as a tuple in the
+				order of the function's parameters, whether they were
+				passed by position or by keyword) and its result, e.g.
+				arg_length; or None (default = None)
+
+	A call for which items fails is recorded with 0 items; profiling never
+	changes what a call does.
+	"""
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            prof = _active
+            if prof is None:
+                return func(*args, **kwargs)
+            if prof.allocations:
+                _push_memory()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                stop = time.perf_counter()
+                allocated = _pop_memory() if prof.allocations else None
+            prof.record(name, start, stop, _count(items, signature, args, kwargs, result), allocated)
+            return result
+        return wrapper
+    return decorator
+
+
+def _count(items, signature, args, kwargs, result):
+    # number of items of a call, or 0 if it can not be determined
+    if items is None:
+        return 0
+    try:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return int(items(tuple(bound.arguments.values()), result))
+    except Exception:
+        return 0
+
+
+@contextlib.contextmanager
+def stage(name, items=0):
+    """Context manager that records a block of code as a single call of a
+    stage, e.g. to time the steps of a script in between the marked
+    functions"""
+    prof = _active
+    if prof is None:
+        yield
+        return
+    if prof.allocations:
+        _push_memory()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stop = time.perf_counter()
+        allocated = _pop_memory() if prof.allocations else None
+        prof.record(name, start, stop, items, allocated)
+
+
+@contextlib.contextmanager
+def profile(allocations=False):
+    """Context manager that profiles all marked stages that are called
+    within it, and yields the Profile they are recorded in
+
+	keyword arguments
+
+	allocations	-	Boolean indicating whether allocations are to be traced
+				(default = False)
+	"""
+    prof = enable(allocations=allocations)
+    try:
+        yield prof
+    finally:
+        disable()
+
+
+def enable(allocations=False):
+    """Starts recording all marked stages into a new Profile, and returns
+    it"""
+    global _active
+    disable()
+    _active = Profile(allocations=allocations)
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _active._tracemalloc = True
+    return _active
+
+
+def disable():
+    """Stops recording, and returns the Profile that was recorded into (or
+    None)"""
+    global _active
+    prof, _active = _active, None
+    if prof is not None and prof._tracemalloc:
+        tracemalloc.stop()
+    return prof
+
+
+def arg_length(args, result):
+    """Number of items of a stage: the length of its first argument (e.g.
+    the number of samples in x)"""
+    return numpy.shape(args[0])[-1]
+
+
+def result_length(args, result):
+    """Number of items of a stage: the length of the first array it
+    returns"""
+    return numpy.shape(result[0])[-1]
+
+
+def _push_memory():
+    # starts measuring the peak of traced memory for a stage; the peak of an
+    # enclosing stage is kept on the stack, as tracemalloc only has one
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    current, peak = tracemalloc.get_traced_memory()
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+    stack.append([current, current])
+    tracemalloc.reset_peak()
+
+
+def _pop_memory():
+    # returns the peak memory allocated since the matching _push_memory
+    stack = _local.stack
+    current, peak = tracemalloc.get_traced_memory()
+    start, seen = stack.pop()
+    peak = max(seen, peak)
+    if stack:
+        stack[-1][1] = max(stack[-1][1], peak)
+    return peak - start
+
+
+def _profile_from_environment():
+    # PYGAZEANALYSER_PROFILE=1 or PYGAZEANALYSER_PROFILE=<trace.json>
+    value = os.environ.get('PYGAZEANALYSER_PROFILE', '')
+    if value in ('', '0'):
+        return
+    prof = enable()
+
+    def report():
+        sys.stderr.write(prof.summary() + "\n")
+        if value.lower().endswith('.json'):
+            prof.save_trace(value)
+    atexit.register(report)
+
+
+_profile_from_environment()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Detection Runner
+#
+# Runs a detector on many trials at once. The samples of all trials are
+# copied into a single shared memory block, from which worker processes take
+# their trials as numpy views, so that only trial offsets and the (small)
+# detected events are sent between processes (see map_shared, which the
+# other modules that spread trials over processes use as well). Trials are
+# handed out to the workers in chunks, and the results are returned in the
+# order of images.csv, regardless of the number of workers.
+
+import os
+
+import numpy
+
+from pygazeanalyser.icarereader import read_trial, read_images, trial_filename
+
+
+# fields of a trial, in the order of the tuples of read_images
+TRIAL_FIELDS = ('participant', 'dataset', 'trial', 'image')
+
+
+def trial_images(datadir, trials=None):
+    """Returns a list of trials, and the image of every trial
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+
+	keyword arguments
+
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+
+	returns
+	trials, images
+				trials	-	list of (participant, dataset, trial, image) tuples
+				images	-	dict of (participant, dataset, trial) to image
+	"""
+
+    if trials is None:
+        trials = read_images(os.path.join(datadir, 'images.csv'))
+    return trials, dict(((p, d, t), i) for p, d, t, i in trials)
+
+
+def trial_grouping(datadir, by, trials=None, caller='trial_grouping'):
+    """Returns a list of trials, and a function that returns the group of a
+    trial, e.g. its (dataset, image)
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+	by		-	tuple of the trial fields that make up a group, out of
+				TRIAL_FIELDS
+
+	keyword arguments
+
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	caller	-	name of the function to report in errors
+
+	returns
+	trials, group
+				trials	-	list of (participant, dataset, trial, image) tuples
+				group		-	function taking a (participant, dataset, trial)
+						key, and returning the tuple of its by fields
+	"""
+
+    for field in by:
+        if field not in TRIAL_FIELDS:
+            raise Exception("ERROR in %s: unknown trial field '%s'" % (caller, field))
+    trials, images = trial_images(datadir, trials)
+    positions = [TRIAL_FIELDS.index(field) for field in by]
+
+    def group(key):
+        values = tuple(key) + (images[tuple(key)],)
+        return tuple(values[i] for i in positions)
+    return trials, group
+
+
+def load_trials(datadir, trials=None, store=None):
+    """Returns the samples of a list of trials, concatenated into one (3, n)
+    array of x, y and time
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+
+	keyword arguments
+
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	store		-	SampleStore to read the samples from instead of the
+				trial files, or None (default = None)
+
+	returns
+	keys, samples, offsets
+				keys		-	list of (participant, dataset, trial) tuples of
+						the trials that have samples, in the order of trials
+				samples	-	numpy array of shape (3, n) with x, y and time
+				offsets	-	numpy array of len(keys) + 1 sample offsets
+	"""
+
+    trials, images = trial_images(datadir, trials)
+    keys = []
+    columns = []
+    for participant, dataset, trial, image in trials:
+        key = (participant, dataset, trial)
+        if store is not None:
+            if key not in store:
+                continue
+            columns.append(store.trial(*key))
+        else:
+            filename = trial_filename(datadir, participant, dataset, trial, image)
+            if not os.path.isfile(filename):
+                continue
+            columns.append(read_trial(filename))
+        keys.append(key)
+    lengths = [len(c[0]) for c in columns]
+    offsets = numpy.concatenate(([0], numpy.cumsum(lengths, dtype=int)))
+    samples = numpy.empty((3, offsets[-1]))
+    for (x, y, time), s, e in zip(columns, offsets[:-1], offsets[1:]):
+        samples[0, s:e] = x
+        samples[1, s:e] = y
+        samples[2, s:e] = time
+    return keys, samples, offsets
+
+
+def run_detection(detector, datadir, trials=None, store=None, workers=None, chunksize=16, **kwargs):
+    """Runs a detector on every trial, in parallel over a pool of processes
+
+	arguments
+
+	detector	-	function taking x, y and time as its first arguments,
+				e.g. detectors.fixation_detection; it needs to be
+				importable from a module, so that it can be sent to
+				the worker processes
+	datadir	-	path to the ICARE data directory
+
+	keyword arguments
+
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	store		-	SampleStore to read the samples from instead of the
+				trial files, or None (default = None)
+	workers	-	number of worker processes; None for one per CPU, and
+				0 or 1 to run in the current process (default = None)
+	chunksize	-	number of trials that are sent to a worker at once
+				(default = 16)
+
+	all further keyword arguments are passed on to the detector
+
+	returns
+	results
+				results	-	list of ((participant, dataset, trial), events)
+						tuples in the order of trials (or images.csv),
+						where events is what the detector returned; the
+						output is the same for any number of workers
+	"""
+
+    keys, samples, offsets = load_trials(datadir, trials=trials, store=store)
+    return detect_loaded(detector, keys, samples, offsets, workers=workers, chunksize=chunksize, **kwargs)
+
+
+def detect_loaded(detector, keys, samples, offsets, workers=None, chunksize=16, **kwargs):
+    """Runs a detector on trials that were loaded with load_trials, e.g. to
+    run several detectors on the same samples without reading the trial
+    files again
+
+	arguments
+
+	detector	-	function taking x, y and time as its first arguments,
+				as in run_detection
+	keys		-	list of (participant, dataset, trial) tuples
+	samples	-	array of the samples of all trials, as returned by
+				load_trials
+	offsets	-	array of the offsets of the trials in samples
+
+	keyword arguments
+
+	workers	-	number of worker processes, as in run_detection
+				(default = None)
+	chunksize	-	number of trials that are sent to a worker at once
+				(default = 16)
+
+	all further keyword arguments are passed on to the detector
+
+	returns
+	results	-	list of ((participant, dataset, trial), events)
+				tuples in the order of keys
+	"""
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = [(s, min(s + chunksize, len(keys))) for s in range(0, len(keys), max(1, chunksize))]
+
+    # SERIAL
+    if workers <= 1 or len(chunks) <= 1:
+        events = []
+        for first, last in chunks:
+            events.extend(_detect(samples, (detector, offsets[first:last + 1], kwargs)))
+        return list(zip(keys, events))
+
+    # PARALLEL
+    jobs = [(detector, offsets[first:last + 1], kwargs) for first, last in chunks]
+    events = []
+    for result in map_shared(_detect, samples, jobs, workers):
+        events.extend(result)
+    return list(zip(keys, events))
+
+
+def map_shared(worker, samples, jobs, workers):
+    """Runs a function on every job in a pool of processes, which read a
+    samples array from shared memory instead of receiving a copy of it
+
+	arguments
+
+	worker	-	function taking the samples array and a job, and
+				returning a result that does not refer to the samples;
+				it needs to be importable from a module
+	samples	-	numpy array that is copied into shared memory once
+	jobs		-	list of jobs, e.g. tuples of a detector and the
+				offsets of some trials
+	workers	-	number of worker processes
+
+	returns
+	results	-	iterator over the results of worker(samples, job), in
+				the order of jobs; the shared memory is released once
+				all results are taken (or the iterator is closed)
+	"""
+
+    # the pool is only imported when it is used, which keeps importing the
+    # modules that run workers quick
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, samples.nbytes))
+    try:
+        shared = numpy.ndarray(samples.shape, dtype=samples.dtype, buffer=shm.buf)
+        shared[:] = samples
+        del shared
+        tasks = [(worker, shm.name, samples.shape, samples.dtype.str, job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as executor:
+            # map returns the results in order of submission
+            for result in executor.map(_run_shared, tasks):
+                yield result
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _run_shared(task):
+    # worker side of map_shared: attaches to the shared samples
+    from multiprocessing import shared_memory
+
+    worker, name, shape, dtype, job = task
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        samples = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        result = worker(samples, job)
+        del samples
+    finally:
+        shm.close()
+    return result
+
+
+def _detect(samples, job):
+    # runs the detector on the trials between consecutive offsets
+    detector, offsets, kwargs = job
+    events = []
+    for s, e in zip(offsets[:-1], offsets[1:]):
+        events.append(detector(samples[0, s:e], samples[1, s:e], samples[2, s:e], **kwargs))
+    return events
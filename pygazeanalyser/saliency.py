@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Saliency Metrics
+#
+# Compares the fixations of humans with the saliency maps of models, e.g.
+# of CNNs trained on the same stimuli, with the metrics of the MIT saliency
+# benchmark (Bylinskii et al., 2019):
+#	nss		-	mean normalized saliency at the fixated pixels
+#	auc_judd	-	area under the ROC curve of saliency as a classifier of
+#				fixated pixels, with the saliency at the fixated pixels
+#				as thresholds
+#	cc		-	Pearson correlation of saliency and fixation density
+#	kl		-	KL divergence of the saliency map from the fixation
+#				density (lower is better)
+#	sim		-	sum of the minima of both maps, each scaled to [0, 1]
+#				and then to a sum of 1
+# The fixation density of an image is the heatmap that draw_heatmap draws
+# (see gazeplotter._heatmap), and its fixated pixels are those under the
+# fixations. Saliency maps are arrays of the display size.
+#
+# All metrics are computed for a stack of images at once. evaluate_models
+# streams the images through in chunks: the density maps of a chunk are
+# drawn from the fixations, and the saliency maps of every model are only
+# loaded for that chunk, so that memory stays bounded by the chunk size
+# regardless of the number of images and models:
+#	fixations = collect_fixations('data')
+#	models = {'resnet': lambda key: numpy.load('resnet/%s_%s.npy' % key)}
+#	keys, results = evaluate_models(fixations, models, (1920, 1200))
+#	print(results['resnet']['nss'].mean())
+
+import numpy
+
+from pygazeanalyser.detectors import fixation_detection_dd
+from pygazeanalyser.events import EventTable, FIXATION_COLUMNS
+from pygazeanalyser.gazeplotter import parse_fixations, _heatmap
+from pygazeanalyser.runner import run_detection, trial_grouping
+
+
+# # # # #
+# CONSTANTS
+
+METRICS = ('nss', 'auc_judd', 'cc', 'kl', 'sim')
+# regularisation of the KL divergence, as in the MIT benchmark code
+EPSILON = numpy.finfo(float).eps
+
+
+# # # # #
+# METRICS
+
+def saliency_metrics(saliency, density, fixated, metrics=METRICS):
+    """Returns the metrics of a stack of saliency maps
+
+	arguments
+
+	saliency	-	numpy array of shape (k, h, w) with k saliency maps
+	density	-	numpy array of shape (k, h, w) with the fixation
+				density of each image
+	fixated	-	boolean numpy array of shape (k, h, w) with the fixated
+				pixels of each image
+
+	keyword arguments
+
+	metrics	-	names of the metrics to compute, out of METRICS
+				(default = METRICS)
+
+	returns
+	results	-	dict of metric name to a numpy array of k values; NaN
+				for images without fixations (or constant maps, for
+				nss and cc)
+	"""
+
+    saliency = numpy.asarray(saliency, dtype=float)
+    density = numpy.asarray(density, dtype=float)
+    fixated = numpy.asarray(fixated, dtype=bool)
+    if saliency.shape != density.shape or saliency.shape != fixated.shape:
+        raise Exception("ERROR in saliency_metrics: saliency %s, density %s and fixated %s differ in shape" %
+                        (saliency.shape, density.shape, fixated.shape))
+    k = saliency.shape[0]
+    s = saliency.reshape(k, -1)
+    d = density.reshape(k, -1)
+    f = fixated.reshape(k, -1)
+    results = {}
+    for metric in metrics:
+        if metric not in METRICS:
+            raise Exception("ERROR in saliency_metrics: unknown metric '%s'" % metric)
+        results[metric] = _METRIC_FUNCTIONS[metric](s, d, f)
+    return results
+
+
+def _nss(s, d, f):
+    # mean of the z-scored saliency over the fixated pixels
+    z = _standardize(s)
+    nfix = f.sum(axis=1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(nfix > 0, (z * f).sum(axis=1) / nfix, numpy.nan)
+
+
+def _auc_judd(s, d, f):
+    # true positive rate at every fixated pixel's saliency as threshold,
+    # against the false positive rate of the other pixels, on saliency
+    # scaled to [0, 1]
+    s = _rescale(s)
+    npix = s.shape[1]
+    results = numpy.full(len(s), numpy.nan)
+    for row in range(len(s)):
+        thresholds = numpy.sort(s[row][f[row]])
+        nfix = len(thresholds)
+        if nfix == 0 or nfix == npix:
+            continue
+        # number of pixels at or above every threshold, from highest to
+        # lowest, counted from the number of thresholds at or below every
+        # pixel, so that only the (few) thresholds need to be sorted
+        below = numpy.bincount(numpy.searchsorted(thresholds, s[row], side='right'), minlength=nfix + 1)
+        above = numpy.cumsum(below[::-1])[:nfix]
+        tp = numpy.concatenate(([0.0], numpy.arange(1, nfix + 1) / float(nfix), [1.0]))
+        fp = numpy.concatenate(([0.0], (above - numpy.arange(1, nfix + 1)) / float(npix - nfix), [1.0]))
+        # trapezoidal area under the curve
+        results[row] = numpy.sum(numpy.diff(fp) * (tp[1:] + tp[:-1]) / 2)
+    return results
+
+
+def _cc(s, d, f):
+    # Pearson correlation of saliency and density
+    return numpy.mean(_standardize(s) * _standardize(d), axis=1)
+
+
+def _kl(s, d, f):
+    # KL divergence of the saliency distribution from the density
+    p = _distribution(d)
+    q = _distribution(s)
+    return numpy.sum(p * numpy.log(EPSILON + p / (q + EPSILON)), axis=1)
+
+
+def _sim(s, d, f):
+    # histogram intersection of both maps as distributions
+    return numpy.sum(numpy.minimum(_distribution(_rescale(s)), _distribution(_rescale(d))), axis=1)
+
+
+_METRIC_FUNCTIONS = {'nss': _nss, 'auc_judd': _auc_judd, 'cc': _cc, 'kl': _kl, 'sim': _sim}
+
+
+def _standardize(maps):
+    # every row to zero mean and unit (population) standard deviation; NaN
+    # for constant rows
+    std = maps.std(axis=1, keepdims=True)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return (maps - maps.mean(axis=1, keepdims=True)) / numpy.where(std > 0, std, numpy.nan)
+
+
+def _rescale(maps):
+    # every row to the range [0, 1]; constant rows to 0
+    lo = maps.min(axis=1, keepdims=True)
+    span = maps.max(axis=1, keepdims=True) - lo
+    return (maps - lo) / numpy.where(span > 0, span, 1.0)
+
+
+def _distribution(maps):
+    # every row to a sum of 1; NaN for rows that sum to 0
+    total = maps.sum(axis=1, keepdims=True)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return maps / numpy.where(total > 0, total, numpy.nan)
+
+
+# # # # #
+# BATCHES
+
+def human_maps(fixations, dispsize, durationweight=True, gwh=200, gsdwh=None, out=None):
+    """Returns the fixation density and fixated pixels of a stack of images
+
+	arguments
+
+	fixations	-	list with, for every image, an EventTable or list of
+				fixation ending events, or a list of EventTables (one
+				per trial)
+	dispsize	-	tuple or list indicating the size of the display,
+				e.g. (1920,1200)
+
+	keyword arguments
+
+	durationweight, gwh and gsdwh are as in gazeplotter.draw_heatmap
+	out		-	(density, fixated) arrays of shape (k, h, w) with
+				k >= len(fixations) to draw into, or None (default = None)
+
+	returns
+	density, fixated
+				numpy arrays of shape (len(fixations), h, w)
+	"""
+
+    w, h = int(dispsize[0]), int(dispsize[1])
+    gsdwh = gwh/6 if gsdwh is None else gsdwh
+    k = len(fixations)
+    if out is None:
+        density = numpy.zeros((k, h, w))
+        fixated = numpy.zeros((k, h, w), dtype=bool)
+    else:
+        density, fixated = out[0][:k], out[1][:k]
+        density[:] = 0
+        fixated[:] = False
+    for image, events in enumerate(fixations):
+        fix = parse_fixations(_pooled(events))
+        _heatmap(fix, dispsize, gwh, gsdwh, durationweight, out=density[image])
+        # the pixel under a fixation, as the kernel centre in _heatmap
+        valid = numpy.isfinite(fix['x']) & numpy.isfinite(fix['y'])
+        x = fix['x'][valid].astype(int)
+        y = fix['y'][valid].astype(int)
+        inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+        fixated[image, y[inside], x[inside]] = True
+    return density, fixated
+
+
+def evaluate_models(fixations, models, dispsize, keys=None, metrics=METRICS, chunksize=8, durationweight=True,
+                    gwh=200, gsdwh=None):
+    """Computes the metrics of every model's saliency maps against the
+    human fixations, for many images, in chunks of images
+
+	arguments
+
+	fixations	-	dict of image key to the fixations on that image, as
+				an EventTable or list of fixation ending events, or a
+				list of EventTables, e.g. as returned by
+				collect_fixations
+	models	-	dict of model name to either a function that takes an
+				image key and returns the model's saliency map of that
+				image, or a dict of image key to saliency map; maps are
+				numpy arrays of shape (dispsize[1], dispsize[0])
+	dispsize	-	tuple or list indicating the size of the display,
+				e.g. (1920,1200)
+
+	keyword arguments
+
+	keys		-	image keys to evaluate, or None for all keys of
+				fixations (default = None)
+	metrics	-	names of the metrics, out of METRICS (default = METRICS)
+	chunksize	-	number of images that are held in memory at once
+				(default = 8)
+
+	durationweight, gwh and gsdwh define the fixation density, as in
+	gazeplotter.draw_heatmap
+
+	returns
+	keys, results
+				keys		-	list of the evaluated image keys
+				results	-	dict of model name to a dict of metric name
+						to a numpy array with a value for every key
+	"""
+
+    if keys is None:
+        keys = list(fixations.keys())
+    w, h = int(dispsize[0]), int(dispsize[1])
+    results = dict((name, dict((metric, numpy.full(len(keys), numpy.nan)) for metric in metrics))
+                   for name in models)
+    # the chunk buffers are reused for every chunk
+    density = numpy.zeros((chunksize, h, w))
+    fixated = numpy.zeros((chunksize, h, w), dtype=bool)
+    saliency = numpy.zeros((chunksize, h, w))
+    for first in range(0, len(keys), chunksize):
+        chunk = keys[first:first + chunksize]
+        k = len(chunk)
+        human_maps([fixations[key] for key in chunk], dispsize, durationweight=durationweight, gwh=gwh,
+                   gsdwh=gsdwh, out=(density, fixated))
+        for name, model in models.items():
+            for i, key in enumerate(chunk):
+                values = numpy.asarray(model(key) if callable(model) else model[key])
+                if values.shape != (h, w):
+                    raise Exception("ERROR in evaluate_models: saliency map of model '%s' for %s has shape %s, "
+                                    "not %s" % (name, key, values.shape, (h, w)))
+                saliency[i] = values
+            for metric, values in saliency_metrics(saliency[:k], density[:k], fixated[:k], metrics).items():
+                results[name][metric][first:first + k] = values
+    return keys, results
+
+
+def collect_fixations(datadir, by=('dataset', 'image'), trials=None, store=None, workers=None,
+                      detector=fixation_detection_dd, **params):
+    """Detects the fixations of every trial and pools them per dataset and
+    image (or any other combination of trial fields)
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+
+	keyword arguments
+
+	by		-	tuple of the trial fields that make up the key, out of
+				'participant', 'dataset', 'trial' and 'image'
+				(default = ('dataset', 'image'))
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	store		-	SampleStore to read the samples from, or None
+				(default = None)
+	workers	-	number of detection processes, as in
+				runner.run_detection (default = None)
+	detector	-	fixation detector (default = fixation_detection_dd)
+
+	all further keyword arguments are passed on to the detector
+
+	returns
+	fixations	-	dict of key to an EventTable with the fixations of all
+				trials of that key
+	"""
+
+    trials, group = trial_grouping(datadir, by, trials, 'collect_fixations')
+
+    pooled = {}
+    for trial, (Sfix, Efix) in run_detection(detector, datadir, trials=trials, store=store, workers=workers,
+                                             table=True, **params):
+        pooled.setdefault(group(trial), []).append(Efix)
+    return dict((key, EventTable.concatenate(tables)) for key, tables in pooled.items())
+
+
+def _pooled(events):
+    # a single EventTable from an EventTable, a list of fixation ending
+    # events, or a list of EventTables (one per trial)
+    if isinstance(events, EventTable):
+        return events
+    if len(events) > 0 and isinstance(events[0], EventTable):
+        return EventTable.concatenate(events)
+    return EventTable.from_events(FIXATION_COLUMNS, events)
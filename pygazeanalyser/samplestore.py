@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Sample Store
+#
+# Columnar store of all samples in an ICARE data directory. The samples of
+# all trials are concatenated into one x.npy, y.npy and time.npy file each,
+# which are opened as memory maps, and index.npy holds the offsets of every
+# (participant, dataset, trial) in those arrays. Reading a trial from the
+# store returns views into the memory maps, without parsing any CSV files.
+#
+# The store is built with ingest, or from the command line:
+#	python -m pygazeanalyser.samplestore <datadir> <storedir>
+# Re-ingesting only parses the trial files that were added or changed since
+# the last ingest, appends their samples to the column files, and rewrites
+# the index; the samples of all other trials stay where they are. The
+# samples of changed and removed trials are left in the columns until they
+# make up more than half of them, at which point the store is rewritten
+# from scratch, in the order of the index.
+
+import os
+import io
+import sys
+import argparse
+
+import numpy
+
+from pygazeanalyser.icarereader import read_trial, list_trials
+
+
+# # # # #
+# FORMAT
+
+# record layout of the index; size and mtime identify the version of the
+# source file that the samples were read from
+INDEX_DTYPE = numpy.dtype([	('participant', 'i4'),
+						('dataset', 'U16'),
+						('trial', 'i4'),
+						('image', 'U64'),
+						('start', 'i8'),
+						('stop', 'i8'),
+						('size', 'i8'),
+						('mtime', 'i8')])
+COLUMNS = ('x', 'y', 'time')
+
+
+class SampleStore(object):
+    """Read-only view on a sample store created by ingest
+
+	arguments
+
+	storedir	-	path to the directory of the store
+
+	The index is a numpy record array with one row per trial (see
+	INDEX_DTYPE); trials are sorted by participant, dataset and trial, and
+	all trials of a participant, or of a participant's dataset, are stored
+	next to each other, except for those that a later ingest appended.
+	"""
+
+    def __init__(self, storedir):
+        self.storedir = storedir
+        if not os.path.isfile(os.path.join(storedir, 'index.npy')):
+            raise Exception("ERROR in SampleStore: no sample store found at '%s'" % storedir)
+        self.index = numpy.load(os.path.join(storedir, 'index.npy'))
+        self.x, self.y, self.time = [_load_column(storedir, c) for c in COLUMNS]
+        self._rows = {}
+        for row, entry in enumerate(self.index):
+            self._rows[(int(entry['participant']), str(entry['dataset']), int(entry['trial']))] = row
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return tuple(key) in self._rows
+
+    def keys(self):
+        """Returns the (participant, dataset, trial) keys of all trials"""
+        return list(self._rows.keys())
+
+    def trial(self, participant, dataset, trial):
+        """Returns x, y and time of a single trial, as views into the store"""
+        try:
+            entry = self.index[self._rows[(int(participant), dataset, int(trial))]]
+        except KeyError:
+            raise KeyError("no trial %s of participant %s on dataset %s in the sample store" %
+                           (trial, participant, dataset))
+        s, e = entry['start'], entry['stop']
+        return self.x[s:e], self.y[s:e], self.time[s:e]
+
+    def select(self, participant=None, dataset=None):
+        """Returns the index rows of all trials of a participant and/or a
+        dataset"""
+        mask = numpy.ones(len(self.index), dtype=bool)
+        if participant is not None:
+            mask &= self.index['participant'] == int(participant)
+        if dataset is not None:
+            mask &= self.index['dataset'] == dataset
+        return self.index[mask]
+
+    def batch(self, participant=None, dataset=None):
+        """Returns the samples of all trials of a participant and/or a
+        dataset in the layout of detectors.fixation_detection_dd_batch,
+        i.e. x, y, time and offsets; when the selected trials are stored
+        contiguously, the arrays are views into the store, and otherwise
+        copies
+
+	returns
+	entries, x, y, time, offsets
+				entries	-	the index rows of the selected trials
+	"""
+        entries = self.select(participant, dataset)
+        if len(entries) == 0:
+            empty = numpy.zeros(0)
+            return entries, empty, empty, empty, numpy.zeros(1, dtype=int)
+        s, e = entries['start'][0], entries['stop'][-1]
+        offsets = numpy.concatenate((entries['start'], entries['stop'][-1:])) - s
+        if not numpy.array_equal(entries['stop'][:-1], entries['start'][1:]):
+            # the trials are not contiguous (e.g. a dataset across participants)
+            idx = numpy.concatenate([numpy.arange(a, b) for a, b in zip(entries['start'], entries['stop'])])
+            offsets = numpy.concatenate(([0], numpy.cumsum(entries['stop'] - entries['start'])))
+            return entries, self.x[idx], self.y[idx], self.time[idx], offsets
+        return entries, self.x[s:e], self.y[s:e], self.time[s:e], offsets
+
+
+def ingest(datadir, storedir):
+    """Reads all trial files in datadir into the sample store in storedir;
+    trial files that did not change since a previous ingest into the same
+    store are not parsed again, and only the samples of the other files are
+    appended to the store (which is rewritten in full when most of its
+    samples are no longer used)
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+	storedir	-	path to the directory of the store; created if it does
+				not exist
+
+	returns
+	parsed, reused, removed
+				parsed	-	number of trial files that were read
+				reused	-	number of trials taken from the existing store
+				removed	-	number of trials in the existing store whose
+						file no longer exists
+	"""
+
+    if not os.path.isdir(storedir):
+        os.makedirs(storedir)
+
+    # existing store
+    previous = {}
+    old = None
+    if os.path.isfile(os.path.join(storedir, 'index.npy')):
+        old = SampleStore(storedir)
+        for entry in old.index:
+            previous[(int(entry['participant']), str(entry['dataset']), int(entry['trial']))] = entry
+
+    trials = list_trials(datadir)
+    index = numpy.zeros(len(trials), dtype=INDEX_DTYPE)
+    # samples of the parsed trials, by index row; the start and stop of
+    # those rows are relative to the parsed samples until they are written
+    added = {}
+    kept = 0
+    start = 0
+    for row, (participant, dataset, trial, image, path) in enumerate(trials):
+        stat = os.stat(path)
+        entry = previous.pop((participant, dataset, trial), None)
+        if entry is not None and entry['image'] == image and entry['size'] == stat.st_size \
+                and entry['mtime'] == stat.st_mtime_ns:
+            index[row] = entry
+            kept += entry['stop'] - entry['start']
+        else:
+            samples = [numpy.asarray(values, dtype=float) for values in read_trial(path)]
+            added[row] = samples
+            index[row] = (participant, dataset, trial, image, start, start + len(samples[0]),
+                          stat.st_size, stat.st_mtime_ns)
+            start += len(samples[0])
+    parsed, reused = len(added), len(trials) - len(added)
+
+    stored = len(old.x) if old is not None else 0
+    if old is None or stored - kept > kept or not _append(storedir, added, index, stored):
+        _rewrite(storedir, added, index, old)
+    del old
+    # the index is replaced last, so that a store that is read meanwhile
+    # only sees complete trials
+    numpy.save(os.path.join(storedir, 'index.tmp.npy'), index)
+    os.replace(os.path.join(storedir, 'index.tmp.npy'), os.path.join(storedir, 'index.npy'))
+
+    return parsed, reused, len(previous)
+
+
+def _append(storedir, added, index, stored):
+    # appends the samples of the parsed trials to the column files, and
+    # moves their rows in the index to them; returns False, without writing
+    # anything, if a column file can not be extended in place
+    rows = sorted(added)
+    total = stored + sum(len(added[row][0]) for row in rows)
+    headers = []
+    for name in COLUMNS:
+        with open(os.path.join(storedir, name + '.npy'), 'rb') as f:
+            version = numpy.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = numpy.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran, dtype = numpy.lib.format.read_array_header_2_0(f)
+            else:
+                return False
+            offset = f.tell()
+        if shape != (stored,) or dtype != numpy.dtype(float):
+            return False
+        # the new header has to fit in the space of the old one, which numpy
+        # pads so that the shape can grow
+        header = io.BytesIO()
+        write = numpy.lib.format.write_array_header_1_0 if version == (1, 0) else \
+            numpy.lib.format.write_array_header_2_0
+        write(header, {'descr': numpy.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (total,)})
+        if len(header.getvalue()) != offset:
+            return False
+        headers.append((offset, header.getvalue()))
+
+    for number, (name, (offset, header)) in enumerate(zip(COLUMNS, headers)):
+        with open(os.path.join(storedir, name + '.npy'), 'r+b') as f:
+            # the samples first, and then the header with the new length,
+            # after any samples left by an interrupted ingest
+            f.seek(offset + stored * 8)
+            for row in rows:
+                f.write(added[row][number].tobytes())
+            f.truncate()
+            f.seek(0)
+            f.write(header)
+    index['start'][rows] += stored
+    index['stop'][rows] += stored
+    return True
+
+
+def _rewrite(storedir, added, index, old):
+    # writes all samples to new column files, in the order of the index
+    columns = ([], [], [])
+    start = 0
+    for row, entry in enumerate(index):
+        if row in added:
+            samples = added[row]
+        else:
+            s, e = entry['start'], entry['stop']
+            samples = (old.x[s:e], old.y[s:e], old.time[s:e])
+        for column, values in zip(columns, samples):
+            column.append(numpy.asarray(values, dtype=float))
+        index['start'][row] = start
+        index['stop'][row] = start + len(samples[0])
+        start += len(samples[0])
+    # write all columns to temporary files first, and only then replace the
+    # old ones, which are still memory mapped while the columns are copied
+    for name, column in zip(COLUMNS, columns):
+        values = numpy.concatenate(column) if column else numpy.zeros(0)
+        numpy.save(os.path.join(storedir, name + '.tmp.npy'), values)
+    del columns
+    for name in COLUMNS:
+        os.replace(os.path.join(storedir, name + '.tmp.npy'), os.path.join(storedir, name + '.npy'))
+
+
+def _load_column(storedir, name):
+    # memory map a column; numpy cannot memory map empty arrays
+    path = os.path.join(storedir, name + '.npy')
+    try:
+        return numpy.load(path, mmap_mode='r')
+    except ValueError:
+        return numpy.load(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest the trial files of an ICARE data directory into a sample store")
+    parser.add_argument('datadir', help="path to the data directory")
+    parser.add_argument('storedir', help="path to the sample store")
+    args = parser.parse_args(argv)
+    parsed, reused, removed = ingest(args.datadir, args.storedir)
+    print("parsed %d trial files, reused %d trials, removed %d trials" % (parsed, reused, removed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
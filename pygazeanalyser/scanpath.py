@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Scanpath Comparison
+#
+# Pairwise distances between the fixation sequences (Efix) of trials, e.g.
+# of all participants that saw the same image:
+#	levenshtein	-	edit distance between the sequences of grid cells (or
+#				AOI regions, see aoi) that the fixations fall on, as in
+#				ScanMatch without its substitution matrix, divided by
+#				the length of the longer sequence
+#	vector, direction, length, position, duration
+#			-	the MultiMatch measures, as 1 - similarity: the
+#				saccade vectors between consecutive fixations of both
+#				scanpaths are aligned by the path of least total vector
+#				difference, and the aligned pairs compared on their
+#				difference vector, angle, length, start position and
+#				start fixation duration (MultiMatch's simplification of
+#				the scanpaths is not applied)
+# The edit distance is computed for many pairs at once, one row of the
+# dynamic programming table per step, for all pairs of a block together;
+# within a row, the insertions are resolved with a running minimum instead
+# of a loop. The alignment of the vector measures is resolved the same way.
+# Blocks of pairs are spread over a pool of processes.
+#
+# With a ScanpathCache, every distance is stored under the contents of both
+# scanpaths (and the measure and encoding), so adding a participant to a
+# comparison only computes the distances to the new scanpaths.
+
+import os
+import json
+import hashlib
+
+import numpy
+
+from pygazeanalyser.aoi import OUTSIDE
+from pygazeanalyser.detectors import fixation_detection_dd
+from pygazeanalyser.features import STIMULUS_RECT, JSONCache
+from pygazeanalyser.runner import run_detection, trial_grouping
+
+
+# # # # #
+# CONSTANTS
+
+MEASURES = ('levenshtein', 'vector', 'direction', 'length', 'position', 'duration')
+VECTOR_MEASURES = MEASURES[1:]
+# code of the padding after the end of a sequence in a block
+_PADDING = OUTSIDE - 1
+
+
+# # # # #
+# ENCODING
+
+def encode(Efix, grid=(5, 5), rect=STIMULUS_RECT, aoimap=None):
+    """Returns a scanpath as the sequence of regions its fixations fall on
+
+	arguments
+
+	Efix		-	EventTable or list of ending fixation events
+
+	keyword arguments
+
+	grid		-	(columns, rows) of the grid that the stimulus area is
+				divided into (default = (5, 5))
+	rect		-	(left, top, width, height) of the stimulus area on the
+				display (default = STIMULUS_RECT)
+	aoimap	-	AOIMap whose regions are used instead of the grid, or
+				None (default = None)
+
+	returns
+	codes	-	integer numpy array with the cell (row * columns +
+				column) or region of every fixation, and aoi.OUTSIDE
+				for fixations outside the stimulus area or regions
+	"""
+
+    x, y, dur = _fixation_columns(Efix)
+    if aoimap is not None:
+        return aoimap.lookup(x, y)
+    cx = numpy.floor((x - rect[0]) * grid[0] / rect[2])
+    cy = numpy.floor((y - rect[1]) * grid[1] / rect[3])
+    inside = (cx >= 0) & (cx < grid[0]) & (cy >= 0) & (cy < grid[1])
+    codes = numpy.full(len(x), OUTSIDE, dtype=numpy.int32)
+    codes[inside] = (cy[inside] * grid[0] + cx[inside]).astype(numpy.int32)
+    return codes
+
+
+def _fixation_array(Efix):
+    # ending fixation events as an (n, 5) numpy array
+    if hasattr(Efix, 'columns'):
+        return numpy.ascontiguousarray(Efix.data.T)
+    return numpy.array(Efix, dtype=float).reshape(-1, 5)
+
+
+def _fixation_columns(Efix):
+    # endx, endy and duration of the fixations of an EventTable or list
+    if hasattr(Efix, 'columns'):
+        return (numpy.asarray(Efix['endx'], dtype=float), numpy.asarray(Efix['endy'], dtype=float),
+                numpy.asarray(Efix['duration'], dtype=float))
+    events = _fixation_array(Efix)
+    return events[:, 3], events[:, 4], events[:, 2]
+
+
+# # # # #
+# MEASURES
+
+def levenshtein(a, b, normalize=True):
+    """Returns the edit distance between two sequences of codes, e.g. as
+    returned by encode; normalized by the length of the longer sequence
+    (0 for two empty sequences) unless normalize is False"""
+    return levenshtein_batch([a], [b], normalize=normalize)[0]
+
+
+def levenshtein_batch(first, second, normalize=True):
+    """Returns the edit distances between first[k] and second[k] for every
+    k, computed for all pairs at once
+
+	arguments
+
+	first		-	list of integer sequences
+	second	-	list of integer sequences, as long as first
+
+	keyword arguments
+
+	normalize	-	Boolean indicating whether distances are divided by the
+				length of the longer sequence (default = True)
+
+	returns
+	distances	-	numpy array of distances
+	"""
+
+    m = len(first)
+    la = numpy.array([len(s) for s in first], dtype=int)
+    lb = numpy.array([len(s) for s in second], dtype=int)
+    A = _pad(first, la)
+    B = _pad(second, lb)
+    # row i of the table holds the distances between the first i codes of a
+    # and every prefix of b; the distance is read from row len(a) at
+    # column len(b), and the padding beyond len(b) does not affect that
+    j = numpy.arange(B.shape[1] + 1)
+    row = numpy.tile(j, (m, 1))
+    distances = numpy.where(la == 0, lb, 0).astype(float)
+    for i in range(1, A.shape[1] + 1):
+        # substitution (or match) and deletion, then insertion, which is a
+        # running minimum of row[k] + (j - k) over all k <= j
+        c = numpy.empty((m, B.shape[1] + 1), dtype=int)
+        c[:, 0] = i
+        c[:, 1:] = numpy.minimum(row[:, :-1] + (A[:, i - 1:i] != B), row[:, 1:] + 1)
+        row = numpy.minimum.accumulate(c - j, axis=1) + j
+        done = numpy.flatnonzero(la == i)
+        distances[done] = row[done, lb[done]]
+    if normalize:
+        longest = numpy.maximum(la, lb)
+        distances = numpy.where(longest > 0, distances / numpy.maximum(longest, 1), 0.0)
+    return distances
+
+
+def _pad(sequences, lengths):
+    # sequences as the rows of one integer array, padded with _PADDING
+    padded = numpy.full((len(sequences), max(1, lengths.max() if len(lengths) else 1)), _PADDING, dtype=numpy.int32)
+    for k, s in enumerate(sequences):
+        padded[k, :len(s)] = s
+    return padded
+
+
+def vector_similarity(first, second, dispsize=(1920, 1200)):
+    """Returns the MultiMatch similarities of two scanpaths
+
+	arguments
+
+	first		-	EventTable or list of ending fixation events
+	second	-	EventTable or list of ending fixation events
+
+	keyword arguments
+
+	dispsize	-	tuple or list indicating the size of the display,
+				e.g. (1920,1200), to which distances are normalized
+
+	returns
+	similarity	-	dict with a value between 0 and 1 for every measure
+				in VECTOR_MEASURES; NaN if either scanpath has fewer
+				than two fixations (and so no saccades)
+	"""
+
+    ax, ay, adur = _fixation_columns(first)
+    bx, by, bdur = _fixation_columns(second)
+    if len(ax) < 2 or len(bx) < 2:
+        return dict((measure, numpy.nan) for measure in VECTOR_MEASURES)
+    # saccade vectors between consecutive fixations
+    va = numpy.column_stack((numpy.diff(ax), numpy.diff(ay)))
+    vb = numpy.column_stack((numpy.diff(bx), numpy.diff(by)))
+    cost = numpy.hypot(va[:, None, 0] - vb[None, :, 0], va[:, None, 1] - vb[None, :, 1])
+    ia, ib = _align(cost)
+
+    diagonal = numpy.hypot(dispsize[0], dispsize[1])
+    pa, pb = va[ia], vb[ib]
+    la, lb = numpy.hypot(pa[:, 0], pa[:, 1]), numpy.hypot(pb[:, 0], pb[:, 1])
+    angle = numpy.abs(numpy.arctan2(pa[:, 1], pa[:, 0]) - numpy.arctan2(pb[:, 1], pb[:, 0]))
+    angle = numpy.minimum(angle, 2 * numpy.pi - angle)
+    da, db = adur[ia], bdur[ib]
+    longest = numpy.maximum(da, db)
+    return {'vector': 1 - numpy.mean(cost[ia, ib]) / (2 * diagonal),
+            'direction': 1 - numpy.mean(angle) / numpy.pi,
+            'length': 1 - numpy.mean(numpy.abs(la - lb)) / diagonal,
+            'position': 1 - numpy.mean(numpy.hypot(ax[ia] - bx[ib], ay[ia] - by[ib])) / diagonal,
+            'duration': 1 - numpy.mean(numpy.where(longest > 0, numpy.abs(da - db) / numpy.where(longest > 0,
+                                                                                              longest, 1), 0))}
+
+
+def _align(cost):
+    # indices of the path of least total cost through the cost matrix, from
+    # [0, 0] to [-1, -1] in steps right, down or diagonally down-right
+    n, m = cost.shape
+    total = numpy.empty((n, m))
+    total[0] = numpy.cumsum(cost[0])
+    for i in range(1, n):
+        # best predecessor from the previous row, then moves within the row:
+        # total[i, j] = min over k <= j of c[k] + sum(cost[i, k:j + 1])
+        c = total[i - 1].copy()
+        c[1:] = numpy.minimum(c[1:], total[i - 1, :-1])
+        summed = numpy.cumsum(cost[i])
+        total[i] = summed + numpy.minimum.accumulate(c - (summed - cost[i]))
+    path = [(n - 1, m - 1)]
+    i, j = n - 1, m - 1
+    while i > 0 or j > 0:
+        if i == 0:
+            j -= 1
+        elif j == 0:
+            i -= 1
+        else:
+            step = numpy.argmin((total[i - 1, j - 1], total[i - 1, j], total[i, j - 1]))
+            i, j = (i - 1, j - 1) if step == 0 else (i - 1, j) if step == 1 else (i, j - 1)
+        path.append((i, j))
+    path = numpy.array(path[::-1])
+    return path[:, 0], path[:, 1]
+
+
+# # # # #
+# DISTANCE MATRICES
+
+def distance_matrix(scanpaths, measure='levenshtein', grid=(5, 5), rect=STIMULUS_RECT, aoimap=None,
+                    dispsize=(1920, 1200), workers=None, blocksize=256, cache=None, cachekey=''):
+    """Returns the distances between all pairs of scanpaths
+
+	arguments
+
+	scanpaths	-	list of EventTables or lists of ending fixation events
+
+	keyword arguments
+
+	measure	-	one of MEASURES (default = 'levenshtein')
+	grid, rect, aoimap
+			-	encoding of the scanpaths for 'levenshtein', see encode
+	dispsize	-	size of the display, for the vector measures
+				(default = (1920,1200))
+	workers	-	number of worker processes; None for one per CPU, and
+				0 or 1 to run in the current process (default = None)
+	blocksize	-	number of pairs that are computed together
+				(default = 256)
+	cache		-	ScanpathCache, or None (default = None)
+	cachekey	-	string that identifies where the scanpaths come from,
+				e.g. the image and detector parameters; only pairs with
+				the same key are taken from the cache (default = '')
+
+	returns
+	distances	-	symmetric numpy array of shape (n, n), with zeros on
+				the diagonal
+	"""
+
+    if measure not in MEASURES:
+        raise Exception("ERROR in distance_matrix: unknown measure '%s'" % measure)
+    n = len(scanpaths)
+    if measure == 'levenshtein':
+        codes = [encode(s, grid=grid, rect=rect, aoimap=aoimap) for s in scanpaths]
+        data = codes
+        setting = [measure, list(grid), list(rect), None if aoimap is None else _digest(aoimap.labels)]
+    else:
+        data = [_fixation_array(s) for s in scanpaths]
+        setting = [measure, list(dispsize)]
+    key = json.dumps([cachekey, setting])
+    digests = [_digest(d) for d in data]
+
+    distances = numpy.zeros((n, n))
+    pairs = []
+    for a in range(n):
+        for b in range(a + 1, n):
+            value = cache.get(key, digests[a], digests[b]) if cache is not None else None
+            if value is None:
+                pairs.append((a, b))
+            else:
+                distances[a, b] = distances[b, a] = value
+
+    # pairs of similar lengths are put in the same block, with the shorter
+    # scanpath first, as every pair of a block is padded to the longest
+    # scanpaths in it and the table has a row per code of the first one
+    lengths = [len(d) for d in data]
+    pairs = [(a, b) if lengths[a] <= lengths[b] else (b, a) for a, b in pairs]
+    pairs.sort(key=lambda pair: (lengths[pair[1]], lengths[pair[0]]))
+    blocks = [pairs[s:s + blocksize] for s in range(0, len(pairs), max(1, blocksize))]
+    jobs = [(measure, [data[a] for a, b in block], [data[b] for a, b in block], dispsize) for block in blocks]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        results = [_distance_block(job) for job in jobs]
+    else:
+        # the pool is only imported when it is used, as in runner.map_shared
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_distance_block, jobs))
+    for block, values in zip(blocks, results):
+        for (a, b), value in zip(block, values):
+            distances[a, b] = distances[b, a] = value
+            if cache is not None:
+                cache.set(key, digests[a], digests[b], value)
+    return distances
+
+
+def _distance_block(job):
+    # distances of a block of pairs; runs in the worker processes
+    measure, first, second, dispsize = job
+    if measure == 'levenshtein':
+        return levenshtein_batch(first, second).tolist()
+    return [float(1 - vector_similarity(a, b, dispsize=dispsize)[measure]) for a, b in zip(first, second)]
+
+
+def _digest(values):
+    # identifies a scanpath (or AOI map) by its contents
+    values = numpy.ascontiguousarray(values)
+    return hashlib.sha1(str(values.dtype).encode() + str(values.shape).encode() + values.tobytes()).hexdigest()
+
+
+def compare_scanpaths(datadir, by=('dataset', 'image'), measure='levenshtein', trials=None, store=None,
+                      workers=None, detector=fixation_detection_dd, cachefile=None, grid=(5, 5), rect=STIMULUS_RECT,
+                      dispsize=(1920, 1200), **params):
+    """Detects the fixations of every trial and computes a distance matrix
+    of the scanpaths per dataset and image (or any other combination of
+    trial fields)
+
+	arguments
+
+	datadir	-	path to the ICARE data directory
+
+	keyword arguments
+
+	by		-	tuple of the trial fields that make up the key, out of
+				'participant', 'dataset', 'trial' and 'image'
+				(default = ('dataset', 'image'))
+	measure	-	one of MEASURES (default = 'levenshtein')
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	store		-	SampleStore to read the samples from, or None
+				(default = None)
+	workers	-	number of processes, for detection and for the
+				distances (default = None)
+	detector	-	fixation detector (default = fixation_detection_dd)
+	cachefile	-	path to a JSON file in which the distances are cached
+				between calls, or None to not cache (default = None)
+	grid, rect	-	encoding for 'levenshtein', see encode
+	dispsize	-	size of the display, for the vector measures
+
+	all further keyword arguments are passed on to the detector
+
+	returns
+	matrices	-	dict of key to a (labels, distances) tuple, where labels
+				are the (participant, dataset, trial) of the rows
+	"""
+
+    trials, group = trial_grouping(datadir, by, trials, 'compare_scanpaths')
+
+    groups = {}
+    for trial, (Sfix, Efix) in run_detection(detector, datadir, trials=trials, store=store, workers=workers,
+                                             table=True, **params):
+        labels, scanpaths = groups.setdefault(group(trial), ([], []))
+        labels.append(trial)
+        scanpaths.append(Efix)
+
+    cache = ScanpathCache(cachefile) if cachefile is not None else None
+    detectorkey = [detector.__module__ + '.' + detector.__name__, sorted(params.items())]
+    matrices = {}
+    for key, (labels, scanpaths) in groups.items():
+        matrices[key] = (labels, distance_matrix(scanpaths, measure=measure, grid=grid, rect=rect, dispsize=dispsize,
+                                                 workers=workers, cache=cache,
+                                                 cachekey=json.dumps([list(key), detectorkey])))
+    if cache is not None:
+        cache.save()
+    return matrices
+
+
+class ScanpathCache(JSONCache):
+    """Cache of pairwise scanpath distances in a JSON file; a distance is
+    stored under the cache key of its comparison and the contents of both
+    scanpaths, so it stays valid for as long as both scanpaths do
+
+	arguments
+
+	filename	-	path to the cache file, or None for a cache that is
+				not stored
+	"""
+
+    def get(self, key, first, second):
+        """Returns the distance between two scanpaths (given by their
+        digests), or None if it is not cached"""
+        return self.entries.get(key, {}).get(_pair(first, second))
+
+    def set(self, key, first, second, value):
+        """Stores the distance between two scanpaths"""
+        self.entries.setdefault(key, {})[_pair(first, second)] = value
+
+
+def _pair(first, second):
+    # distances are symmetric, so a pair is stored under its sorted digests
+    return ':'.join(sorted((first, second)))
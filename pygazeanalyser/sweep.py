@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of PyGaze - the open-source toolbox for eye tracking
+#
+#	PyGazeAnalyser is a Python module for easily analysing eye-tracking data
+#	Copyright (C) 2014  Edwin S. Dalmaijer
+#
+#	This program is free software: you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation, either version 3 of the License, or
+#	(at your option) any later version.
+#
+#	This program is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+# Parameter Sweeps
+#
+# Runs a detector with every combination of a grid of parameter values on
+# all trials, and summarises the events of every combination, e.g. to choose
+# the thresholds of fixation_detection_dd:
+#	results = sweep(fixation_detection_dd, {'maxdist': [15, 25, 35],
+#		'mindur': [50, 100, 150]}, datadir='data')
+#	for row in results:
+#		print(row['maxdist'], row['mindur'], row['events_per_trial'])
+#
+# Every trial is read and cleaned of missing samples once for the whole
+# sweep. For fixation_detection_dd and saccade_detection, the intermediates
+# that do not depend on a threshold are computed once as well: the windows
+# and their dispersions for every value of mindur (shared by all values of
+# maxdist), and the inter-sample velocities and accelerations (shared by all
+# values of minlen, maxvel and maxacc). The other detectors that start by
+# removing the missing samples (fixation_detection, saccade_detection_ivt)
+# are called on the cleaned trials, and any other detector (e.g.
+# blink_detection, which looks for the missing samples) on the trials as
+# they are. The trials are split into chunks, each of which is run with the
+# whole grid, in a pool of processes that read the prepared samples from
+# shared memory, as in runner.run_detection; the results are the same as
+# those of calling the detector on every trial.
+
+import os
+import inspect
+import itertools
+
+import numpy
+
+from pygazeanalyser import detectors
+from pygazeanalyser.runner import load_trials, map_shared
+
+
+# # # # #
+# FORMAT
+
+# fields of the results that follow the parameters; durations are in
+# milliseconds, over all events of a parameter set
+SUMMARY_FIELDS = [	('trials', 'i8'),
+				('events', 'i8'),
+				('events_per_trial', 'f8'),
+				('dur_mean', 'f8'),
+				('dur_median', 'f8'),
+				('dur_std', 'f8'),
+				('dur_total', 'f8')]
+
+
+def parameter_grid(grid):
+    """Returns the parameter sets of a grid, as a list of dicts
+
+	arguments
+
+	grid		-	dict of parameter name to a list of values, of which
+				every combination is a parameter set; or a list of
+				dicts, which is returned as it is
+	"""
+
+    if isinstance(grid, dict):
+        names = list(grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+    return [dict(params) for params in grid]
+
+
+def sweep(detector, grid, datadir, trials=None, store=None, workers=None, chunksize=16, missing=0.0, **kwargs):
+    """Runs a detector with every parameter set of a grid on all trials
+
+	arguments
+
+	detector	-	function taking x, y and time as its first arguments,
+				e.g. detectors.fixation_detection_dd; it needs to be
+				importable from a module, as in runner.run_detection
+	grid		-	dict of parameter name to a list of values, or a list
+				of dicts of parameters; see parameter_grid
+	datadir	-	path to the ICARE data directory
+
+	keyword arguments
+
+	trials	-	list of (participant, dataset, trial, image) tuples, or
+				None for all trials in images.csv (default = None)
+	store		-	SampleStore to read the samples from instead of the
+				trial files, or None (default = None)
+	workers	-	number of worker processes; None for one per CPU, and
+				0 or 1 to run in the current process (default = None)
+	chunksize	-	number of trials that are sent to a worker at once,
+				to be run with every parameter set (default = 16)
+	missing	-	value to be used for missing data, for all parameter
+				sets (default = 0.0)
+
+	all further keyword arguments are passed on to the detector for every
+	parameter set
+
+	returns
+	results	-	numpy record array with one row per parameter set, in
+				the order of parameter_grid, with a field for every
+				parameter followed by SUMMARY_FIELDS
+	"""
+
+    paramsets = parameter_grid(grid)
+    if not paramsets:
+        raise Exception("ERROR in sweep: the parameter grid is empty")
+    for params in paramsets:
+        if 'missing' in params or 'table' in params:
+            raise Exception("ERROR in sweep: missing and table can not be part of the parameter grid")
+
+    keys, samples, offsets = load_trials(datadir, trials=trials, store=store)
+    kind = _KINDS.get(detector, 'generic')
+    prepared, offsets = _prepare(kind, samples, offsets, missing)
+    defaults = _defaults(detector)
+    paramsets = [dict(defaults, **dict(kwargs, **params)) for params in paramsets]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = [(s, min(s + chunksize, len(keys))) for s in range(0, len(keys), max(1, chunksize))]
+
+    # every job is a chunk of trials with the whole grid, so that the
+    # intermediates are shared by all parameter sets
+    if workers <= 1 or len(chunks) <= 1:
+        results = [_sweep_job(kind, detector, prepared, missing, (offsets, paramsets))]
+    else:
+        tasks = [(kind, detector, missing, (offsets[first:last + 1], paramsets)) for first, last in chunks]
+        results = list(map_shared(_sweep_task, prepared, tasks, workers))
+    durations = [numpy.concatenate([result[number] for result in results]) for number in range(len(paramsets))]
+
+    return _summarise(paramsets, parameter_grid(grid), durations, len(keys))
+
+
+# # # # #
+# INTERNAL
+
+# detectors with shared intermediates, and those that remove the missing
+# samples before anything else
+_KINDS = {	detectors.fixation_detection_dd: 'dispersion',
+		detectors.saccade_detection: 'saccade',
+		detectors.fixation_detection: 'clean',
+		detectors.saccade_detection_ivt: 'clean'}
+
+
+def _defaults(detector):
+    # keyword arguments of the detector with their default values
+    return dict((name, p.default) for name, p in inspect.signature(detector).parameters.items()
+                if p.default is not inspect.Parameter.empty and name not in ('missing', 'table'))
+
+
+def _prepare(kind, samples, offsets, missing):
+    # returns the arrays that every parameter set needs, as one (k, n) array,
+    # and the offsets of the trials in it; for all but generic detectors,
+    # the missing samples are removed, and for the saccade detector,
+    # velocity and acceleration are added (padded to the trial)
+    if kind == 'generic':
+        return samples, offsets
+    # all trials are filtered at once, and the offsets moved to the first
+    # kept sample at or after them
+    kept, index = detectors.remove_missing_samples(samples, missing, return_index=True)
+    offsets = numpy.searchsorted(index, offsets)
+    if kind != 'saccade':
+        return kept, offsets
+    prepared = numpy.full((5, kept.shape[1]), numpy.nan)
+    prepared[:3] = kept
+    for s, e in zip(offsets[:-1], offsets[1:]):
+        vel, acc = detectors._saccade_velocity(kept[0, s:e], kept[1, s:e], kept[2, s:e])
+        prepared[3, s:s + len(vel)] = vel
+        prepared[4, s:s + len(acc)] = acc
+    return prepared, offsets
+
+
+def _sweep_job(kind, detector, prepared, missing, job):
+    # runs every parameter set of a job on its chunk of trials, and returns
+    # the durations of their events, per parameter set
+    offsets, paramsets = job
+    # the chunk as arrays of its own, with offsets from its first sample
+    prepared = prepared[:, offsets[0]:offsets[-1]]
+    offsets = offsets - offsets[0]
+    x, y, time = prepared[0], prepared[1], prepared[2]
+    results = []
+    if kind == 'dispersion':
+        # the windows are computed once for every mindur, hz and window
+        windows = {}
+        for params in paramsets:
+            group = (params['mindur'], params['hz'], params['window'])
+            if group not in windows:
+                windows[group] = detectors._dispersion_windows(x, y, time, offsets, *group)
+            events = detectors._dispersion_fixations(x, y, time, offsets, windows[group], params['maxdist'], True)
+            results.append(_durations(events))
+    elif kind == 'saccade':
+        for params in paramsets:
+            events = []
+            for s, e in zip(offsets[:-1], offsets[1:]):
+                n = e - s
+                events.append(detectors._saccade_events(x[s:e], y[s:e], time[s:e], prepared[3, s:s + max(0, n - 1)],
+                                                        prepared[4, s:s + max(0, n - 2)], params['minlen'],
+                                                        params['maxvel'], params['maxacc'], True))
+            results.append(_durations(events))
+    else:
+        # 'clean' detectors get trials without missing samples, so that
+        # their own removal finds nothing to remove
+        for params in paramsets:
+            events = [detector(x[s:e], y[s:e], time[s:e], missing=missing, table=True, **params)
+                      for s, e in zip(offsets[:-1], offsets[1:])]
+            results.append(_durations(events))
+    return results
+
+
+def _sweep_task(prepared, task):
+    # worker side of sweep, on the prepared samples in shared memory
+    kind, detector, missing, job = task
+    return _sweep_job(kind, detector, prepared, missing, job)
+
+
+def _durations(events):
+    # durations of the ending events (the second value a detector returns)
+    # of all trials
+    if not events:
+        return numpy.zeros(0)
+    return numpy.concatenate([result[1]['duration'] for result in events])
+
+
+def _summarise(paramsets, requested, durations, ntrials):
+    # results table with the requested parameters and the summary fields
+    names = list(requested[0].keys())
+    fields = []
+    for name in names:
+        values = numpy.array([params[name] for params in paramsets])
+        fields.append((name, values.dtype))
+    results = numpy.zeros(len(paramsets), dtype=fields + SUMMARY_FIELDS)
+    for row, (params, dur) in enumerate(zip(paramsets, durations)):
+        nonempty = len(dur) > 0
+        results[row] = tuple([params[name] for name in names]
+                             + [ntrials, len(dur), len(dur) / ntrials if ntrials else numpy.nan,
+                                numpy.mean(dur) if nonempty else numpy.nan,
+                                numpy.median(dur) if nonempty else numpy.nan,
+                                numpy.std(dur) if nonempty else numpy.nan,
+                                numpy.sum(dur)])
+    return results